@@ -1,14 +1,22 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, abort
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, abort, Response, stream_with_context
 from flask_session import Session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 import PyPDF2
-from funcs import chat, load_llm, load_llm1, MODEL_NAME
+from funcs import env, chat, chat_stream, run_llm_task, load_llm, get_response_cache, MODEL_NAME, router, telemetry, upstream
+import asyncio
+import json
+import re
 import shutil
 import os
 
 # Import database and auth modules
 import db
+import lessons
+import study_guide_index
+from speculation import Speculator
+from prompts import Section, build_prompt, truncate_text, PDF_CONTEXT_TOKENS
+from upstream import INTERACTIVE, UpstreamUnavailable, priority_scope
 from models import User
 from auth import register_user, login_user_auth
 
@@ -32,6 +40,21 @@ def load_user(user_id):
     """Load user by ID for Flask-Login"""
     return User.get(int(user_id))
 
+# Idle SQLite connections kept for reuse across requests and background workers,
+# and the runtime profile (WAL, busy timeout, cache sizing) applied to each one
+db.configure_connections(
+    env.int("DB_POOL_SIZE", 8),
+    profile={
+        'journal_mode': env.str("DB_JOURNAL_MODE", "WAL"),
+        'synchronous': env.str("DB_SYNCHRONOUS", "NORMAL"),
+        'busy_timeout': env.int("DB_BUSY_TIMEOUT_MS", 5000),
+        'mmap_size': env.int("DB_MMAP_SIZE_MB", 256) * 2 ** 20,
+        'cache_size': -env.int("DB_CACHE_SIZE_MB", 32) * 2 ** 10,
+        'temp_store': env.str("DB_TEMP_STORE", "MEMORY"),
+    },
+    checkpoint_interval=env.float("DB_CHECKPOINT_INTERVAL", 300.0)
+)
+
 # Initialize database on startup
 try:
     db.init_database()
@@ -40,6 +63,36 @@ except Exception as e:
     print(f"Database already initialized or error: {e}")
 
 
+@app.before_request
+def open_connection_scope():
+    """db calls made while handling a request share one pooled connection"""
+    db.begin_connection_scope()
+
+
+@app.teardown_request
+def close_connection_scope(exception=None):
+    db.end_connection_scope()
+
+
+def upstream_unavailable_response(e):
+    """503 with Retry-After for a call the upstream guard failed fast"""
+    response = jsonify({
+        'status': 'error',
+        'error': 'upstream_unavailable',
+        'message': 'OLEG is overloaded right now, please try again shortly',
+        'retry_after': round(e.retry_after, 1)
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(int(e.retry_after + 0.999), 1))
+    return response
+
+
+@app.errorhandler(UpstreamUnavailable)
+def handle_upstream_unavailable(e):
+    print(f"LLM call rejected: {e}")
+    return upstream_unavailable_response(e)
+
+
 # ==================
 # AUTHENTICATION ROUTES
 # ==================
@@ -126,6 +179,7 @@ def index():
 @login_required
 def new_course():
     session.pop('chat_history', None)
+    speculator.discard(current_user.id)
     return render_template('new_course.html')
 
 
@@ -137,8 +191,10 @@ def send():
     if 'chat_history' not in session:
         session['chat_history'] = []
 
-    bot_response, updated_chat_history = generate_bot_response(user_message, session['chat_history'])
+    with priority_scope(INTERACTIVE):
+        bot_response, updated_chat_history = generate_bot_response(user_message, session['chat_history'])
     session['chat_history'] = updated_chat_history
+    speculate_course_materials(current_user.id, updated_chat_history)
 
     # Check if we should show duration selector
     message_count = len([m for m in updated_chat_history if m.startswith('user:')])
@@ -150,10 +206,68 @@ def send():
     })
 
 
+def sse_event(data, event=None):
+    """Format one Server-Sent Events message"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+@app.route('/send_stream', methods=['POST'])
+@login_required
+def send_stream():
+    """Same as /send, but forwards OLEG's reply token by token as Server-Sent Events"""
+    user_message = request.json.get('formdata')
+    chat_history = list(session.get('chat_history', []))
+    prompt = build_bot_prompt(user_message, chat_history)
+    user_id = current_user.id
+
+    def generate():
+        reply = ""
+        try:
+            with priority_scope(INTERACTIVE):
+                for delta in chat_stream(
+                    model=load_llm("generate_bot_response"),
+                    messages=[{"role": "user", "content": prompt}],
+                    options=BOT_RESPONSE_OPTIONS,
+                    use_cache=False,
+                    call_site="generate_bot_response"
+                ):
+                    reply += delta
+                    yield sse_event({'delta': delta})
+        except UpstreamUnavailable as e:
+            yield sse_event({'error': 'OLEG is overloaded right now, please try again shortly',
+                             'retry_after': round(e.retry_after, 1)}, event='error')
+            return
+        except Exception as e:
+            print(f"Error streaming chat response: {e}")
+            yield sse_event({'error': 'Error generating response'}, event='error')
+            return
+
+        updated_chat_history = record_bot_response(reply, chat_history)
+        session['chat_history'] = updated_chat_history
+        # Headers (and the session) were already sent before streaming started,
+        # so write the server-side session explicitly once the reply is complete
+        app.session_interface.save_session(app, session, Response())
+        speculate_course_materials(user_id, updated_chat_history)
+
+        message_count = len([m for m in updated_chat_history if m.startswith('user:')])
+        yield sse_event({
+            'response': reply,
+            'show_duration_selector': message_count >= 3
+        }, event='done')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/clear', methods=['POST'])
 @login_required
 def clear_chat():
     session.pop('chat_history', None)
+    speculator.discard(current_user.id)
     return jsonify({'status': 'success'})
 
 
@@ -176,8 +290,13 @@ def handle_finish():
     if not chat_history:
         return jsonify({'status': 'error', 'message': 'No conversation history found'}), 400
 
-    # Extract course name with minimal context
-    course_name = extract_course_name(chat_history)
+    # Course name, study guide and schedule (independent calls run concurrently),
+    # reusing what was started speculatively for this conversation
+    speculative = speculator.take(current_user.id, chat_history)
+    print(f"DEBUG: Speculative results {'reused' if speculative else 'not available'}")
+    course_name, study_guide, schedule = asyncio.run(
+        generate_course_materials(chat_history, duration_weeks, speculative)
+    )
     course_name = course_name.strip().replace('\n', ' ').replace('"', '').replace("'", "")
 
     if course_name.lower().startswith('assistant:'):
@@ -185,14 +304,6 @@ def handle_finish():
 
     print(f"DEBUG: Generated course name: '{course_name}'")
 
-    # Generate study guide (ONE API call)
-    print("Generating study guide...")
-    study_guide = generate_study_guide(chat_history)
-
-    # Generate complete schedule (ONE API call instead of 20!)
-    print(f"Generating {duration_weeks}-week schedule...")
-    schedule = generate_complete_schedule(study_guide, duration_weeks)
-
     # Save to database
     try:
         # Calculate start date (next Monday from today)
@@ -214,6 +325,13 @@ def handle_finish():
         )
         print(f"DEBUG: Created course with ID {course_id}, start date: {start_date}")
 
+        # Index the study guide so lesson prompts only get the relevant topics
+        try:
+            chunks = study_guide_index.index_study_guide(course_id, study_guide)
+            print(f"DEBUG: Indexed study guide into {len(chunks)} chunks")
+        except Exception as e:
+            print(f"Error indexing study guide: {e}")  # Lessons index it on first use instead
+
         # Parse and save activities
         from funcs import parse_schedule_to_activities
         activities = parse_schedule_to_activities(schedule, course_id, start_date)
@@ -231,6 +349,9 @@ def handle_finish():
         # Initialize streak record
         db.initialize_user_streak(current_user.id, course_id)
 
+        # Start generating the first week (one batched LLM call) so its days open instantly
+        lessons.prefetch_week(course_id, 1)
+
         # Clear chat history from session
         session.pop('chat_history', None)
 
@@ -299,11 +420,14 @@ def get_file():
 
         # Preprocess text
         text = text.replace("\n", " ").replace("\t", " ")
-        text = text[:3000]  # Limit to first 3000 chars to avoid huge context
+        text = truncate_text(text, PDF_CONTEXT_TOKENS)  # Whole sentences, within the token budget
         text += " [PDF file content]"
 
-        bot_response, updated_chat_history = generate_bot_response(text, session.get('chat_history', []))
+        # A chat reply the user is waiting on, like /send
+        with priority_scope(INTERACTIVE):
+            bot_response, updated_chat_history = generate_bot_response(text, session.get('chat_history', []))
         session['chat_history'] = updated_chat_history
+        speculate_course_materials(current_user.id, updated_chat_history)
 
         return jsonify({'response': bot_response})
     except Exception as e:
@@ -325,55 +449,47 @@ def clear_courses():
         return redirect('/')
 
 
-# Load model names
-model_l70 = load_llm()
-model_l70_1 = load_llm1()
-
-
 def extract_course_name(chat_history):
     """Extract course name with minimal context"""
-    # Only use last 6 messages for context
-    recent_history = chat_history[-6:] if len(chat_history) > 6 else chat_history
-
-    prompt = f"""Based on this conversation, extract ONLY the course subject name in maximum 2 words.
+    # Recent messages within the token budget, plus the first one (usually names the subject)
+    prompt = build_prompt('extract_course_name', lambda history: f"""Based on this conversation, extract ONLY the course subject name in maximum 2 words.
 Output ONLY the course name, nothing else.
 
 Recent conversation:
-{chr(10).join(recent_history)}
+{history}
 
-Course name (2 words max):"""
+Course name (2 words max):""", history=Section(chat_history, keep='tail', pin_first=True))
 
     generated_text = chat(
-        model=model_l70,
+        model=load_llm("extract_course_name"),
         messages=[{"role": "user", "content": prompt}],
-        options={"max_tokens": 50, "temperature": 0.3}
+        options={"max_tokens": 50, "temperature": 0.3},
+        call_site="extract_course_name"
     )
 
     return generated_text.strip()
 
 
 def summarize_course_content(chat_history):
-    """Summarize chat history to reduce token usage"""
+    """Summarize chat history to reduce token usage; returns the messages to keep"""
     if len(chat_history) <= 10:
-        return chr(10).join(chat_history)
+        return chat_history
 
     # Extract key information from chat
     user_messages = [msg for msg in chat_history if msg.startswith('user:')]
 
     # Take first 3 and last 3 user messages
-    key_messages = user_messages[:3] + user_messages[-3:]
-
-    return chr(10).join(key_messages)
+    return user_messages[:3] + user_messages[-3:]
 
 
 def generate_study_guide(chat_history):
     """Generate study guide with summarized context"""
     # Summarize chat history instead of sending everything
-    course_summary = summarize_course_content(chat_history)
+    course_summary = Section(summarize_course_content(chat_history), keep='tail', pin_first=True)
 
-    prompt = f"""You are OLEG, an educational assistant. Create a comprehensive study guide based on this course information:
+    prompt = build_prompt('generate_study_guide', lambda summary: f"""You are OLEG, an educational assistant. Create a comprehensive study guide based on this course information:
 
-{course_summary}
+{summary}
 
 Create a structured study guide with these sections for each major topic (minimum 3 topics):
 
@@ -394,77 +510,249 @@ Create a structured study guide with these sections for each major topic (minimu
 * Book/Article 1
 * Book/Article 2
 
-Repeat this structure for all major topics in the course. Format everything clearly."""
+Repeat this structure for all major topics in the course. Format everything clearly.""", summary=course_summary)
 
     generated_text = chat(
-        model=model_l70_1,
+        model=load_llm("generate_study_guide"),
         messages=[{"role": "user", "content": prompt}],
-        options={"max_tokens": 4000, "temperature": 0.7}
+        options={"max_tokens": 4000, "temperature": 0.7},
+        call_site="generate_study_guide"
     )
 
     return generated_text
 
 
-def generate_complete_schedule(study_guide, duration_weeks=20):
-    """Generate entire schedule in ONE API call"""
+# Segmented schedule generation: weeks per LLM call and retries for short segments
+SCHEDULE_SEGMENT_WEEKS = env.int("SCHEDULE_SEGMENT_WEEKS", 4)
+SCHEDULE_SEGMENT_RETRIES = env.int("SCHEDULE_SEGMENT_RETRIES", 2)
+
+DAY_LINE_PATTERN = re.compile(r'[-•*]?\s*Day\s*(\d+)\s*[:\-]\s*(.+)', re.IGNORECASE)
+OUTLINE_LINE_PATTERN = re.compile(r'Week\s*(\d+)\s*[:\-]\s*(.+)', re.IGNORECASE)
+
 
-    # Limit study guide context to avoid token overflow
-    study_guide_summary = study_guide[:2500] if len(study_guide) > 2500 else study_guide
+def extract_day_texts(schedule_text):
+    """Return the activity text of every "Day X: ..." line, in order"""
+    day_texts = []
+    for line in schedule_text.split('\n'):
+        day_match = DAY_LINE_PATTERN.search(line.strip())
+        if day_match:
+            day_texts.append(day_match.group(2).strip())
+    return day_texts
 
-    total_days = duration_weeks * 7
 
-    prompt = f"""You are OLEG. Based on this study guide, create a COMPLETE {duration_weeks}-week study schedule.
+def generate_schedule_outline(study_guide, duration_weeks):
+    """
+    One short call returning a theme per week, shared by every schedule
+    segment so separately generated weeks still follow one progression
+    Returns dict week_number -> theme
+    """
+    prompt = build_prompt('generate_schedule_outline', lambda guide: f"""You are OLEG. Based on this study guide, plan the weekly themes of a {duration_weeks}-week course.
 
 Study Guide:
-{study_guide_summary}
+{guide}
+
+Write exactly {duration_weeks} lines, one per week, in this format:
+Week 1: [Theme of week 1]
+Week 2: [Theme of week 2]
+...
+Week {duration_weeks}: [Theme of week {duration_weeks}]
+
+Build from fundamentals to advanced topics and leave room for review. Output ONLY the lines.""", guide=Section(study_guide))
+
+    generated_text = chat(
+        model=load_llm("generate_schedule_outline"),
+        messages=[{"role": "user", "content": prompt}],
+        options={"max_tokens": min(40 * duration_weeks + 100, 2000), "temperature": 0.5},
+        call_site="generate_schedule_outline"
+    )
+
+    outline = {}
+    for line in generated_text.split('\n'):
+        week_match = OUTLINE_LINE_PATTERN.search(line.replace('*', ''))
+        if week_match:
+            week = int(week_match.group(1))
+            if 1 <= week <= duration_weeks:
+                outline.setdefault(week, week_match.group(2).strip())
+
+    for week in range(1, duration_weeks + 1):
+        outline.setdefault(week, "Review and practice")
+
+    return outline
+
+
+def generate_schedule_segment(study_guide, outline, first_week, last_week, duration_weeks):
+    """
+    Generate the days of weeks first_week..last_week. Segments that come back
+    short are retried; whatever is still missing after that is filled with
+    review days so the course never ends up truncated.
+    Returns list of day texts (7 per week)
+    """
+    num_weeks = last_week - first_week + 1
+    expected_days = num_weeks * 7
+    first_day = (first_week - 1) * 7 + 1
+    last_day = last_week * 7
+
+    outline_text = chr(10).join(f"Week {week}: {theme}" for week, theme in sorted(outline.items()))
+
+    prompt = build_prompt('generate_schedule_segment', lambda guide: f"""You are OLEG. Based on this study guide, write weeks {first_week}-{last_week} of a {duration_weeks}-week study schedule.
+
+Study Guide:
+{guide}
+
+Course outline (keep these weeks consistent with it):
+{outline_text}
 
 CRITICAL FORMATTING REQUIREMENTS:
-- You MUST create exactly {duration_weeks} weeks
-- Each week MUST have exactly 7 days
-- EVERY day must start with "- Day X:" or "Day X:" (where X is the day number starting from 1)
+- Write ONLY weeks {first_week} to {last_week} ({expected_days} days)
+- Start each week with a "**Week N**" header; each week MUST have exactly 7 days
+- Number days continuously from Day {first_day} to Day {last_day}
+- EVERY day line must start with "- Day X:"
 - Include time duration for each day (e.g., "30 min", "45 min", "1 hour")
 - Maximum 1 hour of study per day
 
 Example format (FOLLOW THIS EXACTLY):
 
-**Week 1**
-- Day 1: Introduction to [Topic] (30 min)
-- Day 2: Study [Subtopic] (45 min)
-- Day 3: Practice [Concept] (1 hour)
-- Day 4: Review [Material] (30 min)
-- Day 5: Deep dive into [Topic] (1 hour)
-- Day 6: Study [Resource] (45 min)
-- Day 7: Weekly review (30 min)
-
-**Week 2**
-- Day 8: [Next Topic] (45 min)
-- Day 9: [Continue...] (30 min)
-...continue with Days 10-14
+**Week {first_week}**
+- Day {first_day}: Introduction to [Topic] (30 min)
+- Day {first_day + 1}: Study [Subtopic] (45 min)
+...continue to Day {last_day}
+
+Generate weeks {first_week}-{last_week} now:""", guide=Section(study_guide))
+
+    best_days = []
+    for attempt in range(SCHEDULE_SEGMENT_RETRIES + 1):
+        generated_text = chat(
+            model=load_llm("generate_schedule_segment"),
+            messages=[{"role": "user", "content": prompt}],
+            options={"max_tokens": min(350 * num_weeks + 200, 5000), "temperature": 0.7},
+            use_cache=attempt == 0,  # A retry must not get the same short answer back from the cache
+            call_site="generate_schedule_segment"
+        )
+        day_texts = extract_day_texts(generated_text)
+        if len(day_texts) > len(best_days):
+            best_days = day_texts
+        if len(best_days) >= expected_days:
+            break
+        print(f"Schedule segment weeks {first_week}-{last_week}: got {len(day_texts)}/{expected_days} days (attempt {attempt + 1})")
+
+    best_days = best_days[:expected_days]
+    for index in range(len(best_days), expected_days):
+        week = first_week + index // 7
+        best_days.append(f"Review: {outline[week]} (30 min)")
+
+    return best_days
+
+
+async def generate_complete_schedule(study_guide, duration_weeks=20):
+    """
+    Generate the schedule in segments of SCHEDULE_SEGMENT_WEEKS weeks that run
+    concurrently, then stitch them together with continuous day numbers.
+    Wall-clock time follows the segment length instead of the course length.
+    """
+
+    segment_weeks = max(1, SCHEDULE_SEGMENT_WEEKS)
+    segments = [
+        (first_week, min(first_week + segment_weeks - 1, duration_weeks))
+        for first_week in range(1, duration_weeks + 1, segment_weeks)
+    ]
+
+    # A single segment needs no outline to stay consistent with other segments
+    if len(segments) > 1:
+        outline = await run_llm_task(generate_schedule_outline, study_guide, duration_weeks)
+    else:
+        outline = {week: "Review and practice" for week in range(1, duration_weeks + 1)}
+
+    segment_days = await asyncio.gather(*[
+        run_llm_task(generate_schedule_segment, study_guide, outline,
+                     first_week, last_week, duration_weeks)
+        for first_week, last_week in segments
+    ])
+
+    # Stitch segments together, renumbering days continuously
+    all_days = [day_text for days in segment_days for day_text in days]
+    lines = []
+    for index, day_text in enumerate(all_days):
+        if index % 7 == 0:
+            if lines:
+                lines.append("")
+            lines.append(f"**Week {index // 7 + 1}**")
+        lines.append(f"- Day {index + 1}: {day_text}")
+
+    return chr(10).join(lines)
+
+
+# Speculative course generation: once the intake conversation has this many user
+# messages (when OLEG suggests finishing), the course name and study guide start
+# in the background and /finish reuses them if the user hasn't said anything new
+SPECULATIVE_GENERATION_ENABLED = env.bool("SPECULATIVE_GENERATION_ENABLED", True)
+SPECULATIVE_MIN_MESSAGES = env.int("SPECULATIVE_MIN_MESSAGES", 4)
+
+speculator = Speculator(
+    enabled=SPECULATIVE_GENERATION_ENABLED,
+    max_workers=env.int("SPECULATIVE_WORKERS", 4),
+    ttl=env.float("SPECULATIVE_TTL", 900.0)
+)
+
+
+def speculate_course_materials(user_id, chat_history):
+    """Start the course name and study guide for the conversation so far, once it is complete enough"""
+    message_count = len([m for m in chat_history if m.startswith('user:')])
+    if message_count < SPECULATIVE_MIN_MESSAGES:
+        return
+
+    if speculator.start(user_id, chat_history, {
+        'course_name': extract_course_name,
+        'study_guide': generate_study_guide
+    }):
+        print(f"Speculatively generating course materials for user {user_id} ({message_count} messages)")
+
+
+async def _speculative_or_run(speculative, name, func, chat_history):
+    """Await the speculative result for name if there is one, otherwise run func"""
+    future = (speculative or {}).get(name)
+    if future is not None and not future.cancelled():
+        try:
+            return await asyncio.wrap_future(future)
+        except Exception as e:
+            print(f"Speculative {name} failed, generating it again: {e}")
+    return await run_llm_task(func, chat_history)
+
+
+async def generate_course_materials(chat_history, duration_weeks=20, speculative=None):
+    """
+    Run the /finish LLM pipeline, overlapping calls that don't depend on each other.
+    The course name only needs the chat history, so it runs alongside the
+    study guide; the schedule has to wait for the finished study guide.
+    speculative holds futures already started for this conversation (see
+    speculate_course_materials), which are awaited instead of calling again.
+    Returns (course_name, study_guide, schedule)
+    """
+    course_name_task = asyncio.create_task(
+        _speculative_or_run(speculative, 'course_name', extract_course_name, chat_history)
+    )
+    try:
+        print("Generating study guide...")
+        study_guide = await _speculative_or_run(speculative, 'study_guide', generate_study_guide, chat_history)
 
-Continue this pattern for ALL {duration_weeks} weeks (Days 1-{total_days}).
+        print(f"Generating {duration_weeks}-week schedule...")
+        schedule = await generate_complete_schedule(study_guide, duration_weeks)
 
-Remember:
-- Day numbers must be continuous (1, 2, 3... up to {total_days})
-- Each day line MUST start with "- Day" or "Day"
-- Include duration in parentheses
+        course_name = await course_name_task
+    except BaseException:
+        course_name_task.cancel()
+        raise
 
-Generate the complete schedule now:"""
+    return course_name, study_guide, schedule
 
-    generated_text = chat(
-        model=model_l70_1,
-        messages=[{"role": "user", "content": prompt}],
-        options={"max_tokens": 8000, "temperature": 0.7}
-    )
 
-    return generated_text
+# Generation options for OLEG's conversational replies
+BOT_RESPONSE_OPTIONS = {"max_tokens": 300, "temperature": 0.7}
 
 
-def generate_bot_response(message, chat_history):
-    """Optimized chat response - only keep recent context"""
+def build_bot_prompt(message, chat_history):
+    """Append the user message to chat_history and build the prompt for OLEG's reply"""
     chat_history.append(f"user: {message}")
 
-    # Only use last 10 messages for context (not entire history!)
-    recent_history = chat_history[-10:] if len(chat_history) > 10 else chat_history
     message_count = len([m for m in chat_history if m.startswith('user:')])
 
     # Determine conversation stage
@@ -478,7 +766,8 @@ def generate_bot_response(message, chat_history):
     elif message_count >= 4:
         stage_hint = "\n\nYou have enough information. Warmly let them know they can click 'Finish Course' to generate their personalized study plan."
 
-    prompt = f"""You are OLEG: A friendly educational assistant collecting information to create personalized study courses.
+    # Only the most recent messages that fit the token budget (not entire history!)
+    prompt = build_prompt('generate_bot_response', lambda history: f"""You are OLEG: A friendly educational assistant collecting information to create personalized study courses.
 
 Your conversation style:
 - Ask ONE clear question at a time (not multiple questions)
@@ -489,22 +778,39 @@ Your conversation style:
 IMPORTANT: You're collecting requirements, NOT teaching yet. The actual learning content will be generated when they click "Finish Course".{stage_hint}
 
 Recent conversation:
-{chr(10).join(recent_history)}
+{history}
 
-Respond with ONE question (keep it brief and natural):"""
+Respond with ONE question (keep it brief and natural):""", history=Section(chat_history, keep='tail', pin_first=True))
 
-    generated_text = chat(
-        model=model_l70,
-        messages=[{"role": "user", "content": prompt}],
-        options={"max_tokens": 300, "temperature": 0.7}
-    )
+    return prompt
 
+
+def record_bot_response(generated_text, chat_history):
+    """Append OLEG's reply to chat_history and trim it; returns the trimmed history"""
     chat_history.append(f"assistant: {generated_text}")
 
     # Keep only last 20 messages in session to prevent memory bloat
     if len(chat_history) > 20:
         chat_history = chat_history[-20:]
 
+    return chat_history
+
+
+def generate_bot_response(message, chat_history):
+    """Optimized chat response - only keep recent context"""
+    prompt = build_bot_prompt(message, chat_history)
+
+    # Conversational replies bypass the response cache so repeated questions get fresh answers
+    generated_text = chat(
+        model=load_llm("generate_bot_response"),
+        messages=[{"role": "user", "content": prompt}],
+        options=BOT_RESPONSE_OPTIONS,
+        use_cache=False,
+        call_site="generate_bot_response"
+    )
+
+    chat_history = record_bot_response(generated_text, chat_history)
+
     return generated_text, chat_history
 
 
@@ -523,6 +829,9 @@ def get_calendar(course_id, year, month):
     from datetime import date
     calendar_data = db.get_calendar_data(current_user.id, course_id, year, month)
 
+    # Warm up the next lessons while the user looks at the calendar
+    lessons.prefetch_upcoming(course_id)
+
     return jsonify(calendar_data)
 
 
@@ -569,34 +878,29 @@ def get_daily_lesson(course_id, date_str):
         # Get course for study guide context
         course = db.get_course_by_id(course_id)
 
-        # Generate content for activities that don't have it yet
-        from funcs import generate_task_content, load_llm
-        model = load_llm()
+        # Start generating content for activities that don't have it yet, in
+        # parallel; anything unfinished at the request deadline (by default
+        # straight away) is reported as pending and streamed by the page
+        with priority_scope(INTERACTIVE):
+            contents, errors = lessons.ensure_activities_content(activities, course)
+        pending_activities = []
+        failed_activities = []
 
         for activity in activities:
-            # Check if content needs to be generated
-            if not activity.get('content_generated'):
-                # Generate content based on activity type
-                content = generate_task_content(
-                    task_title=activity['title'],
-                    task_type=activity['activity_type'],
-                    study_guide_summary=course['study_guide'][:2000],  # First 2000 chars
-                    model=model
-                )
-
-                # Update the activity with generated content
-                db.update_activity_content(
-                    activity['id'],
-                    theory_content=content.get('theory_content'),
-                    test_questions=content.get('test_questions'),
-                    test_solutions=content.get('test_solutions')
-                )
-
-                # Update the activity dict
-                activity['theory_content'] = content.get('theory_content')
-                activity['test_questions'] = content.get('test_questions')
-                activity['test_solutions'] = content.get('test_solutions')
-                activity['content_generated'] = 1
+            if activity['id'] in errors:
+                # Already failed: reported as such, not streamed as if still running
+                failed_activities.append(activity['id'])
+                continue
+            content = contents.get(activity['id'])
+            if content is None:
+                pending_activities.append(activity['id'])
+                continue
+
+            # Update the activity dict
+            activity['theory_content'] = content.get('theory_content')
+            activity['test_questions'] = content.get('test_questions')
+            activity['test_solutions'] = content.get('test_solutions')
+            activity['content_generated'] = 1
 
         # Collect all content and determine lesson type
         lesson_data = {
@@ -608,7 +912,9 @@ def get_daily_lesson(course_id, date_str):
             'activities': activities,
             'lesson_title': None,
             'steps': [],
-            'completed': all(act['completed_at'] for act in activities)
+            'completed': all(act['completed_at'] for act in activities),
+            'pending_activities': pending_activities,
+            'failed_activities': failed_activities
         }
 
         # Determine lesson title from first activity
@@ -616,6 +922,9 @@ def get_daily_lesson(course_id, date_str):
             first_activity = activities[0]
             lesson_data['lesson_title'] = first_activity['title']
 
+        # Pre-generate the following lessons in the background
+        lessons.prefetch_after(course_id, target_date)
+
         return jsonify(lesson_data)
 
     except ValueError:
@@ -643,7 +952,6 @@ def complete_task(course_id, task_id):
         # Update daily progress and streak
         target_date = date.fromisoformat(activity['scheduled_date'])
         db.update_daily_progress(current_user.id, course_id, target_date)
-        db.update_streak_record(current_user.id, course_id)
 
         return jsonify({'status': 'success', 'message': 'Task marked as complete'})
     else:
@@ -670,7 +978,6 @@ def incomplete_task(course_id, task_id):
         # Update daily progress and streak
         target_date = date.fromisoformat(activity['scheduled_date'])
         db.update_daily_progress(current_user.id, course_id, target_date)
-        db.update_streak_record(current_user.id, course_id)
 
         return jsonify({'status': 'success', 'message': 'Task marked as incomplete'})
     else:
@@ -744,7 +1051,8 @@ def debug_course(course_id):
         'start_date': course.get('start_date'),
         'total_activities': len(activities),
         'schedule_preview': course['schedule_data'][:1000] if course['schedule_data'] else 'No schedule',
-        'activities': [dict(a) for a in activities][:10]  # First 10 activities
+        'activities': [dict(a) for a in activities][:10],  # First 10 activities
+        'content_library': lessons.content_library_stats()
     })
 
 
@@ -771,28 +1079,12 @@ def get_task_content(course_id, task_id):
 
     # Generate content on-demand
     try:
-        from funcs import generate_task_content, load_llm
-
         # Get course for study guide
         course = db.get_course_by_id(course_id)
-        study_guide_summary = course['study_guide'][:1500] if len(course['study_guide']) > 1500 else course['study_guide']
-
-        # Generate content
-        model = load_llm()
-        content = generate_task_content(
-            task_title=activity['title'],
-            task_type=activity['activity_type'],
-            study_guide_summary=study_guide_summary,
-            model=model
-        )
 
-        # Update task in database
-        db.update_activity_content(
-            activity_id=task_id,
-            theory_content=content['theory_content'],
-            test_questions=content['test_questions'],
-            test_solutions=content['test_solutions']
-        )
+        # Generate content and update task in database (shared with any concurrent request for it)
+        with priority_scope(INTERACTIVE):
+            lessons.ensure_activity_content(activity, course)
 
         # Get updated activity
         updated_activity = db.get_activity_by_id(task_id)
@@ -802,10 +1094,83 @@ def get_task_content(course_id, task_id):
             'generated': True
         })
 
+    except UpstreamUnavailable as e:
+        return upstream_unavailable_response(e)
     except Exception as e:
         print(f"Error generating task content: {e}")
         return jsonify({'error': 'Failed to generate content'}), 500
 
 
+@app.route('/api/course/<int:course_id>/task/<int:task_id>/content_stream', methods=['GET'])
+@login_required
+def stream_task_content(course_id, task_id):
+    """Same as /content, but sends each lesson step / test question as Server-Sent Events as soon as it is generated"""
+    # Verify ownership
+    if not db.verify_course_ownership(course_id, current_user.id):
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    activity = db.get_activity_by_id(task_id)
+
+    if not activity or activity['course_id'] != course_id:
+        return jsonify({'error': 'Task not found'}), 404
+
+    course = db.get_course_by_id(course_id)
+
+    def generate():
+        try:
+            with priority_scope(INTERACTIVE):
+                for event in lessons.stream_activity_content(activity, course):
+                    if event[0] == 'item':
+                        _, key, index, item = event
+                        yield sse_event({'key': key, 'index': index, 'item': item}, event='item')
+        except UpstreamUnavailable as e:
+            yield sse_event({'error': 'upstream_unavailable', 'retry_after': round(e.retry_after, 1)}, event='error')
+            return
+        except Exception as e:
+            print(f"Error streaming task content: {e}")
+            yield sse_event({'error': 'Failed to generate content'}, event='error')
+            return
+
+        yield sse_event({'task': db.get_activity_by_id(task_id), 'generated': True}, event='done')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# ==================
+# MONITORING
+# ==================
+
+@app.route('/metrics')
+def metrics():
+    """
+    LLM call metrics in Prometheus text format
+    Deliberately left without login so Prometheus can scrape it; it holds
+    aggregate counters only. Restrict it at the reverse proxy if needed.
+    """
+    body = telemetry.render_prometheus() + upstream.render_prometheus() + speculator.render_prometheus()
+    cache = get_response_cache()
+    if cache is not None:
+        body += cache.render_prometheus()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/upstream/status')
+@login_required
+def upstream_status():
+    """Circuit breaker and adaptive concurrency limiter state"""
+    return jsonify(upstream.status())
+
+
+@app.route('/api/llm/routing')
+@login_required
+def llm_routing():
+    """Model tier of each call site, with tier models, timeouts and fallbacks"""
+    return jsonify(router.status())
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
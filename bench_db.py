@@ -0,0 +1,153 @@
+"""
+SQLite throughput benchmark for the connection runtime profile
+Runs several worker processes (like multiple app workers on one box) against
+a fresh copy of the schema, each mixing task completions (mark complete +
+daily progress upsert) with lesson page reads, once with the legacy settings
+(rollback journal, synchronous=FULL) and once with the tuned profile from db.py.
+
+Usage:
+    python bench_db.py --workers 4 --duration 10 --write-ratio 0.3
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+import db
+
+# The settings get_db_connection() used before the runtime profile
+LEGACY_PROFILE = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+PROFILES = {
+    'legacy': LEGACY_PROFILE,
+    'tuned': db.SQLITE_PROFILE,
+}
+
+ACTIVITIES_PER_COURSE = 140
+
+
+def seed(path: str, courses: int):
+    """Create the schema and one user with a 20-week course per worker"""
+    db.DATABASE_PATH = path
+    db.configure_connections(2, profile={}, checkpoint_interval=0)
+    db.init_database()
+
+    user_id = db.create_user('bench', 'bench@example.com', 'x')
+    start = date.today() - timedelta(days=ACTIVITIES_PER_COURSE // 2)
+    course_ids = []
+    for number in range(courses):
+        course_id = db.create_course(user_id, f'Course {number}', 'guide', 'schedule', 20, start)
+        db.bulk_create_activities([
+            {
+                'course_id': course_id, 'week_number': day // 7 + 1, 'day_number': day + 1,
+                'day_of_week': day % 7 + 1, 'scheduled_date': start + timedelta(days=day),
+                'title': f'Day {day + 1}', 'description': 'Study', 'duration_minutes': 30,
+                'activity_type': 'study'
+            }
+            for day in range(ACTIVITIES_PER_COURSE)
+        ])
+        course_ids.append(course_id)
+    return user_id, course_ids
+
+
+def worker(path, profile_name, user_id, course_id, duration, write_ratio, seed_value, results):
+    """One app worker: completions and reads until the deadline"""
+    db.DATABASE_PATH = path
+    db.configure_connections(4, profile=PROFILES[profile_name], checkpoint_interval=0)
+    rng = random.Random(seed_value)
+    activities = db.get_activities_by_course(course_id)
+
+    stats = {'reads': 0, 'writes': 0, 'locked': 0, 'read_latency': [], 'write_latency': []}
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        activity = rng.choice(activities)
+        target_date = date.fromisoformat(activity['scheduled_date'])
+        started = time.perf_counter()
+        try:
+            with db.connection_scope():
+                if rng.random() < write_ratio:
+                    if rng.random() < 0.5:
+                        db.mark_activity_complete(activity['id'])
+                    else:
+                        db.mark_activity_incomplete(activity['id'])
+                    db.update_daily_progress(user_id, course_id, target_date)
+                    kind = 'write'
+                else:
+                    db.get_activities_for_date(course_id, target_date)
+                    db.get_daily_progress(user_id, course_id, target_date)
+                    db.get_user_streak(user_id, course_id)
+                    kind = 'read'
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            stats['locked'] += 1
+            continue
+        stats[f'{kind}_latency'].append(time.perf_counter() - started)
+        stats[f'{kind}s'] += 1
+
+    results.put(stats)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(profile_name: str, workers: int, duration: float, write_ratio: float) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        user_id, course_ids = seed(path, workers)
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(
+                path, profile_name, user_id, course_ids[number], duration, write_ratio, number, results
+            ))
+            for number in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    total = {'reads': 0, 'writes': 0, 'locked': 0, 'read_latency': [], 'write_latency': []}
+    for stats in collected:
+        for key in total:
+            total[key] += stats[key]
+
+    return {
+        'profile': profile_name,
+        'reads_per_sec': total['reads'] / duration,
+        'writes_per_sec': total['writes'] / duration,
+        'locked': total['locked'],
+        'read_p95_ms': percentile(total['read_latency'], 0.95) * 1000,
+        'write_p95_ms': percentile(total['write_latency'], 0.95) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite throughput under concurrent writers, legacy vs tuned profile')
+    parser.add_argument('--workers', type=int, default=4, help='Worker processes (default 4)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per profile (default 10)')
+    parser.add_argument('--write-ratio', type=float, default=0.3, help='Fraction of operations that write (default 0.3)')
+    parser.add_argument('--profile', choices=['legacy', 'tuned', 'both'], default='both')
+    args = parser.parse_args()
+
+    names = ['legacy', 'tuned'] if args.profile == 'both' else [args.profile]
+    print(f"{args.workers} workers, {args.duration:g}s per profile, {args.write_ratio:.0%} writes")
+    print(f"{'profile':<8} {'reads/s':>9} {'writes/s':>9} {'locked':>7} {'read p95 ms':>12} {'write p95 ms':>13}")
+    for name in names:
+        result = run(name, args.workers, args.duration, args.write_ratio)
+        print(f"{result['profile']:<8} {result['reads_per_sec']:>9.0f} {result['writes_per_sec']:>9.0f} "
+              f"{result['locked']:>7} {result['read_p95_ms']:>12.2f} {result['write_p95_ms']:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Check the query plans of the hot course page queries
+Builds a throwaway database from the migrations and asserts, via EXPLAIN
+QUERY PLAN, that each query seeks the expected index rather than scanning
+a table or sorting in a temporary b-tree. Exits non-zero on a regression.
+
+Usage:
+    python check_query_plans.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+import db
+import migrate_db
+
+# query name -> (SQL, parameters, index searches the plan must contain)
+CHECKS = {
+    'calendar': (
+        db.CALENDAR_QUERY,
+        (1, 1, *db.month_range(2025, 1)),
+        [
+            'SEARCH a USING COVERING INDEX idx_activities_course_date (course_id=? AND scheduled_date>? AND scheduled_date<?)',
+            'SEARCH ac USING COVERING INDEX sqlite_autoindex_activity_completions_1 (activity_id=?)',
+            'SEARCH dp USING INDEX sqlite_autoindex_daily_progress_1 (user_id=? AND course_id=? AND date=?)',
+        ]
+    ),
+    'monthly_progress': (
+        db.MONTHLY_PROGRESS_QUERY,
+        (1, 1, *db.month_range(2025, 1)),
+        [
+            'SEARCH daily_progress USING INDEX sqlite_autoindex_daily_progress_1 (user_id=? AND course_id=? AND date>? AND date<?)',
+        ]
+    ),
+}
+
+# Plan steps that mean the query reads more than the rows it needs
+FORBIDDEN = ('SCAN ', 'USE TEMP B-TREE')
+
+
+def query_plan(conn: sqlite3.Connection, sql: str, params) -> list:
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def check(conn: sqlite3.Connection) -> bool:
+    ok = True
+    for name, (sql, params, expected) in CHECKS.items():
+        plan = query_plan(conn, sql, params)
+        problems = [f"missing: {step}" for step in expected if not any(line.startswith(step) for line in plan)]
+        problems += [f"unexpected: {line}" for line in plan if line.startswith(FORBIDDEN)]
+
+        print(f"[{'OK' if not problems else 'FAIL'}] {name}")
+        for line in plan:
+            print(f"       {line}")
+        for problem in problems:
+            print(f"       {problem}")
+        ok = ok and not problems
+    return ok
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        conn = sqlite3.connect(os.path.join(directory, 'plans.db'))
+        try:
+            migrate_db.migrate(conn)
+            ok = check(conn)
+        finally:
+            conn.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Cross-user lesson content library
+Generated lessons are stored under a normalized task title, the activity kind
+(lesson or test) and a MinHash fingerprint of the course study guide. Before
+generating a lesson we look for a close-enough entry from another course: a
+TF-IDF cosine match on the title plus a MinHash (vocabulary Jaccard) match on
+the study guide. Template titles ("Weekly review", "Introduction") say nothing
+about the lesson and are never matched.
+"""
+import json
+import math
+import re
+import threading
+import zlib
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import db
+
+# MinHash parameters (signature length and the Mersenne prime used for hashing)
+MINHASH_PERMUTATIONS = 64
+_MERSENNE_PRIME = (1 << 61) - 1
+_MINHASH_SEEDS = [
+    (1 + (i * 0x9E3779B97F4A7C15) % (_MERSENNE_PRIME - 1), (i * 0xC2B2AE3D27D4EB4F) % _MERSENNE_PRIME)
+    for i in range(1, MINHASH_PERMUTATIONS + 1)
+]
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'how', 'in', 'into',
+    'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with', 'your', 'this', 'that', 'its'
+}
+
+# Words schedule templates put around the topic; a title needs
+# MIN_TOPIC_TERMS other words to identify a lesson
+TEMPLATE_TERMS = {
+    'introduction', 'intro', 'overview', 'review', 'weekly', 'daily', 'week', 'day', 'practice',
+    'recap', 'summary', 'revision', 'study', 'lesson', 'basics', 'fundamentals', 'exercises',
+    'exercise', 'quiz', 'test', 'checkpoint', 'assessment', 'rest', 'catch', 'up', 'min', 'hour'
+}
+MIN_TOPIC_TERMS = 2
+
+
+# ====================
+# NORMALIZATION AND FINGERPRINTS
+# ====================
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords"""
+    return [t for t in re.findall(r'[a-z0-9]+', text.lower()) if t not in STOPWORDS]
+
+
+def normalize_title(title: str) -> str:
+    """
+    Normalize a task title for matching
+    "Day 1: Introduction to Machine Learning (30 min)" -> "introduction machine learning"
+    """
+    title = re.sub(r'^\W*day\s*\d+\s*[:\-]\s*', '', title, flags=re.IGNORECASE)
+    title = re.sub(r'\(\s*\d+(?:\.\d+)?\s*(?:min|minute|hour|hr)s?\s*\)', '', title, flags=re.IGNORECASE)
+    return ' '.join(tokenize(title))
+
+
+def is_template_title(normalized_title: str) -> bool:
+    """True for titles like "weekly review" or "review practice" that don't name a topic"""
+    topic_terms = [t for t in normalized_title.split() if t not in TEMPLATE_TERMS and not t.isdigit()]
+    return len(topic_terms) < MIN_TOPIC_TERMS
+
+
+def activity_kind(activity_type: str) -> str:
+    """Library entries are shared between activity types that produce the same content shape"""
+    return 'test' if activity_type in ['test', 'checkpoint'] else 'lesson'
+
+
+@lru_cache(maxsize=64)
+def guide_signature(study_guide: str) -> Tuple[int, ...]:
+    """MinHash signature of the study guide vocabulary (cached: one course asks many times)"""
+    tokens = set(tokenize(study_guide))
+    if not tokens:
+        return (0,) * MINHASH_PERMUTATIONS
+
+    hashes = [zlib.crc32(token.encode('utf-8')) for token in tokens]
+    return tuple(
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+        for a, b in _MINHASH_SEEDS
+    )
+
+
+def signature_similarity(sig_a: Sequence[int], sig_b: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    if not sig_a or len(sig_a) != len(sig_b):
+        return 0.0
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+def is_reusable(content: Dict) -> bool:
+    """Only well-formed JSON lessons/tests go into the library, not raw-text fallbacks"""
+    try:
+        if content.get('theory_content'):
+            steps = json.loads(content['theory_content']).get('steps', [])
+            return len(steps) > 1
+        if content.get('test_questions'):
+            return isinstance(json.loads(content['test_questions']), list)
+    except (ValueError, AttributeError):
+        return False
+    return False
+
+
+# ====================
+# SIMILARITY INDEX
+# ====================
+
+class ContentLibrary:
+    """
+    In-memory TF-IDF index over library titles, loaded from the content_library
+    table and topped up incrementally with rows other workers have added
+    """
+
+    def __init__(self, reuse_threshold: float = 0.9, adapt_threshold: float = 0.75,
+                 guide_threshold: float = 0.5):
+        self.reuse_threshold = reuse_threshold
+        self.adapt_threshold = adapt_threshold
+        self.guide_threshold = guide_threshold
+
+        self._lock = threading.Lock()
+        self._entries = {}        # entry id -> {'kind', 'terms', 'signature', 'course_id'}
+        self._postings = {}       # (kind, term) -> set of entry ids
+        self._doc_freq = Counter()
+        self._last_id = 0
+        self._counters = {'lookups': 0, 'reused': 0, 'adapted': 0, 'misses': 0, 'template_titles': 0, 'stored': 0}
+
+    def _index(self, row: Dict):
+        terms = Counter(row['normalized_title'].split())
+        self._entries[row['id']] = {
+            'kind': row['activity_kind'],
+            'terms': terms,
+            'signature': json.loads(row['guide_signature']),
+            'course_id': row['source_course_id']
+        }
+        for term in terms:
+            self._postings.setdefault((row['activity_kind'], term), set()).add(row['id'])
+            self._doc_freq[term] += 1
+        self._last_id = max(self._last_id, row['id'])
+
+    def refresh(self):
+        """Index rows added since the last refresh (by this or another process)"""
+        rows = db.get_content_library_entries_since(self._last_id)
+        with self._lock:
+            for row in rows:
+                if row['id'] not in self._entries:
+                    self._index(row)
+
+    def _tfidf(self, terms: Counter) -> Dict[str, float]:
+        total = len(self._entries) + 1
+        return {
+            term: count * (math.log(total / (self._doc_freq.get(term, 0) + 1)) + 1)
+            for term, count in terms.items()
+        }
+
+    @staticmethod
+    def _cosine(vec_a: Dict[str, float], vec_b: Dict[str, float]) -> float:
+        dot = sum(weight * vec_b.get(term, 0.0) for term, weight in vec_a.items())
+        norm_a = math.sqrt(sum(w * w for w in vec_a.values()))
+        norm_b = math.sqrt(sum(w * w for w in vec_b.values()))
+        return dot / (norm_a * norm_b) if norm_a and norm_b else 0.0
+
+    def find(self, title: str, activity_type: str, study_guide: str,
+             course_id: Optional[int] = None) -> Tuple[Optional[int], float, str]:
+        """
+        Look up the closest library entry generated for another course than course_id
+        Returns (entry_id, title_similarity, decision) where decision is
+        'reuse', 'adapt' or 'miss'
+        """
+        normalized = normalize_title(title)
+        if is_template_title(normalized):
+            with self._lock:
+                self._counters['lookups'] += 1
+                self._counters['template_titles'] += 1
+            return None, 0.0, 'miss'
+
+        self.refresh()
+        kind = activity_kind(activity_type)
+        terms = Counter(normalized.split())
+        signature = guide_signature(study_guide)
+
+        best_id, best_score = None, 0.0
+        with self._lock:
+            self._counters['lookups'] += 1
+
+            candidate_ids = set()
+            for term in terms:
+                candidate_ids |= self._postings.get((kind, term), set())
+
+            query_vec = self._tfidf(terms)
+            for entry_id in candidate_ids:
+                entry = self._entries[entry_id]
+                # Within a course every day is a different lesson, however alike the titles
+                if course_id is not None and entry['course_id'] == course_id:
+                    continue
+                if signature_similarity(signature, entry['signature']) < self.guide_threshold:
+                    continue
+                score = self._cosine(query_vec, self._tfidf(entry['terms']))
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is not None and best_score >= self.reuse_threshold:
+                decision = 'reuse'
+            elif best_id is not None and best_score >= self.adapt_threshold:
+                decision = 'adapt'
+            else:
+                decision = 'miss'
+            self._counters['reused' if decision == 'reuse' else
+                           'adapted' if decision == 'adapt' else 'misses'] += 1
+
+        return (best_id if decision != 'miss' else None), round(best_score, 3), decision
+
+    def add(self, title: str, activity_type: str, study_guide: str, content: Dict,
+            source_activity_id: Optional[int] = None):
+        """Store generated content in the library if it is well-formed and has a topic title"""
+        normalized = normalize_title(title)
+        if is_template_title(normalized) or not is_reusable(content):
+            return
+
+        db.add_content_library_entry(
+            normalized_title=normalized,
+            activity_kind=activity_kind(activity_type),
+            guide_signature=json.dumps(guide_signature(study_guide)),
+            theory_content=content.get('theory_content'),
+            test_questions=content.get('test_questions'),
+            test_solutions=content.get('test_solutions'),
+            source_activity_id=source_activity_id
+        )
+        with self._lock:
+            self._counters['stored'] += 1
+
+    def stats(self) -> Dict:
+        """Lookup counters, reuse rate and the thresholds in use"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries_indexed'] = len(self._entries)
+        stats['reuse_rate'] = round((stats['reused'] + stats['adapted']) / stats['lookups'], 3) if stats['lookups'] else 0.0
+        stats['thresholds'] = {
+            'reuse': self.reuse_threshold,
+            'adapt': self.adapt_threshold,
+            'guide': self.guide_threshold
+        }
+        return stats
@@ -1,35 +1,230 @@
 import sqlite3
 import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
 from typing import List, Dict, Optional, Tuple
 import json
 
+import migrate_db
+
 DATABASE_PATH = 'oleg.db'
 
-def get_db_connection():
-    """Create and return a database connection"""
-    conn = sqlite3.connect(DATABASE_PATH)
+# Idle connections kept for reuse; callers beyond this get a fresh connection as before
+DB_POOL_SIZE = 8
+
+# Runtime profile applied to every new connection (PRAGMA name -> value).
+# WAL lets readers run alongside a writer, and synchronous=NORMAL is safe
+# with WAL (a power loss may drop the last commits, never corrupts).
+SQLITE_PROFILE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,        # ms a writer waits for the lock before "database is locked"
+    'mmap_size': 256 * 2 ** 20,  # bytes of the file read through memory mapping
+    'cache_size': -32 * 2 ** 10,  # page cache per connection (negative = KiB)
+    'temp_store': 'MEMORY',
+}
+
+# Seconds between passive WAL checkpoints from a background thread, 0 = only SQLite's auto-checkpoint
+CHECKPOINT_INTERVAL = 300.0
+
+# ====================
+# CONNECTIONS
+# ====================
+
+_profile = dict(SQLITE_PROFILE)
+_checkpoint_interval = CHECKPOINT_INTERVAL
+
+def _open_connection():
+    """Open a new database connection"""
+    # Pooled connections move between threads, but only one thread uses one at a time
+    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row  # Return rows as dictionaries
     conn.execute('PRAGMA foreign_keys = ON')  # Enable foreign key constraints
+    for pragma, value in _profile.items():
+        try:
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        except sqlite3.OperationalError as e:
+            # e.g. journal_mode can't change while another process holds the database
+            print(f"Could not set PRAGMA {pragma} = {value}: {e}")
+    _start_checkpointer()
     return conn
 
-def init_database():
-    """Initialize database with schema from schema.sql"""
-    if not os.path.exists('schema.sql'):
-        raise FileNotFoundError("schema.sql file not found")
+_checkpointer_pid = None
+_checkpointer_lock = threading.Lock()
+
+def _checkpoint_worker(interval: float):
+    """Periodically copy the WAL back into the database so it doesn't grow between idle periods"""
+    conn = None
+    while True:
+        time.sleep(interval)
+        try:
+            if conn is None:
+                conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+                conn.execute(f"PRAGMA busy_timeout = {_profile.get('busy_timeout', 5000)}")
+            # PASSIVE never waits for readers or writers; pages still in use are left for next time
+            busy, wal_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+            if wal_pages > 0 and checkpointed < wal_pages:
+                print(f"WAL checkpoint: {checkpointed}/{wal_pages} pages (readers still active)")
+        except sqlite3.Error as e:
+            print(f"WAL checkpoint failed: {e}")
+
+def _start_checkpointer():
+    """Start the checkpoint thread once per process when the database runs in WAL mode"""
+    global _checkpointer_pid
+    if not _checkpoint_interval or str(_profile.get('journal_mode', '')).upper() != 'WAL':
+        return
+    if _checkpointer_pid == os.getpid():
+        return
+    with _checkpointer_lock:
+        if _checkpointer_pid != os.getpid():
+            _checkpointer_pid = os.getpid()
+            threading.Thread(target=_checkpoint_worker, args=(_checkpoint_interval,),
+                             name='sqlite-checkpoint', daemon=True).start()
+
+class ConnectionPool:
+    """Bounded LIFO pool of idle connections to DATABASE_PATH"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._pid = os.getpid()
+        self._path = DATABASE_PATH
+        self.opened = 0
+        self.reused = 0
+
+    def _reset_if_stale(self):
+        # A forked worker or a different database file must not reuse these connections
+        if self._pid != os.getpid() or self._path != DATABASE_PATH:
+            self._idle = queue.LifoQueue()
+            self._pid, self._path = os.getpid(), DATABASE_PATH
+
+    def acquire(self) -> sqlite3.Connection:
+        self._reset_if_stale()
+        try:
+            conn = self._idle.get_nowait()
+            self.reused += 1
+            return conn
+        except queue.Empty:
+            self.opened += 1
+            return _open_connection()
+
+    def release(self, conn: sqlite3.Connection):
+        # Work that was never committed is discarded, as closing the connection would
+        if conn.in_transaction:
+            conn.rollback()
+        self._reset_if_stale()
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close()
 
-    conn = get_db_connection()
+    def status(self) -> Dict:
+        return {'size': self.size, 'idle': self._idle.qsize(), 'opened': self.opened, 'reused': self.reused}
+
+class _ConnectionHandle:
+    """
+    What get_db_connection() returns: behaves like the sqlite3 connection, but
+    close() hands it back instead (to the pool, or to the enclosing scope)
+    """
+
+    def __init__(self, conn: sqlite3.Connection, on_close):
+        self._conn = conn
+        self._on_close = on_close
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
+
+    def close(self):
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close(self._conn)
+
+_pool = ConnectionPool(DB_POOL_SIZE)
+
+# Per-thread scope: db calls inside it share one connection
+_scope = threading.local()
+
+def configure_connections(pool_size: int, profile: Optional[Dict] = None,
+                          checkpoint_interval: Optional[float] = None):
+    """
+    Set the connection pool size, the PRAGMA profile for new connections
+    (default SQLITE_PROFILE) and the WAL checkpoint interval (called once at startup)
+    """
+    global _pool, _profile, _checkpoint_interval
+    _profile = dict(SQLITE_PROFILE if profile is None else profile)
+    if checkpoint_interval is not None:
+        _checkpoint_interval = checkpoint_interval
+    _pool = ConnectionPool(pool_size)
+
+def _release_in_scope(conn: sqlite3.Connection):
+    # The scope keeps the connection; once no caller has it open, drop what was left uncommitted
+    _scope.handles -= 1
+    if not _scope.handles and conn.in_transaction:
+        conn.rollback()
+
+def get_db_connection():
+    """
+    Return a database connection. Inside a connection scope this is the
+    scope's connection; otherwise one from the pool. Either way, close() it
+    when done.
+    """
+    if getattr(_scope, 'depth', 0):
+        if _scope.conn is None:
+            _scope.conn = _pool.acquire()
+        _scope.handles += 1
+        return _ConnectionHandle(_scope.conn, _release_in_scope)
+    return _ConnectionHandle(_pool.acquire(), _pool.release)
+
+def begin_connection_scope():
+    """Start (or nest) this thread's connection scope; the connection is opened on first use"""
+    if not getattr(_scope, 'depth', 0):
+        _scope.depth, _scope.conn, _scope.handles = 0, None, 0
+    _scope.depth += 1
+
+def end_connection_scope():
+    """Leave this thread's connection scope, returning its connection after the outermost one"""
+    depth = getattr(_scope, 'depth', 0)
+    if not depth:
+        return
+    _scope.depth = depth - 1
+    if _scope.depth == 0 and _scope.conn is not None:
+        conn, _scope.conn = _scope.conn, None
+        if _scope.handles:
+            conn.close()  # Someone never closed their handle; don't pool a connection still in use
+        else:
+            _pool.release(conn)
+
+@contextmanager
+def connection_scope():
+    """Run several db functions on one connection: with db.connection_scope(): ..."""
+    begin_connection_scope()
     try:
-        with open('schema.sql', 'r') as f:
-            schema = f.read()
-        conn.executescript(schema)
-        conn.commit()
-        print("Database initialized successfully")
+        yield
+    finally:
+        end_connection_scope()
+
+def init_database():
+    """Bring the database schema up to date (a single version check when it already is)"""
+    conn = _pool.acquire()  # The raw connection: migrations switch it to explicit transactions
+    try:
+        applied = migrate_db.migrate(conn)
+        if applied:
+            print(f"Applied {len(applied)} migration(s), schema version {migrate_db.current_version(conn)}")
     except Exception as e:
         print(f"Error initializing database: {e}")
         raise
     finally:
-        conn.close()
+        _pool.release(conn)
 
 # ====================
 # USER OPERATIONS
@@ -180,6 +375,44 @@ def update_course(course_id: int, study_guide: str = None, schedule_data: str =
     finally:
         conn.close()
 
+# ====================
+# STUDY GUIDE CHUNKS
+# ====================
+
+def replace_study_guide_chunks(course_id: int, guide_hash: int, chunks: List[Dict]):
+    """Replace a course's study guide chunks (heading, content, term_counts, length)"""
+    conn = get_db_connection()
+    try:
+        conn.execute("DELETE FROM study_guide_chunks WHERE course_id = ?", (course_id,))
+        conn.executemany(
+            """INSERT INTO study_guide_chunks
+               (course_id, chunk_index, heading, content, term_counts, length, guide_hash)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            [
+                (course_id, index, chunk['heading'], chunk['content'],
+                 chunk['term_counts'], chunk['length'], guide_hash)
+                for index, chunk in enumerate(chunks)
+            ]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_study_guide_chunks(course_id: int) -> List[Dict]:
+    """Get a course's study guide chunks in guide order"""
+    conn = get_db_connection()
+    try:
+        chunks = conn.execute(
+            """SELECT chunk_index, heading, content, term_counts, length, guide_hash
+               FROM study_guide_chunks
+               WHERE course_id = ?
+               ORDER BY chunk_index""",
+            (course_id,)
+        ).fetchall()
+        return [dict(chunk) for chunk in chunks]
+    finally:
+        conn.close()
+
 # ====================
 # ACTIVITY OPERATIONS
 # ====================
@@ -236,6 +469,20 @@ def get_activities_by_course(course_id: int) -> List[Dict]:
     finally:
         conn.close()
 
+def get_activities_for_week(course_id: int, week_number: int) -> List[Dict]:
+    """Get activities for one week of a course"""
+    conn = get_db_connection()
+    try:
+        activities = conn.execute(
+            """SELECT * FROM activities
+               WHERE course_id = ? AND week_number = ?
+               ORDER BY day_number, id""",
+            (course_id, week_number)
+        ).fetchall()
+        return [dict(activity) for activity in activities]
+    finally:
+        conn.close()
+
 def get_activities_for_date(course_id: int, target_date: date) -> List[Dict]:
     """Get activities for a specific date"""
     conn = get_db_connection()
@@ -268,6 +515,22 @@ def get_activity_by_id(activity_id: int) -> Optional[Dict]:
     finally:
         conn.close()
 
+def get_upcoming_activities_without_content(course_id: int, from_date: date, limit: int) -> List[Dict]:
+    """Get the next scheduled activities (on or after from_date) whose content hasn't been generated"""
+    conn = get_db_connection()
+    try:
+        activities = conn.execute(
+            """SELECT * FROM activities
+               WHERE course_id = ? AND scheduled_date >= ?
+                 AND COALESCE(content_generated, 0) = 0
+               ORDER BY scheduled_date, id
+               LIMIT ?""",
+            (course_id, from_date, limit)
+        ).fetchall()
+        return [dict(activity) for activity in activities]
+    finally:
+        conn.close()
+
 def update_activity_content(activity_id: int, theory_content: str = None,
                            test_questions: str = None, test_solutions: str = None):
     """Update activity content (theory or test)"""
@@ -286,6 +549,160 @@ def update_activity_content(activity_id: int, theory_content: str = None,
     finally:
         conn.close()
 
+def save_partial_activity_content(activity_id: int, theory_content: str = None,
+                                  test_questions: str = None):
+    """
+    Save content that is still being generated (e.g. the first lesson steps)
+    content_generated stays 0 until update_activity_content saves the final content
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            """UPDATE activities
+               SET theory_content = COALESCE(?, theory_content),
+                   test_questions = COALESCE(?, test_questions)
+               WHERE id = ? AND COALESCE(content_generated, 0) = 0""",
+            (theory_content, test_questions, activity_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def bulk_update_activity_content(contents: List[Dict]):
+    """
+    Update content for several activities in one transaction
+    Each dict needs 'activity_id', 'theory_content', 'test_questions', 'test_solutions'
+    """
+    conn = get_db_connection()
+    try:
+        conn.executemany(
+            """UPDATE activities
+               SET theory_content = :theory_content,
+                   test_questions = :test_questions,
+                   test_solutions = :test_solutions,
+                   content_generated = 1
+               WHERE id = :activity_id""",
+            contents
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+# ====================
+# CONTENT GENERATION LEASES
+# ====================
+
+def acquire_generation_lease(activity_id: int, owner: str, ttl_seconds: float) -> bool:
+    """
+    Try to take the lease for generating an activity's content
+    Succeeds if nobody holds it or the previous holder's lease expired
+    """
+    now = time.time()
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            """INSERT INTO content_generation_leases (activity_id, owner, expires_at)
+               VALUES (?, ?, ?)
+               ON CONFLICT(activity_id) DO UPDATE SET
+               owner = excluded.owner,
+               expires_at = excluded.expires_at
+               WHERE content_generation_leases.expires_at < ?""",
+            (activity_id, owner, now + ttl_seconds, now)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+def renew_generation_leases(leases: List[Tuple[int, str]], ttl_seconds: float):
+    """Push back the expiry of leases [(activity_id, owner)] still held by those owners"""
+    conn = get_db_connection()
+    try:
+        conn.executemany(
+            """UPDATE content_generation_leases SET expires_at = ?
+               WHERE activity_id = ? AND owner = ?""",
+            [(time.time() + ttl_seconds, activity_id, owner) for activity_id, owner in leases]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def release_generation_lease(activity_id: int, owner: str):
+    """Release a generation lease held by owner"""
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            "DELETE FROM content_generation_leases WHERE activity_id = ? AND owner = ?",
+            (activity_id, owner)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+# ====================
+# CONTENT LIBRARY
+# ====================
+
+def get_content_library_entries_since(last_id: int) -> List[Dict]:
+    """Get library index fields (and the source activity's course) for entries added after last_id"""
+    conn = get_db_connection()
+    try:
+        entries = conn.execute(
+            """SELECT cl.id, cl.normalized_title, cl.activity_kind, cl.guide_signature,
+                      a.course_id as source_course_id
+               FROM content_library cl
+               LEFT JOIN activities a ON a.id = cl.source_activity_id
+               WHERE cl.id > ?
+               ORDER BY cl.id""",
+            (last_id,)
+        ).fetchall()
+        return [dict(entry) for entry in entries]
+    finally:
+        conn.close()
+
+def get_content_library_entry(entry_id: int) -> Optional[Dict]:
+    """Get a library entry with its content"""
+    conn = get_db_connection()
+    try:
+        entry = conn.execute(
+            "SELECT * FROM content_library WHERE id = ?",
+            (entry_id,)
+        ).fetchone()
+        return dict(entry) if entry else None
+    finally:
+        conn.close()
+
+def add_content_library_entry(normalized_title: str, activity_kind: str, guide_signature: str,
+                              theory_content: str = None, test_questions: str = None,
+                              test_solutions: str = None, source_activity_id: int = None) -> int:
+    """Add generated content to the shared library"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            """INSERT INTO content_library
+               (normalized_title, activity_kind, guide_signature, theory_content,
+                test_questions, test_solutions, source_activity_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (normalized_title, activity_kind, guide_signature, theory_content,
+             test_questions, test_solutions, source_activity_id)
+        )
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+def increment_content_library_reuse(entry_id: int):
+    """Count one more reuse of a library entry"""
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            "UPDATE content_library SET reuse_count = reuse_count + 1 WHERE id = ?",
+            (entry_id,)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
 # ====================
 # ACTIVITY COMPLETION OPERATIONS
 # ====================
@@ -341,38 +758,69 @@ def is_activity_completed(activity_id: int) -> bool:
 # DAILY PROGRESS OPERATIONS
 # ====================
 
-def update_daily_progress(user_id: int, course_id: int, target_date: date):
-    """Update daily progress for a specific date"""
+def _upsert_daily_progress(conn, user_id: int, course_id: int, target_date: date) -> Dict:
+    """Recount one day's progress (inside the caller's transaction); returns the day's transition"""
+    previous = conn.execute(
+        """SELECT activities_completed, is_complete FROM daily_progress
+           WHERE user_id = ? AND course_id = ? AND date = ?""",
+        (user_id, course_id, target_date)
+    ).fetchone()
+
+    # Get all activities for this date
+    activities = conn.execute(
+        """SELECT a.id, ac.completed_at
+           FROM activities a
+           LEFT JOIN activity_completions ac ON a.id = ac.activity_id
+           WHERE a.course_id = ? AND a.scheduled_date = ?""",
+        (course_id, target_date)
+    ).fetchall()
+
+    total_activities = len(activities)
+    completed_activities = sum(1 for a in activities if a['completed_at'])
+    is_complete = total_activities > 0 and completed_activities == total_activities
+
+    # Upsert daily progress
+    conn.execute(
+        """INSERT INTO daily_progress
+           (user_id, course_id, date, activities_completed, total_activities, is_complete, completed_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(user_id, course_id, date) DO UPDATE SET
+           activities_completed = ?,
+           total_activities = ?,
+           is_complete = ?,
+           completed_at = CASE WHEN ? = 1 AND completed_at IS NULL THEN ? ELSE completed_at END""",
+        (user_id, course_id, target_date, completed_activities, total_activities,
+         is_complete, datetime.now() if is_complete else None,
+         completed_activities, total_activities, is_complete, is_complete, datetime.now())
+    )
+
+    return {
+        'date': target_date,
+        'was_complete': bool(previous and previous['is_complete']),
+        'is_complete': is_complete,
+        'was_studied': bool(previous and previous['activities_completed']),
+        'is_studied': completed_activities > 0
+    }
+
+def update_daily_progress(user_id: int, course_id: int, target_date: date) -> Dict:
+    """
+    Update daily progress for a specific date and move the streak record by
+    the day's change, in one write transaction: concurrent completions for
+    the same course apply one after the other, each seeing the last one's result
+    Returns the day's transition ({'date', 'was_complete', 'is_complete',
+    'was_studied', 'is_studied'}) with the resulting 'current_streak'
+    """
     conn = get_db_connection()
     try:
-        # Get all activities for this date
-        activities = conn.execute(
-            """SELECT a.id, ac.completed_at
-               FROM activities a
-               LEFT JOIN activity_completions ac ON a.id = ac.activity_id
-               WHERE a.course_id = ? AND a.scheduled_date = ?""",
-            (course_id, target_date)
-        ).fetchall()
-
-        total_activities = len(activities)
-        completed_activities = sum(1 for a in activities if a['completed_at'])
-        is_complete = total_activities > 0 and completed_activities == total_activities
-
-        # Upsert daily progress
-        conn.execute(
-            """INSERT INTO daily_progress
-               (user_id, course_id, date, activities_completed, total_activities, is_complete, completed_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?)
-               ON CONFLICT(user_id, course_id, date) DO UPDATE SET
-               activities_completed = ?,
-               total_activities = ?,
-               is_complete = ?,
-               completed_at = CASE WHEN ? = 1 AND completed_at IS NULL THEN ? ELSE completed_at END""",
-            (user_id, course_id, target_date, completed_activities, total_activities,
-             is_complete, datetime.now() if is_complete else None,
-             completed_activities, total_activities, is_complete, is_complete, datetime.now())
-        )
-        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            transition = _upsert_daily_progress(conn, user_id, course_id, target_date)
+            transition['current_streak'] = _apply_streak_transition(conn, user_id, course_id, transition)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return transition
     finally:
         conn.close()
 
@@ -389,16 +837,26 @@ def get_daily_progress(user_id: int, course_id: int, target_date: date) -> Optio
     finally:
         conn.close()
 
+def month_range(year: int, month: int) -> Tuple[date, date]:
+    """First day of the month and first day of the next, for date >= ? AND date < ? filters"""
+    first = date(year, month, 1)
+    following = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return first, following
+
+# Month filters compare the stored ISO dates against a range, so they can seek
+# the (user_id, course_id, date) index instead of running strftime on every row
+MONTHLY_PROGRESS_QUERY = """SELECT * FROM daily_progress
+   WHERE user_id = ? AND course_id = ?
+   AND date >= ? AND date < ?
+   ORDER BY date"""
+
 def get_monthly_progress(user_id: int, course_id: int, year: int, month: int) -> List[Dict]:
     """Get daily progress for a specific month"""
     conn = get_db_connection()
     try:
         progress = conn.execute(
-            """SELECT * FROM daily_progress
-               WHERE user_id = ? AND course_id = ?
-               AND strftime('%Y', date) = ? AND strftime('%m', date) = ?
-               ORDER BY date""",
-            (user_id, course_id, str(year), f"{month:02d}")
+            MONTHLY_PROGRESS_QUERY,
+            (user_id, course_id, *month_range(year, month))
         ).fetchall()
         return [dict(p) for p in progress]
     finally:
@@ -407,92 +865,252 @@ def get_monthly_progress(user_id: int, course_id: int, year: int, month: int) ->
 # ====================
 # STREAK OPERATIONS
 # ====================
+# user_streaks keeps the latest run of consecutive complete days
+# (run_start_date..run_end_date). A completion event only moves the ends of
+# that run; the current streak is the run's length while it ends today or
+# yesterday, so reading it never scans the history.
+
+# Complete days fetched per query when walking back over an earlier run
+RUN_SCAN_BATCH = 64
+
+def _as_date(value) -> Optional[date]:
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+def _streak_length(run_start: Optional[date], run_end: Optional[date], today: Optional[date] = None) -> int:
+    """Current streak for a run: its length if it ends today or yesterday, else 0 (broken)"""
+    today = today or date.today()
+    if run_end is None or run_end not in (today, today - timedelta(days=1)):
+        return 0
+    return (run_end - run_start).days + 1
+
+def _run_start(conn, user_id: int, course_id: int, run_end: date) -> date:
+    """First day of the run of consecutive complete days ending at run_end"""
+    start = run_end
+    while True:
+        rows = conn.execute(
+            """SELECT date FROM daily_progress
+               WHERE user_id = ? AND course_id = ? AND date < ? AND is_complete = 1
+               ORDER BY date DESC LIMIT ?""",
+            (user_id, course_id, start, RUN_SCAN_BATCH)
+        ).fetchall()
+        for row in rows:
+            day = _as_date(row['date'])
+            if day != start - timedelta(days=1):
+                return start
+            start = day
+        if len(rows) < RUN_SCAN_BATCH:
+            return start
+
+def _run_end(conn, user_id: int, course_id: int, run_start: date) -> date:
+    """Last day of the run of consecutive complete days starting at run_start"""
+    end = run_start
+    while True:
+        rows = conn.execute(
+            """SELECT date FROM daily_progress
+               WHERE user_id = ? AND course_id = ? AND date > ? AND is_complete = 1
+               ORDER BY date LIMIT ?""",
+            (user_id, course_id, end, RUN_SCAN_BATCH)
+        ).fetchall()
+        for row in rows:
+            day = _as_date(row['date'])
+            if day != end + timedelta(days=1):
+                return end
+            end = day
+        if len(rows) < RUN_SCAN_BATCH:
+            return end
+
+def _longest_run(conn, user_id: int, course_id: int) -> int:
+    """Length of the longest run of consecutive complete days (scans the history)"""
+    longest = length = 0
+    previous = None
+    for row in conn.execute(
+        """SELECT date FROM daily_progress
+           WHERE user_id = ? AND course_id = ? AND is_complete = 1
+           ORDER BY date""",
+        (user_id, course_id)
+    ):
+        day = _as_date(row['date'])
+        length = length + 1 if previous and day == previous + timedelta(days=1) else 1
+        longest = max(longest, length)
+        previous = day
+    return longest
+
+def _latest_run(conn, user_id: int, course_id: int,
+                before: Optional[date] = None) -> Tuple[Optional[date], Optional[date]]:
+    """(start, end) of the latest run of complete days (ending before `before`), or (None, None)"""
+    row = conn.execute(
+        """SELECT MAX(date) as date FROM daily_progress
+           WHERE user_id = ? AND course_id = ? AND date < ? AND is_complete = 1""",
+        (user_id, course_id, before or date.max)
+    ).fetchone()
+    run_end = _as_date(row['date'])
+    if run_end is None:
+        return None, None
+    return _run_start(conn, user_id, course_id, run_end), run_end
+
+def _advance_run(conn, user_id: int, course_id: int, run_start: Optional[date],
+                 run_end: Optional[date], transition: Dict) -> Tuple[Optional[date], Optional[date]]:
+    """The latest run after one day changed completion state"""
+    day = _as_date(transition['date'])
+
+    if transition['is_complete'] and not transition['was_complete']:
+        if run_end is None or day > run_end + timedelta(days=1):
+            return day, day  # A new latest run
+        if day == run_end + timedelta(days=1):
+            return run_start, day  # Extends the run
+        if day == run_start - timedelta(days=1):
+            # Joins the run to whatever complete days precede it
+            return _run_start(conn, user_id, course_id, run_end), run_end
+        return run_start, run_end  # An older day, outside the latest run
+
+    if transition['was_complete'] and not transition['is_complete']:
+        if run_end is None or not run_start <= day <= run_end:
+            return run_start, run_end
+        if day == run_start == run_end:
+            return _latest_run(conn, user_id, course_id, before=day)  # Falls back to the previous run
+        if day == run_end:
+            return run_start, day - timedelta(days=1)
+        return day + timedelta(days=1), run_end  # Splits the run; the later part is the latest
+
+    return run_start, run_end
+
+def _longest_after(conn, user_id: int, course_id: int, longest: int, old_run: Tuple,
+                   new_run: Tuple, transition: Dict) -> int:
+    """longest_streak after one day changed completion state, given the latest run before and after"""
+    day = _as_date(transition['date'])
+    if transition['is_complete'] and not transition['was_complete']:
+        run_start, run_end = new_run
+    elif transition['was_complete'] and not transition['is_complete']:
+        run_start, run_end = old_run
+    else:
+        return longest
+
+    # The run the day belongs to (while complete); outside the latest run it has to be looked up
+    if run_end is None or not run_start <= day <= run_end:
+        run_start, run_end = _run_start(conn, user_id, course_id, day), _run_end(conn, user_id, course_id, day)
+    length = (run_end - run_start).days + 1
+
+    if transition['is_complete']:
+        return max(longest, length)
+    # Breaking up the longest run may shorten the record; a shorter run leaves it standing
+    return _longest_run(conn, user_id, course_id) if length >= longest else longest
 
 def calculate_streak(user_id: int, course_id: int) -> int:
     """
-    Calculate current streak based on daily_progress
+    Calculate current streak from daily_progress (full recompute; the
+    completion path updates the stored run incrementally instead)
     Returns the current streak count
     """
     conn = get_db_connection()
     try:
-        # Get all completed days ordered by date DESC
-        completed_days = conn.execute(
-            """SELECT date FROM daily_progress
-               WHERE user_id = ? AND course_id = ? AND is_complete = 1
-               ORDER BY date DESC""",
-            (user_id, course_id)
-        ).fetchall()
-
-        if not completed_days:
-            return 0
-
-        today = date.today()
-        yesterday = today - timedelta(days=1)
-
-        # Streak must include today or yesterday
-        most_recent = date.fromisoformat(completed_days[0]['date'])
-        if most_recent < yesterday:
-            return 0  # Streak broken
-
-        # Count consecutive days
-        streak = 0
-        expected_date = today if most_recent == today else yesterday
-
-        for row in completed_days:
-            day = date.fromisoformat(row['date'])
-            if day == expected_date:
-                streak += 1
-                expected_date -= timedelta(days=1)
-            else:
-                break
-
-        return streak
+        return _streak_length(*_latest_run(conn, user_id, course_id))
     finally:
         conn.close()
 
-def update_streak_record(user_id: int, course_id: int):
-    """Update streak table with latest streak info"""
-    current_streak = calculate_streak(user_id, course_id)
-
+def _expected_streak(conn, user_id: int, course_id: int) -> Dict:
+    """A streak record's stored fields, recomputed from daily_progress"""
+    run_start, run_end = _latest_run(conn, user_id, course_id)
+    total_days = conn.execute(
+        """SELECT COUNT(*) as count FROM daily_progress
+           WHERE user_id = ? AND course_id = ? AND activities_completed > 0""",
+        (user_id, course_id)
+    ).fetchone()['count']
+    return {
+        'run_start_date': run_start.isoformat() if run_start else None,
+        'run_end_date': run_end.isoformat() if run_end else None,
+        'longest_streak': _longest_run(conn, user_id, course_id),
+        'total_study_days': total_days
+    }
+
+def _rebuild_streak(conn, user_id: int, course_id: int) -> int:
+    """Recompute a streak record (inside the caller's transaction); returns the current streak"""
+    expected = _expected_streak(conn, user_id, course_id)
+    current_streak = _streak_length(_as_date(expected['run_start_date']), _as_date(expected['run_end_date']))
+    conn.execute(
+        """INSERT INTO user_streaks
+           (user_id, course_id, current_streak, longest_streak, total_study_days,
+            run_start_date, run_end_date)
+           VALUES (?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(user_id, course_id) DO UPDATE SET
+           current_streak = excluded.current_streak,
+           longest_streak = excluded.longest_streak,
+           total_study_days = excluded.total_study_days,
+           run_start_date = excluded.run_start_date,
+           run_end_date = excluded.run_end_date""",
+        (user_id, course_id, current_streak, expected['longest_streak'], expected['total_study_days'],
+         expected['run_start_date'], expected['run_end_date'])
+    )
+    return current_streak
+
+def rebuild_streak_record(user_id: int, course_id: int) -> int:
+    """Recompute a streak record from daily_progress (repair job); returns the current streak"""
     conn = get_db_connection()
     try:
-        # Get existing streak record
-        existing = conn.execute(
-            "SELECT longest_streak FROM user_streaks WHERE user_id = ? AND course_id = ?",
-            (user_id, course_id)
-        ).fetchone()
-
-        # Count total study days
-        total_days = conn.execute(
-            """SELECT COUNT(DISTINCT date) as count FROM daily_progress
-               WHERE user_id = ? AND course_id = ? AND activities_completed > 0""",
-            (user_id, course_id)
-        ).fetchone()['count']
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current_streak = _rebuild_streak(conn, user_id, course_id)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return current_streak
+    finally:
+        conn.close()
 
-        if existing:
-            longest = max(existing['longest_streak'], current_streak)
-            conn.execute(
-                """UPDATE user_streaks
-                   SET current_streak = ?, longest_streak = ?,
-                       last_activity_date = ?, total_study_days = ?
-                   WHERE user_id = ? AND course_id = ?""",
-                (current_streak, longest, date.today(), total_days, user_id, course_id)
-            )
-        else:
-            conn.execute(
-                """INSERT INTO user_streaks
-                   (user_id, course_id, current_streak, longest_streak,
-                    last_activity_date, total_study_days)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (user_id, course_id, current_streak, current_streak,
-                 date.today(), total_days)
-            )
+def check_streak_records(course_id: Optional[int] = None) -> List[Tuple[int, int, Dict, Dict]]:
+    """[(user_id, course_id, stored, expected)] for streak records that don't match daily_progress"""
+    conn = get_db_connection()
+    try:
+        records = conn.execute(
+            """SELECT user_id, course_id, run_start_date, run_end_date, longest_streak, total_study_days
+               FROM user_streaks WHERE ? IS NULL OR course_id = ?""",
+            (course_id, course_id)
+        ).fetchall()
 
-        conn.commit()
-        return current_streak
+        drift = []
+        for record in records:
+            expected = _expected_streak(conn, record['user_id'], record['course_id'])
+            stored = {key: record[key] for key in expected}
+            if stored != expected:
+                drift.append((record['user_id'], record['course_id'], stored, expected))
+        return drift
     finally:
         conn.close()
 
+def _apply_streak_transition(conn, user_id: int, course_id: int, transition: Dict) -> int:
+    """
+    Move the streak record by one day's transition without rescanning the
+    history (inside the caller's transaction); a course with no record yet
+    is recomputed instead. Returns the current streak
+    """
+    existing = conn.execute(
+        """SELECT longest_streak, total_study_days, run_start_date, run_end_date
+           FROM user_streaks WHERE user_id = ? AND course_id = ?""",
+        (user_id, course_id)
+    ).fetchone()
+    if not existing:
+        return _rebuild_streak(conn, user_id, course_id)
+
+    old_run = (_as_date(existing['run_start_date']), _as_date(existing['run_end_date']))
+    run_start, run_end = _advance_run(conn, user_id, course_id, *old_run, transition)
+    current_streak = _streak_length(run_start, run_end)
+    longest = _longest_after(conn, user_id, course_id, existing['longest_streak'] or 0,
+                             old_run, (run_start, run_end), transition)
+    total_days = (existing['total_study_days'] or 0) \
+        + int(transition['is_studied']) - int(transition['was_studied'])
+
+    conn.execute(
+        """UPDATE user_streaks
+           SET current_streak = ?, longest_streak = ?, last_activity_date = ?,
+               total_study_days = ?, run_start_date = ?, run_end_date = ?
+           WHERE user_id = ? AND course_id = ?""",
+        (current_streak, longest, date.today(), max(total_days, 0),
+         run_start, run_end, user_id, course_id)
+    )
+    return current_streak
+
 def get_user_streak(user_id: int, course_id: int) -> Dict:
     """Get streak information for a user and course"""
     conn = get_db_connection()
@@ -503,7 +1121,13 @@ def get_user_streak(user_id: int, course_id: int) -> Dict:
         ).fetchone()
 
         if streak:
-            return dict(streak)
+            streak = dict(streak)
+            # The stored value is as of the last completion; a run that ended
+            # before yesterday has been broken since
+            streak['current_streak'] = _streak_length(
+                _as_date(streak['run_start_date']), _as_date(streak['run_end_date'])
+            )
+            return streak
         else:
             # Return default streak info
             return {
@@ -536,42 +1160,24 @@ def initialize_user_streak(user_id: int, course_id: int):
 # ====================
 
 def get_progress_stats(user_id: int, course_id: int) -> Dict:
-    """Get comprehensive progress statistics"""
+    """
+    Get comprehensive progress statistics from the materialized counters
+    (course_progress and course_week_progress, kept current by triggers)
+    """
     conn = get_db_connection()
     try:
-        # Total activities
-        total_result = conn.execute(
-            "SELECT COUNT(*) as count FROM activities WHERE course_id = ?",
-            (course_id,)
-        ).fetchone()
-        total = total_result['count']
-
-        # Completed activities
-        completed_result = conn.execute(
-            """SELECT COUNT(*) as count FROM activity_completions ac
-               JOIN activities a ON ac.activity_id = a.id
-               WHERE a.course_id = ?""",
+        counters = conn.execute(
+            """SELECT total_activities, completed_activities, days_studied
+               FROM course_progress WHERE course_id = ?""",
             (course_id,)
         ).fetchone()
-        completed = completed_result['count']
+        total = counters['total_activities'] if counters else 0
+        completed = counters['completed_activities'] if counters else 0
 
-        # Days studied
-        days_result = conn.execute(
-            """SELECT COUNT(DISTINCT date) as count FROM daily_progress
-               WHERE user_id = ? AND course_id = ? AND activities_completed > 0""",
-            (user_id, course_id)
-        ).fetchone()
-        days_studied = days_result['count']
-
-        # Weekly breakdown
         weekly = conn.execute(
-            """SELECT week_number,
-                      COUNT(*) as total,
-                      SUM(CASE WHEN ac.id IS NOT NULL THEN 1 ELSE 0 END) as completed
-               FROM activities a
-               LEFT JOIN activity_completions ac ON a.id = ac.activity_id
-               WHERE a.course_id = ?
-               GROUP BY week_number
+            """SELECT week_number, total_activities as total, completed_activities as completed
+               FROM course_week_progress
+               WHERE course_id = ? AND total_activities > 0
                ORDER BY week_number""",
             (course_id,)
         ).fetchall()
@@ -582,12 +1188,92 @@ def get_progress_stats(user_id: int, course_id: int) -> Dict:
             'total_activities': total,
             'completed_activities': completed,
             'progress_percentage': round((completed / total * 100), 1) if total > 0 else 0,
-            'days_studied': days_studied,
+            'days_studied': counters['days_studied'] if counters else 0,
             'weekly_progress': weekly_progress
         }
     finally:
         conn.close()
 
+def _counted_progress(conn, course_id: int) -> Dict:
+    """Progress counters for a course aggregated from the source tables"""
+    weeks = conn.execute(
+        """SELECT a.week_number, COUNT(*) as total_activities, COUNT(ac.id) as completed_activities
+           FROM activities a
+           LEFT JOIN activity_completions ac ON ac.activity_id = a.id
+           WHERE a.course_id = ?
+           GROUP BY a.week_number
+           ORDER BY a.week_number""",
+        (course_id,)
+    ).fetchall()
+    days_studied = conn.execute(
+        "SELECT COUNT(*) as count FROM daily_progress WHERE course_id = ? AND activities_completed > 0",
+        (course_id,)
+    ).fetchone()['count']
+
+    return {
+        'total_activities': sum(week['total_activities'] for week in weeks),
+        'completed_activities': sum(week['completed_activities'] for week in weeks),
+        'days_studied': days_studied,
+        'weeks': {week['week_number']: (week['total_activities'], week['completed_activities']) for week in weeks}
+    }
+
+def _stored_progress(conn, course_id: int) -> Dict:
+    counters = conn.execute(
+        "SELECT total_activities, completed_activities, days_studied FROM course_progress WHERE course_id = ?",
+        (course_id,)
+    ).fetchone()
+    weeks = conn.execute(
+        """SELECT week_number, total_activities, completed_activities FROM course_week_progress
+           WHERE course_id = ? AND (total_activities != 0 OR completed_activities != 0)""",
+        (course_id,)
+    ).fetchall()
+
+    return {
+        'total_activities': counters['total_activities'] if counters else None,
+        'completed_activities': counters['completed_activities'] if counters else None,
+        'days_studied': counters['days_studied'] if counters else None,
+        'weeks': {week['week_number']: (week['total_activities'], week['completed_activities']) for week in weeks}
+    }
+
+def check_progress_counters(course_id: Optional[int] = None) -> List[Tuple[int, Dict, Dict]]:
+    """[(course_id, stored, expected)] for courses whose counters don't match the source tables"""
+    conn = get_db_connection()
+    try:
+        course_ids = [course_id] if course_id is not None else [
+            row['id'] for row in conn.execute("SELECT id FROM courses ORDER BY id")
+        ]
+        drift = []
+        for checked_id in course_ids:
+            stored, expected = _stored_progress(conn, checked_id), _counted_progress(conn, checked_id)
+            if stored != expected:
+                drift.append((checked_id, stored, expected))
+        return drift
+    finally:
+        conn.close()
+
+def rebuild_progress_counters(course_id: int):
+    """Recompute a course's progress counters from the source tables (repair job)"""
+    conn = get_db_connection()
+    try:
+        # Take the write lock before counting, so no completion lands in between
+        conn.execute("BEGIN IMMEDIATE")
+        expected = _counted_progress(conn, course_id)
+        conn.execute("DELETE FROM course_week_progress WHERE course_id = ?", (course_id,))
+        conn.executemany(
+            """INSERT INTO course_week_progress (course_id, week_number, total_activities, completed_activities)
+               VALUES (?, ?, ?, ?)""",
+            [(course_id, week, total, completed) for week, (total, completed) in expected['weeks'].items()]
+        )
+        conn.execute(
+            """INSERT OR REPLACE INTO course_progress
+               (course_id, total_activities, completed_activities, days_studied)
+               VALUES (?, ?, ?, ?)""",
+            (course_id, expected['total_activities'], expected['completed_activities'], expected['days_studied'])
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
 # ====================
 # CHECKPOINT OPERATIONS
 # ====================
@@ -639,28 +1325,31 @@ def get_course_checkpoints(course_id: int) -> List[Dict]:
 # UTILITY FUNCTIONS
 # ====================
 
+# Each activity has at most one completion and each day one daily_progress row,
+# so plain COUNTs suffice; the activities side is read from its covering index
+CALENDAR_QUERY = """SELECT
+       a.scheduled_date as date,
+       COUNT(a.id) as total_activities,
+       COUNT(ac.activity_id) as completed_activities,
+       MAX(dp.is_complete) as is_complete,
+       MAX(CASE WHEN a.activity_type IN ('test', 'checkpoint') THEN 1 ELSE 0 END) as is_test_day
+   FROM activities a
+   LEFT JOIN activity_completions ac ON a.id = ac.activity_id
+   LEFT JOIN daily_progress dp ON dp.user_id = ? AND dp.course_id = a.course_id
+       AND dp.date = a.scheduled_date
+   WHERE a.course_id = ?
+       AND a.scheduled_date >= ? AND a.scheduled_date < ?
+   GROUP BY a.scheduled_date
+   ORDER BY a.scheduled_date"""
+
 def get_calendar_data(user_id: int, course_id: int, year: int, month: int) -> Dict:
     """Get calendar data for a specific month with completion status"""
     conn = get_db_connection()
     try:
         # Get all days in the month with activities
         days = conn.execute(
-            """SELECT
-                   a.scheduled_date as date,
-                   COUNT(DISTINCT a.id) as total_activities,
-                   COUNT(DISTINCT ac.activity_id) as completed_activities,
-                   dp.is_complete,
-                   MAX(CASE WHEN a.activity_type IN ('test', 'checkpoint') THEN 1 ELSE 0 END) as is_test_day
-               FROM activities a
-               LEFT JOIN activity_completions ac ON a.id = ac.activity_id
-               LEFT JOIN daily_progress dp ON a.course_id = dp.course_id
-                   AND a.scheduled_date = dp.date AND dp.user_id = ?
-               WHERE a.course_id = ?
-                   AND strftime('%Y', a.scheduled_date) = ?
-                   AND strftime('%m', a.scheduled_date) = ?
-               GROUP BY a.scheduled_date
-               ORDER BY a.scheduled_date""",
-            (user_id, course_id, str(year), f"{month:02d}")
+            CALENDAR_QUERY,
+            (user_id, course_id, *month_range(year, month))
         ).fetchall()
 
         calendar_days = []
@@ -1,7 +1,21 @@
 #funcs.py
 import requests
 import json
+import asyncio
+import random
+import weakref
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
 from environs import Env
+from llm_cache import ResponseCache, make_cache_key
+from telemetry import LLMTelemetry, set_queued_at, reset_queued_at
+from upstream import AdaptiveLimiter, CircuitBreaker, UpstreamGuard, UpstreamUnavailable
+from model_routing import LARGE, SMALL, ModelRouter
+from prompts import Section, build_prompt
+from streaming_json import StreamingArrayParser, parse_json_response
 
 # Load environment variables ONCE
 env = Env()
@@ -9,25 +23,205 @@ env.read_env()
 
 # Fireworks AI configuration
 FIREWORKS_API_KEY = env.str("FIREWORKS_API_KEY")
-FIREWORKS_API_URL = "https://api.fireworks.ai/inference/v1/chat/completions"
+# Point FIREWORKS_API_URL at mock_llm_server.py to run without the real API
+FIREWORKS_API_URL = env.str("FIREWORKS_API_URL", "https://api.fireworks.ai/inference/v1/chat/completions")
 MODEL_NAME = 'accounts/fireworks/models/llama-v3p3-70b-instruct'
 
-
-def chat(
-        model: str,
-        messages: list[dict],
-        options: dict = None
-):
+# Model tiers: model, read timeout (seconds) and tiers to fall back to, in order.
+# LLM_ROUTES overrides the tier of individual call sites, e.g.
+# LLM_ROUTES=generate_bot_response=large,adapt_task_content=small
+LLM_MODEL_SMALL = env.str("LLM_MODEL_SMALL", "accounts/fireworks/models/llama-v3p1-8b-instruct")
+LLM_MODEL_LARGE = env.str("LLM_MODEL_LARGE", MODEL_NAME)
+LLM_TIMEOUT_SMALL = env.float("LLM_TIMEOUT_SMALL", 30.0)
+LLM_TIMEOUT_LARGE = env.float("LLM_TIMEOUT_LARGE", 0.0)  # 0 = FIREWORKS_READ_TIMEOUT
+LLM_FALLBACK_SMALL = env.list("LLM_FALLBACK_SMALL", [LARGE])
+LLM_FALLBACK_LARGE = env.list("LLM_FALLBACK_LARGE", [])
+LLM_ROUTES = env.dict("LLM_ROUTES", {})
+
+router = ModelRouter(
+    models={SMALL: LLM_MODEL_SMALL, LARGE: LLM_MODEL_LARGE},
+    timeouts={SMALL: LLM_TIMEOUT_SMALL or None, LARGE: LLM_TIMEOUT_LARGE or None},
+    fallbacks={SMALL: LLM_FALLBACK_SMALL, LARGE: LLM_FALLBACK_LARGE},
+    routes=LLM_ROUTES
+)
+
+# HTTP client configuration (connection pool, timeouts in seconds, retries)
+FIREWORKS_POOL_SIZE = env.int("FIREWORKS_POOL_SIZE", 10)
+FIREWORKS_CONNECT_TIMEOUT = env.float("FIREWORKS_CONNECT_TIMEOUT", 5.0)
+FIREWORKS_READ_TIMEOUT = env.float("FIREWORKS_READ_TIMEOUT", 120.0)
+FIREWORKS_MAX_RETRIES = env.int("FIREWORKS_MAX_RETRIES", 3)
+FIREWORKS_BACKOFF_BASE = env.float("FIREWORKS_BACKOFF_BASE", 0.5)
+FIREWORKS_BACKOFF_MAX = env.float("FIREWORKS_BACKOFF_MAX", 20.0)
+
+# 429 and transient 5xx responses are retried, everything else fails immediately
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Max concurrent LLM calls per event loop for async callers (achat / run_llm_task)
+LLM_ASYNC_CONCURRENCY = env.int("LLM_ASYNC_CONCURRENCY", 4)
+
+# Response cache (opt-in): in-memory LRU + persistent SQLite tier
+LLM_CACHE_ENABLED = env.bool("LLM_CACHE_ENABLED", False)
+LLM_CACHE_PATH = env.str("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_MEMORY_ITEMS = env.int("LLM_CACHE_MEMORY_ITEMS", 256)
+LLM_CACHE_TTL = env.int("LLM_CACHE_TTL", 7 * 24 * 3600)
+LLM_CACHE_MAX_BYTES = env.int("LLM_CACHE_MAX_BYTES", 50 * 1024 * 1024)
+
+# Per-call telemetry (served at /metrics); the SQLite sink is off unless a path is set
+LLM_TELEMETRY_ENABLED = env.bool("LLM_TELEMETRY_ENABLED", True)
+LLM_TELEMETRY_DB_PATH = env.str("LLM_TELEMETRY_DB_PATH", "")
+LLM_PRICE_PER_MILLION_TOKENS = env.float("LLM_PRICE_PER_MILLION_TOKENS", 0.9)
+
+telemetry = LLMTelemetry(
+    enabled=LLM_TELEMETRY_ENABLED,
+    price_per_million_tokens=LLM_PRICE_PER_MILLION_TOKENS,
+    sink_path=LLM_TELEMETRY_DB_PATH or None
+)
+
+# Upstream protection: adaptive concurrency limit (per process) and circuit breaker
+LLM_UPSTREAM_GUARD_ENABLED = env.bool("LLM_UPSTREAM_GUARD_ENABLED", True)
+LLM_UPSTREAM_MIN_CONCURRENCY = env.int("LLM_UPSTREAM_MIN_CONCURRENCY", 1)
+LLM_UPSTREAM_MAX_CONCURRENCY = env.int("LLM_UPSTREAM_MAX_CONCURRENCY", FIREWORKS_POOL_SIZE)
+LLM_UPSTREAM_BACKOFF_RATIO = env.float("LLM_UPSTREAM_BACKOFF_RATIO", 0.7)
+LLM_UPSTREAM_LATENCY_TOLERANCE = env.float("LLM_UPSTREAM_LATENCY_TOLERANCE", 2.0)
+LLM_UPSTREAM_QUEUE_TIMEOUT = env.float("LLM_UPSTREAM_QUEUE_TIMEOUT", 30.0)
+LLM_BREAKER_FAILURE_THRESHOLD = env.int("LLM_BREAKER_FAILURE_THRESHOLD", 6)
+LLM_BREAKER_RESET_TIMEOUT = env.float("LLM_BREAKER_RESET_TIMEOUT", 30.0)
+
+# Priority classes sharing the limit while calls are queued (see upstream.priority_scope)
+LLM_PRIORITY_WEIGHTS = env.dict("LLM_PRIORITY_WEIGHTS", {}, subcast_values=float)
+LLM_PRIORITY_MAX_WAIT = env.float("LLM_PRIORITY_MAX_WAIT", 10.0)
+LLM_BACKGROUND_SHARE = env.float("LLM_BACKGROUND_SHARE", 0.5)
+
+upstream = UpstreamGuard(
+    AdaptiveLimiter(
+        initial_limit=LLM_UPSTREAM_MAX_CONCURRENCY,
+        min_limit=LLM_UPSTREAM_MIN_CONCURRENCY,
+        max_limit=LLM_UPSTREAM_MAX_CONCURRENCY,
+        backoff_ratio=LLM_UPSTREAM_BACKOFF_RATIO,
+        latency_tolerance=LLM_UPSTREAM_LATENCY_TOLERANCE,
+        weights=LLM_PRIORITY_WEIGHTS,
+        max_wait=LLM_PRIORITY_MAX_WAIT,
+        background_share=LLM_BACKGROUND_SHARE
+    ),
+    CircuitBreaker(
+        failure_threshold=LLM_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=LLM_BREAKER_RESET_TIMEOUT
+    ),
+    queue_timeout=LLM_UPSTREAM_QUEUE_TIMEOUT,
+    enabled=LLM_UPSTREAM_GUARD_ENABLED
+)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
     """
-    Send a chat request to Fireworks AI with automatic streaming for large responses
+    Return the shared keep-alive session used for every Fireworks call.
+    The underlying urllib3 pool is thread-safe, so one session is shared by
+    all Flask worker threads and reuses TCP+TLS connections between calls.
     """
-    headers = {
-        "Authorization": f"Bearer {FIREWORKS_API_KEY}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=FIREWORKS_POOL_SIZE,
+                    pool_block=True,  # Wait for a free connection instead of opening throwaway ones
+                    max_retries=0     # Retries are handled in _post_with_retries
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({
+                    "Authorization": f"Bearer {FIREWORKS_API_KEY}",
+                    "Content-Type": "application/json",
+                    "Accept": "application/json"
+                })
+                _http_session = session
+    return _http_session
+
+
+def _retry_delay(attempt, resp=None):
+    """
+    Seconds to wait before the next attempt.
+    Honors the Retry-After header when present, otherwise uses
+    exponential backoff with full jitter.
+    """
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), FIREWORKS_BACKOFF_MAX)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    wait = (retry_at - datetime.now(timezone.utc)).total_seconds()
+                    return min(max(wait, 0.0), FIREWORKS_BACKOFF_MAX)
+                except (TypeError, ValueError):
+                    pass
+
+    ceiling = min(FIREWORKS_BACKOFF_MAX, FIREWORKS_BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def _post_with_retries(payload, stream=False, call=None, slot=None, read_timeout=None):
+    """
+    POST a chat payload to Fireworks with timeouts and retries on 429/5xx/connection errors
+    Retries are counted on call (a telemetry.LLMCall) when given. Failed
+    attempts are reported to slot (an upstream.UpstreamSlot), and retrying
+    stops once the circuit breaker has opened. read_timeout overrides
+    FIREWORKS_READ_TIMEOUT (per model tier).
+    """
+    session = get_http_session()
+    timeout = (FIREWORKS_CONNECT_TIMEOUT, read_timeout or FIREWORKS_READ_TIMEOUT)
+
+    for attempt in range(FIREWORKS_MAX_RETRIES + 1):
+        is_last_attempt = attempt == FIREWORKS_MAX_RETRIES
+        try:
+            resp = session.post(FIREWORKS_API_URL, json=payload, stream=stream, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if slot is not None:
+                slot.failure()
+            if is_last_attempt:
+                raise RuntimeError(f"Fireworks API request failed after {attempt + 1} attempts: {e}") from e
+            _check_retry_allowed(slot)
+            if call is not None:
+                call.add_retry()
+            time.sleep(_retry_delay(attempt))
+            continue
+
+        if resp.status_code == 200:
+            return resp
+
+        if resp.status_code in RETRYABLE_STATUS_CODES and slot is not None:
+            slot.failure()
+
+        if resp.status_code in RETRYABLE_STATUS_CODES and not is_last_attempt:
+            delay = _retry_delay(attempt, resp)
+            resp.close()
+            _check_retry_allowed(slot)
+            if call is not None:
+                call.add_retry()
+            time.sleep(delay)
+            continue
 
-    # Default generation options
+        try:
+            raise RuntimeError(f"Fireworks API error {resp.status_code}: {resp.text}")
+        finally:
+            resp.close()
+
+
+def _check_retry_allowed(slot):
+    """Stop retrying once the circuit breaker has opened"""
+    if slot is not None and not slot.allows_retry():
+        raise UpstreamUnavailable("LLM upstream is unavailable (circuit opened while retrying)",
+                                  retry_after=LLM_BREAKER_RESET_TIMEOUT)
+
+
+def _generation_options(options=None):
+    """Default generation options, overridden by the caller's options"""
     opts = {
         "max_tokens": 6000,
         "temperature": 0.7,
@@ -38,6 +232,111 @@ def chat(
     }
     if options:
         opts.update(options)
+    return opts
+
+
+def _iter_stream_deltas(resp, call=None):
+    """
+    Yield the text deltas of a Fireworks SSE response until [DONE]
+    The first delta and the usage block (sent with the last chunk) are recorded on call
+    """
+    for line in resp.iter_lines():
+        if line:
+            line_text = line.decode('utf-8')
+            if line_text.startswith('data: '):
+                chunk_data = line_text[6:]  # Remove 'data: ' prefix
+                if chunk_data.strip() == '[DONE]':
+                    break
+                try:
+                    chunk_json = json.loads(chunk_data)
+                    if call is not None and chunk_json.get('usage'):
+                        call.set_usage(chunk_json['usage'])
+                    if 'choices' in chunk_json and len(chunk_json['choices']) > 0:
+                        delta = chunk_json['choices'][0].get('delta', {})
+                        content = delta.get('content', '')
+                        if content:
+                            if call is not None:
+                                call.mark_first_byte()
+                            yield content
+                except json.JSONDecodeError:
+                    continue  # Skip malformed chunks
+
+
+def _read_stream(resp, call, slot):
+    """_iter_stream_deltas that reports a connection dropped mid-stream to the upstream slot"""
+    try:
+        yield from _iter_stream_deltas(resp, call)
+    except requests.RequestException:
+        slot.failure(congestion=False)
+        raise
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the shared response cache, or None when LLM_CACHE_ENABLED is off"""
+    global _response_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    LLM_CACHE_PATH,
+                    memory_items=LLM_CACHE_MEMORY_ITEMS,
+                    ttl_seconds=LLM_CACHE_TTL,
+                    max_bytes=LLM_CACHE_MAX_BYTES
+                )
+    return _response_cache
+
+
+def chat(
+        model: str,
+        messages: list[dict],
+        options: dict = None,
+        use_cache: bool = True,
+        call_site: str = None
+):
+    """
+    Send a chat request to Fireworks AI with automatic streaming for large responses.
+    Responses are served from / stored in the response cache when it is enabled;
+    pass use_cache=False for calls that should always get a fresh generation.
+    call_site labels the call in telemetry (e.g. "generate_study_guide").
+    A failed call on a routed model (see load_llm) is retried on its tier's
+    fallback chain.
+    """
+    opts = _generation_options(options)
+    attempts = router.chain(model)
+
+    for position, (tier, attempt_model, read_timeout) in enumerate(attempts):
+        try:
+            return _chat_once(attempt_model, messages, opts, use_cache, call_site, tier, read_timeout)
+        except UpstreamUnavailable:
+            raise  # All tiers share the provider, so another tier won't help
+        except Exception as e:
+            if position == len(attempts) - 1:
+                raise
+            _record_model_fallback(call_site, tier, attempts[position + 1][0], e)
+
+
+def _record_model_fallback(call_site, from_tier, to_tier, error):
+    print(f"LLM call {call_site} failed on the {from_tier} model ({error}); falling back to {to_tier}")
+    telemetry.record_fallback(call_site, from_tier, to_tier)
+
+
+def _chat_once(model, messages, opts, use_cache, call_site, tier, read_timeout):
+    """One chat() attempt on a single model"""
+    call = telemetry.start_call(call_site, model, tier)
+
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cache_key = make_cache_key(model, messages, opts)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            call.finish('cache_hit')
+            return cached
 
     # Automatically enable streaming if max_tokens > 5000
     max_tokens = opts.get("max_tokens", 6000)
@@ -51,49 +350,170 @@ def chat(
         **opts
     }
 
-    if use_streaming:
-        # Handle streaming response
-        resp = requests.post(FIREWORKS_API_URL, headers=headers, json=payload, stream=True)
-        if resp.status_code != 200:
-            raise RuntimeError(f"Fireworks API error {resp.status_code}: {resp.text}")
+    try:
+        with upstream.slot(latency_key=model) as slot:
+            if use_streaming:
+                # Handle streaming response
+                resp = _post_with_retries(payload, stream=True, call=call, slot=slot, read_timeout=read_timeout)
+
+                # Collect streamed chunks
+                with resp:
+                    response_text = "".join(_read_stream(resp, call, slot))
+            else:
+                # Handle non-streaming response (for max_tokens <= 5000)
+                resp = _post_with_retries(payload, call=call, slot=slot, read_timeout=read_timeout)
+                call.mark_first_byte()
+                with resp:
+                    data = resp.json()
+                call.set_usage(data.get("usage"))
+                response_text = data["choices"][0]["message"]["content"]
+            slot.success(call.completion_tokens)
+    except UpstreamUnavailable:
+        stale = cache.get(cache_key, allow_expired=True) if cache is not None else None
+        if stale is None:
+            call.finish('rejected')
+            raise
+        # Better an old answer to the same prompt than an error page
+        upstream.record_fallback()
+        call.finish('stale_cache_hit')
+        return stale
+    except Exception:
+        call.finish('error')
+        raise
+    call.finish('success')
+
+    if cache is not None and response_text:
+        cache.set(cache_key, response_text)
+
+    return response_text
+
+
+def chat_stream(
+        model: str,
+        messages: list[dict],
+        options: dict = None,
+        use_cache: bool = True,
+        call_site: str = None
+):
+    """
+    Generator variant of chat() that always streams and yields text deltas
+    as they arrive, for forwarding tokens to the browser. A cache hit is
+    yielded as a single chunk; the complete reply is cached at the end.
+    Falls back to the next tier only if nothing was yielded yet.
+    """
+    opts = _generation_options(options)
+    attempts = router.chain(model)
 
-        # Collect streamed chunks
-        full_response = ""
-        for line in resp.iter_lines():
-            if line:
-                line_text = line.decode('utf-8')
-                if line_text.startswith('data: '):
-                    chunk_data = line_text[6:]  # Remove 'data: ' prefix
-                    if chunk_data.strip() == '[DONE]':
-                        break
-                    try:
-                        chunk_json = json.loads(chunk_data)
-                        if 'choices' in chunk_json and len(chunk_json['choices']) > 0:
-                            delta = chunk_json['choices'][0].get('delta', {})
-                            content = delta.get('content', '')
-                            full_response += content
-                    except json.JSONDecodeError:
-                        continue  # Skip malformed chunks
-
-        return full_response
-    else:
-        # Handle non-streaming response (for max_tokens <= 5000)
-        resp = requests.post(FIREWORKS_API_URL, headers=headers, json=payload)
-        if resp.status_code != 200:
-            raise RuntimeError(f"Fireworks API error {resp.status_code}: {resp.text}")
+    for position, (tier, attempt_model, read_timeout) in enumerate(attempts):
+        started = False
+        try:
+            for delta in _chat_stream_once(attempt_model, messages, opts, use_cache, call_site, tier, read_timeout):
+                started = True
+                yield delta
+            return
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            if started or position == len(attempts) - 1:
+                raise
+            _record_model_fallback(call_site, tier, attempts[position + 1][0], e)
+
+
+def _chat_stream_once(model, messages, opts, use_cache, call_site, tier, read_timeout):
+    """One chat_stream() attempt on a single model"""
+    call = telemetry.start_call(call_site, model, tier)
+
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cache_key = make_cache_key(model, messages, opts)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            call.finish('cache_hit')
+            yield cached
+            return
+
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        **opts
+    }
 
-        data = resp.json()
-        return data["choices"][0]["message"]["content"]
+    parts = []
+    try:
+        with upstream.slot(latency_key=model) as slot:
+            resp = _post_with_retries(payload, stream=True, call=call, slot=slot, read_timeout=read_timeout)
+            with resp:
+                for delta in _read_stream(resp, call, slot):
+                    parts.append(delta)
+                    yield delta
+            slot.success(call.completion_tokens)
+    except GeneratorExit:
+        call.finish('cancelled')  # Client went away mid-stream
+        raise
+    except UpstreamUnavailable:
+        call.finish('rejected')
+        raise
+    except Exception:
+        call.finish('error')
+        raise
+    call.finish('success')
+
+    if cache is not None and parts:
+        cache.set(cache_key, "".join(parts))
+
+
+# asyncio.Semaphore is bound to the loop it is first used on, so keep one per loop
+_async_semaphores = weakref.WeakKeyDictionary()
+
+
+def _get_async_semaphore():
+    """Return the concurrency semaphore for the running event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _async_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(LLM_ASYNC_CONCURRENCY)
+        _async_semaphores[loop] = semaphore
+    return semaphore
+
+
+async def run_llm_task(func, *args, **kwargs):
+    """
+    Run a blocking LLM-bound function (chat or a helper that calls it) in a
+    worker thread, bounded by the per-loop concurrency semaphore
+    """
+    queued_at = time.monotonic()
+    async with _get_async_semaphore():
+        # Copied into the worker thread's context, so chat() can report the queue wait
+        token = set_queued_at(queued_at)
+        try:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        finally:
+            reset_queued_at(token)
 
 
-def load_llm(api_key=None):
-    """Compatibility function - just returns model name"""
-    return MODEL_NAME
+async def achat(
+        model: str,
+        messages: list[dict],
+        options: dict = None,
+        use_cache: bool = True,
+        call_site: str = None
+):
+    """
+    Async counterpart of chat(). Uses the same pooled client, so keep-alive
+    connections, timeouts and retries are shared with synchronous callers.
+    """
+    return await run_llm_task(chat, model, messages, options, use_cache=use_cache, call_site=call_site)
 
 
-def load_llm1(api_key=None):
-    """Compatibility function - just returns model name"""
-    return MODEL_NAME
+def load_llm(call_site=None):
+    """Model name for a call site per the routing table (the large model by default)"""
+    return router.model_for(call_site)
+
+
+def load_llm1(call_site=None):
+    """Compatibility alias of load_llm"""
+    return load_llm(call_site)
 
 
 # ====================
@@ -239,15 +659,36 @@ def extract_duration(activity_text):
     return 45
 
 
-def generate_task_content(task_title, task_type, study_guide_summary, model):
+def _generate_json_response(prompt, model, options, call_site, on_item=None, keys=()):
+    """
+    Run a prompt that answers with a JSON object. With on_item the response is
+    streamed and on_item(key, index, element) is called for every element of
+    the top-level arrays in keys as soon as it is complete.
+    """
+    messages = [{"role": "user", "content": prompt}]
+    if on_item is None:
+        return chat(model=model, messages=messages, options=options, call_site=call_site)
+
+    parser = StreamingArrayParser(keys)
+    parts = []
+    for delta in chat_stream(model=model, messages=messages, options=options, call_site=call_site):
+        parts.append(delta)
+        for key, index, element in parser.feed(delta):
+            on_item(key, index, element)
+    return "".join(parts)
+
+
+def generate_task_content(task_title, task_type, study_guide_summary, model, on_item=None):
     """
     Generate specific content for a task (theory or test)
 
     Args:
         task_title: The title of the task
         task_type: 'study', 'review', 'practice', 'test', 'checkpoint'
-        study_guide_summary: Summary of the course study guide
+        study_guide_summary: Relevant study guide topics (trimmed to the prompt's token budget)
         model: The model to use for generation
+        on_item: optional callback(key, index, element) called with each lesson
+            step / test question / solution as soon as it has been generated
 
     Returns:
         dict with 'theory_content', 'test_questions', 'test_solutions'
@@ -255,10 +696,10 @@ def generate_task_content(task_title, task_type, study_guide_summary, model):
 
     if task_type in ['test', 'checkpoint']:
         # Generate test questions and solutions
-        prompt = f"""Based on this course material, create a focused test for: {task_title}
+        prompt = build_prompt('generate_task_content', lambda guide: f"""Based on this course material, create a focused test for: {task_title}
 
 Study Guide Context:
-{study_guide_summary}
+{guide}
 
 Create 5 questions about this topic. For each question:
 1. Make it specific and test understanding
@@ -275,27 +716,24 @@ Return in this JSON format:
         {{"question_num": 1, "answer": "A", "explanation": "Detailed explanation..."}},
         ...
     ]
-}}"""
-
-        response = chat(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            options={"max_tokens": 2000, "temperature": 0.7}
+}}""", guide=Section(study_guide_summary))
+
+        response = _generate_json_response(
+            prompt, model,
+            options={"max_tokens": 2000, "temperature": 0.7},
+            call_site="generate_task_content",
+            on_item=on_item,
+            keys=('questions', 'solutions')
         )
 
-        try:
-            # Try to extract JSON from response
-            json_start = response.find('{')
-            json_end = response.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                test_data = json.loads(response[json_start:json_end])
-                return {
-                    'theory_content': None,
-                    'test_questions': json.dumps(test_data.get('questions', [])),
-                    'test_solutions': json.dumps(test_data.get('solutions', []))
-                }
-        except:
-            pass
+        # Truncated responses are repaired down to their complete questions
+        test_data, _ = parse_json_response(response)
+        if _is_valid_test(test_data):
+            return {
+                'theory_content': None,
+                'test_questions': json.dumps(test_data['questions']),
+                'test_solutions': json.dumps(test_data.get('solutions', []))
+            }
 
         # Fallback: return raw text
         return {
@@ -306,10 +744,10 @@ Return in this JSON format:
 
     else:
         # Generate theory content for study tasks in steps
-        prompt = f"""Based on this course material, create engaging step-by-step study content for: {task_title}
+        prompt = build_prompt('generate_task_content', lambda guide: f"""Based on this course material, create engaging step-by-step study content for: {task_title}
 
 Study Guide Context:
-{study_guide_summary}
+{guide}
 
 Create 3-5 varied learning steps. Each step should have a DIFFERENT purpose and format:
 
@@ -352,27 +790,24 @@ Return in this JSON format:
             "type": "practice"
         }}
     ]
-}}"""
-
-        response = chat(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            options={"max_tokens": 1500, "temperature": 0.7}
+}}""", guide=Section(study_guide_summary))
+
+        response = _generate_json_response(
+            prompt, model,
+            options={"max_tokens": 1500, "temperature": 0.7},
+            call_site="generate_task_content",
+            on_item=on_item,
+            keys=('steps',)
         )
 
-        try:
-            # Try to extract JSON from response
-            json_start = response.find('{')
-            json_end = response.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                theory_data = json.loads(response[json_start:json_end])
-                return {
-                    'theory_content': json.dumps(theory_data),
-                    'test_questions': None,
-                    'test_solutions': None
-                }
-        except:
-            pass
+        # Truncated responses are repaired down to their complete steps
+        theory_data, _ = parse_json_response(response)
+        if _is_valid_steps(theory_data):
+            return {
+                'theory_content': json.dumps(theory_data),
+                'test_questions': None,
+                'test_solutions': None
+            }
 
         # Fallback: create a simple single-step structure
         return {
@@ -387,4 +822,170 @@ Return in this JSON format:
             }),
             'test_questions': None,
             'test_solutions': None
-        }
\ No newline at end of file
+        }
+
+def _is_valid_steps(data):
+    """Check a parsed lesson looks like {"steps": [{"title", "content", ...}, ...]}"""
+    steps = data.get('steps') if isinstance(data, dict) else None
+    return (isinstance(steps, list) and len(steps) > 0 and
+            all(isinstance(step, dict) and step.get('content') for step in steps))
+
+
+def _is_valid_test(data):
+    """Check a parsed test looks like {"questions": [{"question", ...}, ...], "solutions": [...]}"""
+    questions = data.get('questions') if isinstance(data, dict) else None
+    return (isinstance(questions, list) and len(questions) > 0 and
+            all(isinstance(q, dict) and q.get('question') for q in questions))
+
+
+def generate_task_content_batch(tasks, study_guide_summary, model):
+    """
+    Generate content for several tasks (e.g. a whole week) in ONE API call,
+    so the study guide context is sent once instead of once per task
+
+    Args:
+        tasks: list of dicts with 'id', 'title' and 'activity_type'
+        study_guide_summary: Relevant study guide topics (trimmed to the prompt's token budget)
+        model: The model to use for generation
+
+    Returns:
+        dict mapping task id -> dict with 'theory_content', 'test_questions', 'test_solutions'.
+        Tasks whose part of the response is missing or malformed are left out,
+        so the caller can fall back to generate_task_content for them.
+    """
+    if not tasks:
+        return {}
+
+    task_lines = []
+    for task in tasks:
+        kind = 'test' if task['activity_type'] in ['test', 'checkpoint'] else 'lesson'
+        task_lines.append(f'- "{task["id"]}" ({kind}): {task["title"]}')
+
+    prompt = build_prompt('generate_task_content_batch', lambda guide: f"""Based on this course material, create content for EACH of the following tasks.
+
+Study Guide Context:
+{guide}
+
+Tasks (key, kind and title):
+{chr(10).join(task_lines)}
+
+For every "lesson" task create 3-5 varied learning steps:
+- Each step serves a DIFFERENT purpose (introduction, core concept, real-world example/analogy, deep dive)
+- Keep each step focused and concise (80-120 words)
+- The last step is always a practice question
+- Use EXACTLY these type values: "theory", "example", or "practice"
+
+For every "test" task create 5 questions (multiple choice or short answer) with a detailed solution for each.
+
+Return ONE JSON object keyed by the task key, in this format:
+{{
+    "101": {{
+        "steps": [
+            {{"title": "Why This Matters", "content": "Brief intro explaining relevance...", "type": "theory"}},
+            {{"title": "Real-World Application", "content": "Concrete example or analogy...", "type": "example"}},
+            {{"title": "Quick Check", "content": "Think about this: [question]", "type": "practice"}}
+        ]
+    }},
+    "102": {{
+        "questions": [
+            {{"question": "Question text here?", "options": ["A) ...", "B) ...", "C) ...", "D) ..."], "correct": "A"}}
+        ],
+        "solutions": [
+            {{"question_num": 1, "answer": "A", "explanation": "Detailed explanation..."}}
+        ]
+    }}
+}}
+
+Include every task key listed above. Return ONLY the JSON object.""", guide=Section(study_guide_summary))
+
+    response = chat(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        options={"max_tokens": min(1200 * len(tasks), 12000), "temperature": 0.7},
+        call_site="generate_task_content_batch"
+    )
+
+    # A truncated batch keeps its complete tasks; the cut-off one is regenerated individually
+    batch_data, _ = parse_json_response(response, max_depth=1)
+    if batch_data is None:
+        return {}
+
+    contents = {}
+    for task in tasks:
+        data = batch_data.get(str(task['id']))
+
+        if task['activity_type'] in ['test', 'checkpoint']:
+            if _is_valid_test(data):
+                contents[task['id']] = {
+                    'theory_content': None,
+                    'test_questions': json.dumps(data['questions']),
+                    'test_solutions': json.dumps(data.get('solutions', []))
+                }
+        elif _is_valid_steps(data):
+            contents[task['id']] = {
+                'theory_content': json.dumps({'steps': data['steps']}),
+                'test_questions': None,
+                'test_solutions': None
+            }
+
+    return contents
+
+
+def adapt_task_content(existing_content, task_title, task_type, model):
+    """
+    Lightly adapt library content written for a similar task to a new task title.
+    Much cheaper than generate_task_content: no study guide context and the
+    model only edits an existing lesson/test.
+
+    Args:
+        existing_content: dict with 'theory_content', 'test_questions', 'test_solutions'
+        task_title: The title of the new task
+        task_type: 'study', 'review', 'practice', 'test', 'checkpoint'
+        model: The model to use for adaptation
+
+    Returns:
+        adapted content dict, or None if the response is malformed
+    """
+    is_test = task_type in ['test', 'checkpoint']
+    if is_test:
+        existing = json.dumps({
+            'questions': json.loads(existing_content['test_questions']),
+            'solutions': json.loads(existing_content.get('test_solutions') or '[]')
+        })
+    else:
+        existing = existing_content['theory_content']
+
+    prompt = f"""Here is existing {'test' if is_test else 'lesson'} content written for a closely related task:
+
+{existing}
+
+Adapt it for the task: {task_title}
+
+Keep the same JSON structure, number of {'questions' if is_test else 'steps'} and style.
+Only change wording, titles and examples where needed so it fits the new task exactly.
+Return ONLY the JSON object."""
+
+    response = chat(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        options={"max_tokens": 2000 if is_test else 1500, "temperature": 0.3},
+        call_site="adapt_task_content"
+    )
+
+    data, _ = parse_json_response(response)
+    if is_test:
+        if not _is_valid_test(data):
+            return None
+        return {
+            'theory_content': None,
+            'test_questions': json.dumps(data['questions']),
+            'test_solutions': json.dumps(data.get('solutions', []))
+        }
+
+    if not _is_valid_steps(data):
+        return None
+    return {
+        'theory_content': json.dumps({'steps': data['steps']}),
+        'test_questions': None,
+        'test_solutions': None
+    }
@@ -0,0 +1,593 @@
+"""
+Lesson content generation and background prefetching
+Routes and the prefetcher share generate_activity_content so content is
+produced and saved the same way whether the user is waiting for it or not.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import db
+import study_guide_index
+from content_library import ContentLibrary
+from funcs import env, adapt_task_content, generate_task_content, generate_task_content_batch, load_llm
+from singleflight import SingleFlight
+from upstream import BACKGROUND, priority_scope
+
+# Max activities generated together in one batched LLM call
+LESSON_BATCH_SIZE = env.int("LESSON_BATCH_SIZE", 7)
+
+# Generation leases: how long a lease lasts without renewal (holders renew it
+# every third of that while generating, so only a dead holder's lease runs
+# out), and how often waiters in other processes check for the finished content
+CONTENT_LEASE_TTL = env.float("CONTENT_LEASE_TTL", 120.0)
+CONTENT_LEASE_POLL_INTERVAL = env.float("CONTENT_LEASE_POLL_INTERVAL", 0.5)
+
+# Parallel generation for a day with several activities: shared worker pool
+# size and how long a request waits before returning what has finished. By
+# default it doesn't wait: unfinished activities are followed step by step
+# over their content stream instead
+LESSON_PARALLEL_WORKERS = env.int("LESSON_PARALLEL_WORKERS", 4)
+LESSON_REQUEST_DEADLINE = env.float("LESSON_REQUEST_DEADLINE", 0.0)
+
+# Shared content library: title similarity needed to reuse an entry as-is or
+# to adapt it with a short LLM call, and the minimum study-guide similarity
+CONTENT_LIBRARY_ENABLED = env.bool("CONTENT_LIBRARY_ENABLED", True)
+CONTENT_LIBRARY_REUSE_THRESHOLD = env.float("CONTENT_LIBRARY_REUSE_THRESHOLD", 0.9)
+CONTENT_LIBRARY_ADAPT_THRESHOLD = env.float("CONTENT_LIBRARY_ADAPT_THRESHOLD", 0.75)
+CONTENT_LIBRARY_GUIDE_THRESHOLD = env.float("CONTENT_LIBRARY_GUIDE_THRESHOLD", 0.5)
+
+# Study guide chunks (by BM25 relevance to the task) put in each lesson prompt;
+# 0 sends the whole guide, trimmed to the prompt budget
+STUDY_GUIDE_TOP_K = env.int("STUDY_GUIDE_TOP_K", 3)
+
+# Prefetch configuration
+PREFETCH_ENABLED = env.bool("PREFETCH_ENABLED", True)
+PREFETCH_LOOKAHEAD = env.int("PREFETCH_LOOKAHEAD", 3)  # Upcoming activities to pre-generate
+PREFETCH_WORKERS = env.int("PREFETCH_WORKERS", 2)      # Also the cap on concurrent upstream calls from prefetch
+
+
+# ====================
+# CONTENT LIBRARY
+# ====================
+
+content_library = ContentLibrary(
+    reuse_threshold=CONTENT_LIBRARY_REUSE_THRESHOLD,
+    adapt_threshold=CONTENT_LIBRARY_ADAPT_THRESHOLD,
+    guide_threshold=CONTENT_LIBRARY_GUIDE_THRESHOLD
+)
+
+
+def _content_from_library(activity: Dict, course: Dict) -> Optional[Dict]:
+    """
+    Reuse or adapt library content for an activity
+    Returns a content dict, or None if nothing similar enough exists
+    """
+    if not CONTENT_LIBRARY_ENABLED:
+        return None
+
+    try:
+        entry_id, score, decision = content_library.find(
+            activity['title'], activity['activity_type'], course['study_guide'], course_id=course['id']
+        )
+        if decision == 'miss':
+            return None
+
+        entry = db.get_content_library_entry(entry_id)
+        if not entry:
+            return None
+        content = _stored_content(entry)
+
+        if decision == 'adapt':
+            content = adapt_task_content(content, activity['title'], activity['activity_type'],
+                                         load_llm('adapt_task_content'))
+            if content is None:
+                return None
+            content_library.add(activity['title'], activity['activity_type'], course['study_guide'],
+                                content, source_activity_id=activity['id'])
+
+        db.increment_content_library_reuse(entry_id)
+        print(f"Content library {decision} for activity {activity['id']} (similarity {score})")
+        return content
+    except Exception as e:
+        print(f"Error looking up content library for activity {activity['id']}: {e}")
+        return None
+
+
+def _add_to_library(activity: Dict, course: Dict, content: Dict):
+    """Offer freshly generated content to the library"""
+    if not CONTENT_LIBRARY_ENABLED:
+        return
+    try:
+        content_library.add(activity['title'], activity['activity_type'], course['study_guide'],
+                            content, source_activity_id=activity['id'])
+    except Exception as e:
+        print(f"Error adding activity {activity['id']} to content library: {e}")
+
+
+def content_library_stats() -> Dict:
+    """Reuse counters and thresholds of the content library"""
+    stats = content_library.stats()
+    stats['enabled'] = CONTENT_LIBRARY_ENABLED
+    return stats
+
+
+# ====================
+# STUDY GUIDE CONTEXT
+# ====================
+
+def _study_guide_context(activities: List[Dict], course: Dict) -> str:
+    """The parts of the study guide relevant to the activities being generated"""
+    if STUDY_GUIDE_TOP_K <= 0:
+        return course['study_guide']
+
+    queries = [f"{a['title']} {a.get('description') or ''}" for a in activities]
+    try:
+        return study_guide_index.select_context(course, queries, STUDY_GUIDE_TOP_K)
+    except Exception as e:
+        print(f"Error selecting study guide context for course {course['id']}: {e}")
+        return course['study_guide']
+
+
+# ====================
+# GENERATION PROGRESS
+# ====================
+
+class _ContentProgress:
+    """Steps/questions generated so far for one activity, for streaming to clients"""
+
+    def __init__(self):
+        self.items = []  # (key, index, element) in generation order
+        self.done = False
+        self.condition = threading.Condition()
+
+
+_progress = {}  # activity id -> _ContentProgress while its content is being generated
+_progress_lock = threading.Lock()
+
+
+def _progress_recorder(activity_id: int, progress: _ContentProgress):
+    """
+    on_item callback for generate_task_content: publishes each finished
+    step/question to stream listeners and saves the partial content
+    """
+    collected = {'steps': [], 'questions': []}
+
+    def on_item(key, index, element):
+        with progress.condition:
+            progress.items.append((key, index, element))
+            progress.condition.notify_all()
+
+        if key not in collected:
+            return
+        collected[key].append(element)
+        try:
+            if key == 'steps':
+                db.save_partial_activity_content(activity_id, theory_content=json.dumps({'steps': collected['steps']}))
+            else:
+                db.save_partial_activity_content(activity_id, test_questions=json.dumps(collected['questions']))
+        except Exception as e:
+            print(f"Error saving partial content for activity {activity_id}: {e}")
+
+    return on_item
+
+
+def _generate_with_progress(activity: Dict, course: Dict) -> Dict:
+    """Generate an activity's content, publishing steps as they stream in"""
+    progress = _ContentProgress()
+    with _progress_lock:
+        _progress[activity['id']] = progress
+
+    try:
+        return generate_task_content(
+            task_title=activity['title'],
+            task_type=activity['activity_type'],
+            study_guide_summary=_study_guide_context([activity], course),
+            model=load_llm('generate_task_content'),
+            on_item=_progress_recorder(activity['id'], progress)
+        )
+    finally:
+        with _progress_lock:
+            _progress.pop(activity['id'], None)
+        with progress.condition:
+            progress.done = True
+            progress.condition.notify_all()
+
+
+# ====================
+# CONTENT GENERATION
+# ====================
+
+def generate_activity_content(activity: Dict, course: Dict, use_library: bool = True) -> Dict:
+    """
+    Get theory/test content for one activity (from the content library if a
+    similar lesson exists, otherwise generated) and save it
+    Returns dict with 'theory_content', 'test_questions', 'test_solutions'
+    """
+    content = _content_from_library(activity, course) if use_library else None
+
+    if content is None:
+        content = _generate_with_progress(activity, course)
+        _add_to_library(activity, course, content)
+
+    db.update_activity_content(
+        activity['id'],
+        theory_content=content.get('theory_content'),
+        test_questions=content.get('test_questions'),
+        test_solutions=content.get('test_solutions')
+    )
+
+    return content
+
+
+# ====================
+# SINGLE-FLIGHT GENERATION
+# ====================
+
+_content_flights = SingleFlight()
+
+
+def _lease_owner() -> str:
+    """Identify this process and thread as a lease holder"""
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+# Leases this process holds (activity id -> owner), renewed in the background:
+# one generation can outlast a TTL (read timeout x retries plus backoff, or a
+# batch followed by individual retries)
+_held_leases = {}
+_held_leases_lock = threading.Lock()
+_lease_renewer_pid = None
+
+
+def _renew_held_leases():
+    """Worker: keep this process's leases from expiring while their generations run"""
+    while True:
+        time.sleep(CONTENT_LEASE_TTL / 3)
+        with _held_leases_lock:
+            held = list(_held_leases.items())
+        if not held:
+            continue
+        try:
+            db.renew_generation_leases(held, CONTENT_LEASE_TTL)
+        except Exception as e:
+            print(f"Error renewing generation leases: {e}")
+
+
+def _acquire_lease(activity_id: int, owner: str) -> bool:
+    """Take an activity's generation lease and keep renewing it until _release_lease"""
+    global _lease_renewer_pid
+    if not db.acquire_generation_lease(activity_id, owner, CONTENT_LEASE_TTL):
+        return False
+
+    with _held_leases_lock:
+        _held_leases[activity_id] = owner
+        if _lease_renewer_pid != os.getpid():
+            _lease_renewer_pid = os.getpid()
+            threading.Thread(target=_renew_held_leases, name='lease-renewer', daemon=True).start()
+    return True
+
+
+def _release_lease(activity_id: int, owner: str):
+    with _held_leases_lock:
+        _held_leases.pop(activity_id, None)
+    db.release_generation_lease(activity_id, owner)
+
+
+def _stored_content(activity: Dict) -> Dict:
+    """Content dict of an activity whose content was already generated"""
+    return {
+        'theory_content': activity.get('theory_content'),
+        'test_questions': activity.get('test_questions'),
+        'test_solutions': activity.get('test_solutions')
+    }
+
+
+def _generate_under_lease(activity_id: int, course: Dict) -> Dict:
+    """
+    Generate an activity's content while holding its DB lease. If another
+    process holds the lease, wait for its result (or for the lease to expire).
+    """
+    owner = _lease_owner()
+
+    while True:
+        activity = db.get_activity_by_id(activity_id)
+        if not activity:
+            raise ValueError(f"Activity {activity_id} not found")
+        if activity.get('content_generated'):
+            return _stored_content(activity)
+
+        if _acquire_lease(activity_id, owner):
+            try:
+                # Someone may have finished between our check and taking the lease
+                activity = db.get_activity_by_id(activity_id)
+                if activity.get('content_generated'):
+                    return _stored_content(activity)
+                return generate_activity_content(activity, course)
+            finally:
+                _release_lease(activity_id, owner)
+
+        time.sleep(CONTENT_LEASE_POLL_INTERVAL)
+
+
+def ensure_activity_content(activity: Dict, course: Dict) -> Dict:
+    """
+    Return an activity's content, generating it if needed. Concurrent requests
+    for the same activity share one generation: threads of this process via
+    single-flight, other worker processes via the DB lease.
+    """
+    if activity.get('content_generated'):
+        return _stored_content(activity)
+
+    return _content_flights.do(
+        activity['id'],
+        lambda: _generate_under_lease(activity['id'], course)
+    )
+
+
+_lesson_executor = None
+_lesson_executor_lock = threading.Lock()
+
+
+def _get_lesson_executor() -> ThreadPoolExecutor:
+    """Return the worker pool used for on-demand parallel generation"""
+    global _lesson_executor
+    if _lesson_executor is None:
+        with _lesson_executor_lock:
+            if _lesson_executor is None:
+                _lesson_executor = ThreadPoolExecutor(
+                    max_workers=LESSON_PARALLEL_WORKERS,
+                    thread_name_prefix='lesson-generate'
+                )
+    return _lesson_executor
+
+
+def ensure_activities_content(activities: List[Dict], course: Dict,
+                              deadline: Optional[float] = None) -> Tuple[Dict[int, Dict], Dict[int, Exception]]:
+    """
+    Make sure several activities have content, generating the missing ones in
+    parallel and waiting at most `deadline` seconds (default LESSON_REQUEST_DEADLINE).
+    Each activity is saved as soon as its generation finishes; ones still running
+    at the deadline keep going in the background.
+    Returns (contents, errors): activity id -> content for activities that are
+    ready, and activity id -> exception for ones whose generation failed.
+    Activities in neither are still being generated.
+    """
+    deadline = LESSON_REQUEST_DEADLINE if deadline is None else deadline
+
+    results = {a['id']: _stored_content(a) for a in activities if a.get('content_generated')}
+    errors = {}
+    missing = [a for a in activities if not a.get('content_generated')]
+    if not missing:
+        return results, errors
+
+    executor = _get_lesson_executor()
+    # copy_context carries the caller's LLM priority into the worker threads
+    futures = {
+        executor.submit(contextvars.copy_context().run, ensure_activity_content, a, course): a['id']
+        for a in missing
+    }
+    done, _ = wait(futures, timeout=deadline)
+
+    for future in done:
+        activity_id = futures[future]
+        try:
+            results[activity_id] = future.result()
+        except Exception as e:
+            print(f"Error generating content for activity {activity_id}: {e}")
+            errors[activity_id] = e
+
+    return results, errors
+
+
+def stream_activity_content(activity: Dict, course: Dict,
+                            poll_interval: float = 0.5) -> Iterator[Tuple]:
+    """
+    Generate an activity's content (or join the generation already running)
+    and yield ('item', key, index, element) for each step/question as soon as
+    it is complete, then ('done', content). Steps generated before the caller
+    attached are yielded first. Generation in another worker process can't be
+    followed step by step; only its final content is yielded.
+    """
+    if activity.get('content_generated'):
+        yield ('done', _stored_content(activity))
+        return
+
+    future = _get_lesson_executor().submit(contextvars.copy_context().run, ensure_activity_content, activity, course)
+    sent = 0
+    progress = None
+
+    while not future.done():
+        with _progress_lock:
+            progress = _progress.get(activity['id'], progress)
+
+        if progress is None:
+            wait([future], timeout=poll_interval)
+            continue
+
+        with progress.condition:
+            if len(progress.items) <= sent and not progress.done:
+                progress.condition.wait(timeout=poll_interval)
+            new_items = progress.items[sent:]
+
+        for key, index, element in new_items:
+            yield ('item', key, index, element)
+        sent += len(new_items)
+
+    yield ('done', future.result())
+
+
+def generate_activities_content(activities: List[Dict], course: Dict) -> Dict[int, Dict]:
+    """
+    Generate and save content for several activities of one course, one LLM
+    call per LESSON_BATCH_SIZE activities. Activities missing from or malformed
+    in a batch response are regenerated individually. Activities another
+    worker is already generating (lease held) are skipped.
+    Returns dict mapping activity id -> content dict
+    """
+    owner = _lease_owner()
+    leased = [a for a in activities
+              if _acquire_lease(a['id'], owner)]
+
+    try:
+        return _generate_leased_activities(leased, course)
+    finally:
+        for activity in leased:
+            _release_lease(activity['id'], owner)
+
+
+def _generate_leased_activities(activities: List[Dict], course: Dict) -> Dict[int, Dict]:
+    """Batch-generate content for activities whose leases we hold"""
+    results = {}
+
+    # Re-check now that we hold the leases; another worker may have finished first
+    fresh = [db.get_activity_by_id(a['id']) for a in activities]
+    activities = [a for a in fresh if a and not a.get('content_generated')]
+
+    # Activities the content library can serve don't need to go to the LLM
+    library_contents = {}
+    for activity in activities:
+        content = _content_from_library(activity, course)
+        if content is not None:
+            library_contents[activity['id']] = content
+
+    if library_contents:
+        db.bulk_update_activity_content([
+            {'activity_id': activity_id, **content}
+            for activity_id, content in library_contents.items()
+        ])
+        results.update(library_contents)
+        activities = [a for a in activities if a['id'] not in library_contents]
+
+    for start in range(0, len(activities), LESSON_BATCH_SIZE):
+        batch = activities[start:start + LESSON_BATCH_SIZE]
+
+        contents = {}
+        if len(batch) > 1:
+            try:
+                contents = generate_task_content_batch(
+                    batch,
+                    _study_guide_context(batch, course),
+                    model=load_llm('generate_task_content_batch')
+                )
+            except Exception as e:
+                print(f"Error generating batch content for course {course['id']}: {e}")
+
+        if contents:
+            db.bulk_update_activity_content([
+                {'activity_id': activity_id, **content}
+                for activity_id, content in contents.items()
+            ])
+            results.update(contents)
+            for activity in batch:
+                if activity['id'] in contents:
+                    _add_to_library(activity, course, contents[activity['id']])
+
+        for activity in batch:
+            if activity['id'] not in contents:
+                # Already looked up in the library above
+                results[activity['id']] = generate_activity_content(activity, course, use_library=False)
+
+    return results
+
+
+# ====================
+# BACKGROUND PREFETCH
+# ====================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Activity ids queued or running, so repeated page views don't queue duplicates
+_queued_ids = set()
+_queued_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Return the shared prefetch worker pool"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=PREFETCH_WORKERS,
+                    thread_name_prefix='lesson-prefetch'
+                )
+    return _executor
+
+
+def _prefetch_activities(activity_ids: List[int]):
+    """Worker: generate content (batched) for activities nobody has generated yet"""
+    try:
+        with db.connection_scope():  # The lookups share one connection
+            activities = [db.get_activity_by_id(activity_id) for activity_id in activity_ids]
+            activities = [a for a in activities if a and not a.get('content_generated')]
+            course = db.get_course_by_id(activities[0]['course_id']) if activities else None
+        if not course:
+            return
+
+        # Prefetch only uses capacity interactive calls leave over
+        with priority_scope(BACKGROUND):
+            generate_activities_content(activities, course)
+        print(f"Prefetched content for activities {[a['id'] for a in activities]}")
+    except Exception as e:
+        print(f"Error prefetching content for activities {activity_ids}: {e}")
+    finally:
+        with _queued_lock:
+            _queued_ids.difference_update(activity_ids)
+
+
+def prefetch_upcoming(course_id: int, from_date: Optional[date] = None,
+                      lookahead: Optional[int] = None) -> int:
+    """
+    Queue background generation for the next scheduled activities without content,
+    starting at from_date (default today)
+    Returns the number of activities queued
+    """
+    if not PREFETCH_ENABLED:
+        return 0
+
+    from_date = from_date or date.today()
+    lookahead = PREFETCH_LOOKAHEAD if lookahead is None else lookahead
+    if lookahead <= 0:
+        return 0
+
+    return _queue_prefetch(db.get_upcoming_activities_without_content(course_id, from_date, lookahead))
+
+
+def prefetch_week(course_id: int, week_number: int) -> int:
+    """
+    Queue background generation for every activity of a week without content,
+    batched LESSON_BATCH_SIZE (a week by default) per LLM call
+    Returns the number of activities queued
+    """
+    if not PREFETCH_ENABLED:
+        return 0
+
+    return _queue_prefetch([
+        activity for activity in db.get_activities_for_week(course_id, week_number)
+        if not activity.get('content_generated')
+    ])
+
+
+def _queue_prefetch(activities: List[Dict]) -> int:
+    """Submit the activities nobody has queued yet as one prefetch job"""
+    with _queued_lock:
+        activity_ids = [a['id'] for a in activities if a['id'] not in _queued_ids]
+        _queued_ids.update(activity_ids)
+
+    # One job per prefetch so the activities share a single batched LLM call
+    if activity_ids:
+        _get_executor().submit(_prefetch_activities, activity_ids)
+
+    return len(activity_ids)
+
+
+def prefetch_after(course_id: int, viewed_date: date, lookahead: Optional[int] = None) -> int:
+    """Prefetch the activities following a day the user just opened"""
+    return prefetch_upcoming(course_id, viewed_date + timedelta(days=1), lookahead)
@@ -0,0 +1,206 @@
+"""
+Two-tier response cache for funcs.chat
+A bounded in-process LRU sits in front of a persistent SQLite table.
+Entries are keyed on a canonical hash of (model, messages, generation options).
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def make_cache_key(model: str, messages: list, options: dict) -> str:
+    """Canonical SHA-256 key for a chat request (dict ordering does not matter)"""
+    canonical = json.dumps(
+        {'model': model, 'messages': messages, 'options': options or {}},
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    In-memory LRU + SQLite cache with TTL and size-based eviction.
+    Safe to share between threads.
+    """
+
+    # Only refresh last_access on disk when it is older than this (avoids a write per hit)
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path: str, memory_items: int = 256,
+                 ttl_seconds: int = 7 * 24 * 3600, max_bytes: int = 50 * 1024 * 1024):
+        self.path = path
+        self.memory_items = memory_items
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (response, created_at)
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'expired': 0,
+            'stale_hits': 0,
+            'evictions': 0
+        }
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                   key TEXT PRIMARY KEY,
+                   response TEXT NOT NULL,
+                   size INTEGER NOT NULL,
+                   created_at REAL NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)')
+        self._conn.commit()
+        self._disk_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and created_at + self.ttl_seconds < now
+
+    def _remember(self, key: str, response: str, created_at: float):
+        """Put an entry in the memory tier, evicting the least recently used"""
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str, allow_expired: bool = False) -> Optional[str]:
+        """
+        Return the cached response for key, or None on a miss
+        allow_expired also returns entries past their TTL (a stale answer
+        while the LLM API is unavailable); expired rows stay on disk until
+        eviction so they can serve that purpose
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if allow_expired or not self._is_expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return entry[0]
+                del self._memory[key]
+
+            row = self._conn.execute(
+                'SELECT response, size, created_at, last_access FROM llm_cache WHERE key = ?',
+                (key,)
+            ).fetchone()
+
+            if row is None:
+                self._counters['misses'] += 1
+                return None
+
+            response, size, created_at, last_access = row
+            if self._is_expired(created_at, now):
+                if not allow_expired:
+                    self._counters['expired'] += 1
+                    self._counters['misses'] += 1
+                    return None
+                self._counters['stale_hits'] += 1
+                return response
+
+            if now - last_access > self.TOUCH_INTERVAL:
+                self._conn.execute('UPDATE llm_cache SET last_access = ? WHERE key = ?', (now, key))
+                self._conn.commit()
+
+            self._remember(key, response, created_at)
+            self._counters['disk_hits'] += 1
+            return response
+
+    def set(self, key: str, response: str):
+        """Store a response in both tiers"""
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._remember(key, response, now)
+
+            old = self._conn.execute('SELECT size FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                """INSERT OR REPLACE INTO llm_cache (key, response, size, created_at, last_access)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (key, response, size, now, now)
+            )
+            self._disk_bytes += size - (old[0] if old else 0)
+            self._counters['sets'] += 1
+
+            if self.max_bytes > 0 and self._disk_bytes > self.max_bytes:
+                self._evict()
+
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop expired rows, then least recently used rows until under 90% of max_bytes"""
+        if self.ttl_seconds > 0:
+            cursor = self._conn.execute(
+                'DELETE FROM llm_cache WHERE created_at < ?',
+                (time.time() - self.ttl_seconds,)
+            )
+            self._counters['expired'] += cursor.rowcount
+
+        self._disk_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+
+        while self._disk_bytes > target:
+            rows = self._conn.execute(
+                'SELECT key, size FROM llm_cache ORDER BY last_access LIMIT 100'
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._disk_bytes <= target:
+                    break
+                self._conn.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+                self._memory.pop(key, None)
+                self._disk_bytes -= size
+                self._counters['evictions'] += 1
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute('DELETE FROM llm_cache')
+            self._conn.commit()
+            self._disk_bytes = 0
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current tier sizes"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_items'] = len(self._memory)
+            stats['disk_bytes'] = self._disk_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def render_prometheus(self) -> str:
+        """Cache counters and tier sizes in Prometheus text format"""
+        stats = self.stats()
+        metrics = [
+            ('oleg_llm_cache_memory_hits_total', 'counter', 'Lookups answered from the in-memory tier', stats['memory_hits']),
+            ('oleg_llm_cache_disk_hits_total', 'counter', 'Lookups answered from the SQLite tier', stats['disk_hits']),
+            ('oleg_llm_cache_misses_total', 'counter', 'Lookups that went to the LLM API', stats['misses']),
+            ('oleg_llm_cache_sets_total', 'counter', 'Responses stored', stats['sets']),
+            ('oleg_llm_cache_expired_total', 'counter', 'Entries removed after their TTL', stats['expired']),
+            ('oleg_llm_cache_stale_hits_total', 'counter', 'Expired entries served while the upstream was unavailable',
+             stats['stale_hits']),
+            ('oleg_llm_cache_evictions_total', 'counter', 'Entries evicted to stay under the size limit', stats['evictions']),
+            ('oleg_llm_cache_memory_items', 'gauge', 'Responses held in the in-memory tier', stats['memory_items']),
+            ('oleg_llm_cache_disk_bytes', 'gauge', 'Bytes of responses stored on disk', stats['disk_bytes']),
+            ('oleg_llm_cache_hit_rate', 'gauge', 'Fraction of lookups answered from either tier', stats['hit_rate']),
+        ]
+        lines = []
+        for name, kind, help_text, value in metrics:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
@@ -1,51 +1,278 @@
 """
-Database migration script to add new columns for task content
-Run this once to update your existing database
+Versioned schema migrations
+Migrations live in migrations/ as NNNN_name.sql or NNNN_name.py and are
+applied in order; each applied version is recorded in the schema_version
+table, so starting the app on an up-to-date database is a single query.
+
+SQL migrations run in one transaction. Python migrations define
+upgrade(conn); those that set TRANSACTIONAL = False manage their own
+transactions (e.g. data migrations using run_chunked, which commits in
+small batches so the write lock is never held for long) and must be safe
+to re-run if interrupted.
+
+Usage:
+    python migrate_db.py            # apply pending migrations (creates oleg.db if needed)
+    python migrate_db.py --status   # list applied and pending migrations
 """
-import sqlite3
+import argparse
+import importlib.util
 import os
+import re
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional
 
 DATABASE_PATH = 'oleg.db'
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Rows per transaction for run_chunked data migrations
+DEFAULT_CHUNK_SIZE = 500
+
+_MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+
+_SCHEMA_VERSION_TABLE = """CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(200) NOT NULL,
+    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    duration_ms REAL
+)"""
+
+
+def discover_migrations(directory: str = MIGRATIONS_DIR) -> List[Dict]:
+    """Migration files in version order: [{'version', 'name', 'path', 'kind'}]"""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append({
+                'version': int(match.group(1)),
+                'name': match.group(2),
+                'path': os.path.join(directory, filename),
+                'kind': match.group(3)
+            })
+    migrations.sort(key=lambda migration: migration['version'])
+
+    versions = [migration['version'] for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def latest_version(directory: str = MIGRATIONS_DIR) -> int:
+    migrations = discover_migrations(directory)
+    return migrations[-1]['version'] if migrations else 0
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Highest applied version, 0 for a database that has never been migrated"""
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0  # No schema_version table yet
+    return row[0] or 0
+
+
+def applied_versions(conn: sqlite3.Connection) -> Dict[int, Dict]:
+    try:
+        rows = conn.execute("SELECT version, name, applied_at, duration_ms FROM schema_version").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {row[0]: {'name': row[1], 'applied_at': row[2], 'duration_ms': row[3]} for row in rows}
+
+
+def split_statements(script: str) -> List[str]:
+    """Split an SQL script into complete statements (trigger bodies stay whole)"""
+    statements, current = [], ''
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            if current.strip():
+                statements.append(current.strip())
+            current = ''
+    leftover = '\n'.join(line for line in current.splitlines() if not line.strip().startswith('--'))
+    if leftover.strip():
+        raise ValueError(f"Incomplete SQL statement: {leftover.strip()[:200]}")
+    return statements
+
+
+def _load_module(migration: Dict):
+    spec = importlib.util.spec_from_file_location(f"migration_{migration['version']:04d}", migration['path'])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not hasattr(module, 'upgrade'):
+        raise ValueError(f"Migration {migration['path']} has no upgrade(conn)")
+    return module
+
+
+def _record(conn: sqlite3.Connection, migration: Dict, started: float):
+    conn.execute(
+        "INSERT OR IGNORE INTO schema_version (version, name, duration_ms) VALUES (?, ?, ?)",
+        (migration['version'], migration['name'], (time.perf_counter() - started) * 1000)
+    )
 
-def migrate_database():
-    """Add new columns to existing database"""
 
-    if not os.path.exists(DATABASE_PATH):
-        print("Database does not exist yet. No migration needed.")
-        return
+def _apply(conn: sqlite3.Connection, migration: Dict) -> bool:
+    """Apply one migration; returns False when another process applied it first"""
+    started = time.perf_counter()
+    module = _load_module(migration) if migration['kind'] == 'py' else None
 
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    if module is not None and not getattr(module, 'TRANSACTIONAL', True):
+        # Manages its own (chunked) transactions; only the version is recorded atomically
+        if migration['version'] in applied_versions(conn):
+            return False
+        module.upgrade(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _record(conn, migration, started)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return True
 
+    # The write lock is taken before checking, so concurrent starts apply each migration once
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        # Add new columns to activities table
-        migrations = [
-            "ALTER TABLE activities ADD COLUMN theory_content TEXT",
-            "ALTER TABLE activities ADD COLUMN test_questions TEXT",
-            "ALTER TABLE activities ADD COLUMN test_solutions TEXT",
-            "ALTER TABLE activities ADD COLUMN content_generated BOOLEAN DEFAULT 0",
-            "ALTER TABLE courses ADD COLUMN duration_weeks INTEGER DEFAULT 20",
-            "ALTER TABLE courses ADD COLUMN start_date DATE"
-        ]
+        if migration['version'] in applied_versions(conn):
+            conn.execute("ROLLBACK")
+            return False
 
+        if module is not None:
+            module.upgrade(conn)
+        else:
+            with open(migration['path'], 'r') as f:
+                for statement in split_statements(f.read()):
+                    conn.execute(statement)
+
+        _record(conn, migration, started)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return True
+
+
+def migrate(conn: sqlite3.Connection, target: Optional[int] = None,
+            directory: str = MIGRATIONS_DIR) -> List[Dict]:
+    """
+    Apply pending migrations up to target (default: all) on conn
+    Returns the migrations applied
+    """
+    migrations = discover_migrations(directory)
+    if target is None:
+        target = migrations[-1]['version'] if migrations else 0
+
+    # Fast path: nothing to do
+    if current_version(conn) >= target:
+        return []
+
+    # Explicit transactions only, so DDL and the version row commit together
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute(_SCHEMA_VERSION_TABLE)
+        done = applied_versions(conn)
+        applied = []
         for migration in migrations:
+            if migration['version'] > target or migration['version'] in done:
+                continue
+            print(f"Applying migration {migration['version']:04d}_{migration['name']}...")
+            if _apply(conn, migration):
+                applied.append(migration)
+        return applied
+    finally:
+        conn.isolation_level = isolation_level
+
+
+# ====================
+# DATA MIGRATION HELPERS
+# ====================
+
+def run_chunked(conn: sqlite3.Connection, select_sql: str, apply: Callable,
+                chunk_size: int = DEFAULT_CHUNK_SIZE, pause: float = 0.0) -> int:
+    """
+    Run a data migration in short transactions. select_sql takes
+    (last_key, limit) and returns rows ordered by their first column, e.g.
+    "SELECT id, ... FROM t WHERE id > ? ORDER BY id LIMIT ?"; apply(conn, rows)
+    runs once per chunk and is committed on its own, releasing the write
+    lock (and sleeping `pause` seconds) between chunks.
+    Returns the number of rows processed
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    processed, last_key = 0, None
+    try:
+        while True:
+            rows = conn.execute(select_sql, (last_key if last_key is not None else -1, chunk_size)).fetchall()
+            if not rows:
+                break
+
+            conn.execute("BEGIN IMMEDIATE")
             try:
-                cursor.execute(migration)
-                print(f"[OK] Executed: {migration}")
-            except sqlite3.OperationalError as e:
-                if "duplicate column name" in str(e).lower():
-                    print(f"[SKIP] Column already exists: {migration}")
-                else:
-                    print(f"[ERROR] Error: {e}")
+                apply(conn, rows)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+            processed += len(rows)
+            last_key = rows[-1][0]
+            if pause:
+                time.sleep(pause)
+    finally:
+        conn.isolation_level = isolation_level
+    return processed
+
+
+def column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def add_column(conn: sqlite3.Connection, table: str, definition: str) -> bool:
+    """ALTER TABLE ... ADD COLUMN unless the column is already there; returns whether it was added"""
+    column = definition.split()[0]
+    if column_exists(conn, table, column):
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+    return True
 
-        conn.commit()
-        print("\n[OK] Migration completed successfully!")
 
+def print_status(conn: sqlite3.Connection, directory: str = MIGRATIONS_DIR):
+    applied = applied_versions(conn)
+    for migration in discover_migrations(directory):
+        label = f"{migration['version']:04d}_{migration['name']}.{migration['kind']}"
+        record = applied.get(migration['version'])
+        if record:
+            print(f"[OK]      {label} (applied {record['applied_at']}, {record['duration_ms'] or 0:.0f} ms)")
+        else:
+            print(f"[PENDING] {label}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply OLEG database migrations')
+    parser.add_argument('--database', default=DATABASE_PATH, help=f'SQLite database file (default {DATABASE_PATH})')
+    parser.add_argument('--status', action='store_true', help='List applied and pending migrations')
+    parser.add_argument('--target', type=int, help='Migrate up to this version (default: latest)')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    conn.execute('PRAGMA foreign_keys = ON')
+    try:
+        if args.status:
+            print_status(conn)
+            return
+
+        applied = migrate(conn, args.target)
+        if applied:
+            print(f"\n[OK] Applied {len(applied)} migration(s); schema is at version {current_version(conn)}")
+        else:
+            print(f"[OK] Schema is up to date (version {current_version(conn)})")
     except Exception as e:
         print(f"[ERROR] Migration failed: {e}")
-        conn.rollback()
+        raise SystemExit(1)
     finally:
         conn.close()
 
+
 if __name__ == '__main__':
-    migrate_database()
+    main()
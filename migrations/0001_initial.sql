@@ -1,5 +1,6 @@
--- OLEG Database Schema
--- SQLite database for user management, courses, activities, and progress tracking
+-- OLEG Database Schema (baseline)
+-- SQLite database for user management, courses, activities, and progress tracking.
+-- Later changes go in new numbered migrations, never in this file.
 
 -- Users table
 CREATE TABLE IF NOT EXISTS users (
@@ -108,6 +109,43 @@ CREATE TABLE IF NOT EXISTS checkpoint_submissions (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
+-- Content generation leases (one worker generates an activity's content at a time)
+CREATE TABLE IF NOT EXISTS content_generation_leases (
+    activity_id INTEGER PRIMARY KEY,
+    owner VARCHAR(100) NOT NULL,
+    expires_at REAL NOT NULL,
+    FOREIGN KEY (activity_id) REFERENCES activities(id) ON DELETE CASCADE
+);
+
+-- Shared lesson content library (reused across users for similar tasks)
+CREATE TABLE IF NOT EXISTS content_library (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    normalized_title VARCHAR(200) NOT NULL,
+    activity_kind VARCHAR(20) NOT NULL,
+    guide_signature TEXT NOT NULL,
+    theory_content TEXT,
+    test_questions TEXT,
+    test_solutions TEXT,
+    source_activity_id INTEGER,
+    reuse_count INTEGER DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (source_activity_id) REFERENCES activities(id) ON DELETE SET NULL
+);
+
+-- Study guide split at its topic headings, with term counts for BM25 retrieval
+CREATE TABLE IF NOT EXISTS study_guide_chunks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    course_id INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    heading TEXT,
+    content TEXT NOT NULL,
+    term_counts TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    guide_hash INTEGER NOT NULL,
+    FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE,
+    UNIQUE(course_id, chunk_index)
+);
+
 -- Indexes for better query performance
 CREATE INDEX IF NOT EXISTS idx_courses_user_id ON courses(user_id);
 CREATE INDEX IF NOT EXISTS idx_activities_course_id ON activities(course_id);
@@ -0,0 +1,21 @@
+"""
+Columns added after the first databases were created (task content and
+course duration), for databases that predate them. The baseline schema
+already has them, so on new databases this does nothing.
+"""
+from migrate_db import add_column
+
+COLUMNS = [
+    ('activities', 'theory_content TEXT'),
+    ('activities', 'test_questions TEXT'),
+    ('activities', 'test_solutions TEXT'),
+    ('activities', 'content_generated BOOLEAN DEFAULT 0'),
+    ('courses', 'duration_weeks INTEGER DEFAULT 20'),
+    ('courses', 'start_date DATE'),
+]
+
+
+def upgrade(conn):
+    for table, definition in COLUMNS:
+        if add_column(conn, table, definition):
+            print(f"[OK] Added {table}.{definition.split()[0]}")
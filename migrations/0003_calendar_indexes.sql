@@ -0,0 +1,11 @@
+-- Index for the calendar range query: activities(course_id, scheduled_date,
+-- activity_type) covers the scan of a course's month, so it never touches
+-- the table rows. daily_progress lookups by (user_id, course_id, date) are
+-- already served by its UNIQUE constraint's index.
+
+CREATE INDEX IF NOT EXISTS idx_activities_course_date
+    ON activities(course_id, scheduled_date, activity_type);
+
+-- Prefixes of the indexes above; they only added write cost
+DROP INDEX IF EXISTS idx_activities_course_id;
+DROP INDEX IF EXISTS idx_daily_progress_user_course;
@@ -0,0 +1,57 @@
+"""
+Track the latest run of consecutive complete days on user_streaks, so
+completions can update streaks incrementally. Existing records get their
+run and study day count from daily_progress, in chunks.
+"""
+from datetime import date, timedelta
+
+from migrate_db import add_column, run_chunked
+
+TRANSACTIONAL = False
+
+
+def _latest_run(conn, user_id, course_id):
+    rows = conn.execute(
+        """SELECT date FROM daily_progress
+           WHERE user_id = ? AND course_id = ? AND is_complete = 1
+           ORDER BY date DESC""",
+        (user_id, course_id)
+    ).fetchall()
+    if not rows:
+        return None, None
+
+    run_end = run_start = date.fromisoformat(rows[0][0][:10])
+    for (value,) in rows[1:]:
+        day = date.fromisoformat(value[:10])
+        if day != run_start - timedelta(days=1):
+            break
+        run_start = day
+    return run_start, run_end
+
+
+def _backfill(conn, rows):
+    for streak_id, user_id, course_id in rows:
+        run_start, run_end = _latest_run(conn, user_id, course_id)
+        # Incremental updates adjust total_study_days from here on, so start from an exact count
+        total_days = conn.execute(
+            """SELECT COUNT(*) FROM daily_progress
+               WHERE user_id = ? AND course_id = ? AND activities_completed > 0""",
+            (user_id, course_id)
+        ).fetchone()[0]
+        conn.execute(
+            """UPDATE user_streaks SET run_start_date = ?, run_end_date = ?, total_study_days = ?
+               WHERE id = ?""",
+            (run_start, run_end, total_days, streak_id)
+        )
+
+
+def upgrade(conn):
+    add_column(conn, 'user_streaks', 'run_start_date DATE')
+    add_column(conn, 'user_streaks', 'run_end_date DATE')
+
+    updated = run_chunked(
+        conn,
+        "SELECT id, user_id, course_id FROM user_streaks WHERE id > ? ORDER BY id LIMIT ?",
+        _backfill
+    )
+    print(f"[OK] Backfilled streak runs for {updated} record(s)")
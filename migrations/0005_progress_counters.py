@@ -0,0 +1,164 @@
+"""
+Materialized progress counters: per course (activities, completed, days
+studied) and per week (activities, completed), kept current by triggers in
+the same transaction as the change, so the statistics endpoint reads one
+row and one short range instead of aggregating the whole course.
+Existing courses are backfilled in chunks.
+"""
+from migrate_db import run_chunked, split_statements
+
+TRANSACTIONAL = False
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS course_progress (
+    course_id INTEGER PRIMARY KEY,
+    total_activities INTEGER NOT NULL DEFAULT 0,
+    completed_activities INTEGER NOT NULL DEFAULT 0,
+    days_studied INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS course_week_progress (
+    course_id INTEGER NOT NULL,
+    week_number INTEGER NOT NULL,
+    total_activities INTEGER NOT NULL DEFAULT 0,
+    completed_activities INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (course_id, week_number),
+    FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_courses_progress_insert AFTER INSERT ON courses
+BEGIN
+    INSERT OR IGNORE INTO course_progress (course_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_activities_progress_insert AFTER INSERT ON activities
+BEGIN
+    INSERT INTO course_progress (course_id, total_activities) VALUES (NEW.course_id, 1)
+        ON CONFLICT(course_id) DO UPDATE SET total_activities = total_activities + 1;
+    INSERT INTO course_week_progress (course_id, week_number, total_activities)
+        VALUES (NEW.course_id, NEW.week_number, 1)
+        ON CONFLICT(course_id, week_number) DO UPDATE SET total_activities = total_activities + 1;
+END;
+
+-- BEFORE, while the activity's completion (removed by the cascade) is still there
+CREATE TRIGGER IF NOT EXISTS trg_activities_progress_delete BEFORE DELETE ON activities
+BEGIN
+    UPDATE course_progress
+       SET total_activities = total_activities - 1,
+           completed_activities = completed_activities
+               - (SELECT COUNT(*) FROM activity_completions WHERE activity_id = OLD.id)
+     WHERE course_id = OLD.course_id;
+    UPDATE course_week_progress
+       SET total_activities = total_activities - 1,
+           completed_activities = completed_activities
+               - (SELECT COUNT(*) FROM activity_completions WHERE activity_id = OLD.id)
+     WHERE course_id = OLD.course_id AND week_number = OLD.week_number;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_activities_progress_move AFTER UPDATE OF course_id, week_number ON activities
+WHEN OLD.course_id != NEW.course_id OR OLD.week_number != NEW.week_number
+BEGIN
+    UPDATE course_week_progress
+       SET total_activities = total_activities - 1,
+           completed_activities = completed_activities
+               - (SELECT COUNT(*) FROM activity_completions WHERE activity_id = OLD.id)
+     WHERE course_id = OLD.course_id AND week_number = OLD.week_number;
+    INSERT INTO course_week_progress (course_id, week_number, total_activities, completed_activities)
+        VALUES (NEW.course_id, NEW.week_number, 1,
+                (SELECT COUNT(*) FROM activity_completions WHERE activity_id = NEW.id))
+        ON CONFLICT(course_id, week_number) DO UPDATE SET
+            total_activities = total_activities + 1,
+            completed_activities = completed_activities + excluded.completed_activities;
+    UPDATE course_progress
+       SET total_activities = total_activities - 1,
+           completed_activities = completed_activities
+               - (SELECT COUNT(*) FROM activity_completions WHERE activity_id = OLD.id)
+     WHERE course_id = OLD.course_id AND OLD.course_id != NEW.course_id;
+    UPDATE course_progress
+       SET total_activities = total_activities + 1,
+           completed_activities = completed_activities
+               + (SELECT COUNT(*) FROM activity_completions WHERE activity_id = NEW.id)
+     WHERE course_id = NEW.course_id AND OLD.course_id != NEW.course_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_completions_progress_insert AFTER INSERT ON activity_completions
+BEGIN
+    UPDATE course_progress SET completed_activities = completed_activities + 1
+     WHERE course_id = (SELECT course_id FROM activities WHERE id = NEW.activity_id);
+    UPDATE course_week_progress SET completed_activities = completed_activities + 1
+     WHERE (course_id, week_number) = (SELECT course_id, week_number FROM activities WHERE id = NEW.activity_id);
+END;
+
+-- When the activity itself is being deleted it is already gone here, so this is a no-op
+CREATE TRIGGER IF NOT EXISTS trg_completions_progress_delete AFTER DELETE ON activity_completions
+BEGIN
+    UPDATE course_progress SET completed_activities = completed_activities - 1
+     WHERE course_id = (SELECT course_id FROM activities WHERE id = OLD.activity_id);
+    UPDATE course_week_progress SET completed_activities = completed_activities - 1
+     WHERE (course_id, week_number) = (SELECT course_id, week_number FROM activities WHERE id = OLD.activity_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_progress_studied_insert AFTER INSERT ON daily_progress
+WHEN NEW.activities_completed > 0
+BEGIN
+    UPDATE course_progress SET days_studied = days_studied + 1 WHERE course_id = NEW.course_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_progress_studied_update AFTER UPDATE OF activities_completed ON daily_progress
+WHEN (OLD.activities_completed > 0) != (NEW.activities_completed > 0)
+BEGIN
+    UPDATE course_progress
+       SET days_studied = days_studied + (CASE WHEN NEW.activities_completed > 0 THEN 1 ELSE -1 END)
+     WHERE course_id = NEW.course_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_progress_studied_delete AFTER DELETE ON daily_progress
+WHEN OLD.activities_completed > 0
+BEGIN
+    UPDATE course_progress SET days_studied = days_studied - 1 WHERE course_id = OLD.course_id;
+END;
+"""
+
+
+def _backfill(conn, rows):
+    for (course_id,) in rows:
+        conn.execute("DELETE FROM course_week_progress WHERE course_id = ?", (course_id,))
+        conn.execute(
+            """INSERT INTO course_week_progress (course_id, week_number, total_activities, completed_activities)
+               SELECT a.course_id, a.week_number, COUNT(*), COUNT(ac.id)
+               FROM activities a
+               LEFT JOIN activity_completions ac ON ac.activity_id = a.id
+               WHERE a.course_id = ?
+               GROUP BY a.week_number""",
+            (course_id,)
+        )
+        conn.execute(
+            """INSERT OR REPLACE INTO course_progress
+               (course_id, total_activities, completed_activities, days_studied)
+               SELECT ?,
+                      COALESCE(SUM(total_activities), 0),
+                      COALESCE(SUM(completed_activities), 0),
+                      (SELECT COUNT(*) FROM daily_progress
+                        WHERE course_id = ? AND activities_completed > 0)
+               FROM course_week_progress WHERE course_id = ?""",
+            (course_id, course_id, course_id)
+        )
+
+
+def upgrade(conn):
+    # Tables and triggers together: from here on every change keeps the counters current
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in split_statements(SCHEMA):
+            conn.execute(statement)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    # Each chunk recomputes its courses in one transaction, so changes the
+    # triggers applied before it are simply superseded
+    courses = run_chunked(conn, "SELECT id FROM courses WHERE id > ? ORDER BY id LIMIT ?", _backfill,
+                          chunk_size=100)
+    print(f"[OK] Backfilled progress counters for {courses} course(s)")
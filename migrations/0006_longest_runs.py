@@ -0,0 +1,44 @@
+"""
+longest_streak becomes the longest run of consecutive complete days, which
+completions now keep exact (it was the highest current streak seen, which
+never went down when a day was un-completed). Existing records are
+recomputed from daily_progress, in chunks.
+"""
+from datetime import date, timedelta
+
+from migrate_db import run_chunked
+
+TRANSACTIONAL = False
+
+
+def _longest_run(conn, user_id, course_id):
+    longest = length = 0
+    previous = None
+    for (value,) in conn.execute(
+        """SELECT date FROM daily_progress
+           WHERE user_id = ? AND course_id = ? AND is_complete = 1
+           ORDER BY date""",
+        (user_id, course_id)
+    ):
+        day = date.fromisoformat(value[:10])
+        length = length + 1 if previous and day == previous + timedelta(days=1) else 1
+        longest = max(longest, length)
+        previous = day
+    return longest
+
+
+def _backfill(conn, rows):
+    for streak_id, user_id, course_id in rows:
+        conn.execute(
+            "UPDATE user_streaks SET longest_streak = ? WHERE id = ?",
+            (_longest_run(conn, user_id, course_id), streak_id)
+        )
+
+
+def upgrade(conn):
+    updated = run_chunked(
+        conn,
+        "SELECT id, user_id, course_id FROM user_streaks WHERE id > ? ORDER BY id LIMIT ?",
+        _backfill
+    )
+    print(f"[OK] Recomputed longest streaks for {updated} record(s)")
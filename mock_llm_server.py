@@ -0,0 +1,388 @@
+"""
+Local stand-in for the Fireworks chat completions API
+Speaks the same /inference/v1/chat/completions protocol (streaming and
+non-streaming) and answers every OLEG prompt with canned content that the
+app can parse, so /send, /finish and the daily lessons can be benchmarked
+without an API key or network.
+
+Usage:
+    python mock_llm_server.py --port 8001 --ttft 0.3 --tokens-per-sec 80
+    FIREWORKS_API_URL=http://127.0.0.1:8001/inference/v1/chat/completions python app.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHAT_COMPLETIONS_PATH = '/inference/v1/chat/completions'
+
+# Behaviour knobs (overridden from the command line)
+CONFIG = {
+    'ttft': 0.3,             # Seconds before the first token
+    'tokens_per_sec': 80.0,  # Generation speed, 0 = instant
+    'error_rate': 0.0,       # Fraction of requests answered with a 500
+    'rate_limit_rate': 0.0,  # Fraction of requests answered with a 429
+    'retry_after': 1.0,      # Retry-After header sent with injected 429s
+    'max_concurrency': 0,    # Requests in flight before extra ones get a 429, 0 = unlimited
+    'unavailable_models': [] # Models answered with a 404 (to exercise model fallback)
+}
+
+_stats_lock = threading.Lock()
+_stats = {
+    'requests': 0,
+    'streaming_requests': 0,
+    'in_flight': 0,
+    'max_in_flight': 0,
+    'errors_injected': 0,
+    'rate_limited': 0,
+    'model_not_found': 0,
+    'prompt_tokens': 0,
+    'completion_tokens': 0
+}
+
+TOPICS = [
+    'Foundations and Key Concepts', 'Core Techniques', 'Tools and Workflow',
+    'Data and Representation', 'Intermediate Methods', 'Design Patterns',
+    'Evaluation and Testing', 'Advanced Topics', 'Real-World Projects'
+]
+
+
+# ====================
+# CANNED RESPONSES
+# ====================
+
+def _subject(prompt):
+    """Best-effort course subject from the conversation in a prompt"""
+    match = re.search(r'user:.*?\b(?:learn|learning|study|about)\s+([A-Za-z][A-Za-z +#]{2,40})', prompt, re.IGNORECASE)
+    if match:
+        words = match.group(1).strip().split()[:2]
+        return ' '.join(word.capitalize() for word in words)
+    return 'Machine Learning'
+
+
+def _lesson(title):
+    return {
+        'steps': [
+            {'title': 'Why This Matters', 'content': f'{title} shows up everywhere in this field. '
+             'Understanding it makes the next lessons much easier to follow.', 'type': 'theory'},
+            {'title': f'Core Concept: {title}', 'content': f'The central idea of {title} is to break a problem '
+             'into smaller parts, study each part and then combine what you learned. '
+             'Work through the definitions slowly and connect them to examples.', 'type': 'theory'},
+            {'title': 'Real-World Application', 'content': 'Think of a recipe: each step depends on the previous '
+             'one, and skipping a step changes the result. The same holds here.', 'type': 'example'},
+            {'title': 'Quick Check', 'content': f'Think about this: how would you explain {title} to a friend '
+             'in two sentences?', 'type': 'practice'}
+        ]
+    }
+
+
+def _test(title):
+    return {
+        'questions': [
+            {'question': f'Which statement best describes {title} (question {n})?',
+             'options': ['A) The correct definition', 'B) A common misconception',
+                         'C) An unrelated idea', 'D) None of the above'],
+             'correct': 'A'}
+            for n in range(1, 6)
+        ],
+        'solutions': [
+            {'question_num': n, 'answer': 'A', 'explanation': 'Option A matches the definition from the lesson.'}
+            for n in range(1, 6)
+        ]
+    }
+
+
+def _study_guide(subject):
+    sections = []
+    for number, topic in enumerate(TOPICS[:4], start=1):
+        sections.append(f"""**Topic {number}: {subject} {topic}**
+
+**Definition:** {topic} covers the ideas every {subject} learner needs at this stage.
+
+**Theoretical Foundations:** The main theories behind {topic.lower()} and how they connect.
+
+**Practical Application:** How {topic.lower()} is used in real projects.
+
+**Key Terms:**
+* **Term {number}A:** Definition
+* **Term {number}B:** Definition
+* **Term {number}C:** Definition
+
+**Resources:**
+* {subject}: A Practical Introduction
+* The {topic} Handbook""")
+    return '\n\n'.join(sections)
+
+
+def _outline(weeks):
+    return '\n'.join(f"Week {week}: {TOPICS[(week - 1) % len(TOPICS)]}" for week in range(1, weeks + 1))
+
+
+def _schedule(first_week, last_week, first_day):
+    lines = []
+    day = first_day
+    for week in range(first_week, last_week + 1):
+        topic = TOPICS[(week - 1) % len(TOPICS)]
+        lines.append(f"**Week {week}**")
+        for index in range(7):
+            if index == 6:
+                lines.append(f"- Day {day}: Review {topic} (30 min)")
+            elif index == 5:
+                lines.append(f"- Day {day}: Practice exercises on {topic} (45 min)")
+            else:
+                lines.append(f"- Day {day}: Study {topic} part {index + 1} (30 min)")
+            day += 1
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def canned_response(prompt):
+    """Pick a response in the format the app expects for this prompt"""
+    if 'extract ONLY the course subject name' in prompt:
+        return _subject(prompt)
+
+    if 'Create a structured study guide' in prompt:
+        return _study_guide(_subject(prompt))
+
+    match = re.search(r'plan the weekly themes of a (\d+)-week course', prompt)
+    if match:
+        return _outline(int(match.group(1)))
+
+    match = re.search(r'write weeks (\d+)-(\d+) of a', prompt)
+    if match:
+        first_week, last_week = int(match.group(1)), int(match.group(2))
+        day_match = re.search(r'from Day (\d+) to Day', prompt)
+        first_day = int(day_match.group(1)) if day_match else (first_week - 1) * 7 + 1
+        return _schedule(first_week, last_week, first_day)
+
+    if 'Return ONE JSON object keyed by the task key' in prompt:
+        batch = {}
+        for key, kind, title in re.findall(r'^- "([^"]+)" \((lesson|test)\): (.+)$', prompt, re.MULTILINE):
+            batch[key] = _test(title) if kind == 'test' else _lesson(title)
+        return json.dumps(batch, indent=2)
+
+    match = re.search(r'Adapt it for the task: (.+)', prompt)
+    if match:
+        title = match.group(1).strip()
+        return json.dumps(_test(title) if 'existing test content' in prompt else _lesson(title), indent=2)
+
+    match = re.search(r'create a focused test for: (.+)', prompt)
+    if match:
+        return json.dumps(_test(match.group(1).strip()), indent=2)
+
+    match = re.search(r'step-by-step study content for: (.+)', prompt)
+    if match:
+        return json.dumps(_lesson(match.group(1).strip()), indent=2)
+
+    return "That sounds like a great goal! What is your current experience with this topic?"
+
+
+def tokenize(text):
+    """Split text into rough tokens (a word plus its trailing whitespace)"""
+    return re.findall(r'\s*\S+\s*', text) or [text]
+
+
+# ====================
+# HTTP HANDLER
+# ====================
+
+class MockFireworksHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown benchmark output
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, data):
+        encoded = data.encode('utf-8')
+        self.wfile.write(f"{len(encoded):X}\r\n".encode('ascii') + encoded + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with _stats_lock:
+                self._send_json(200, {**_stats, 'config': CONFIG})
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path != CHAT_COMPLETIONS_PATH:
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': 'Invalid JSON'})
+            return
+
+        if payload.get('model') in CONFIG['unavailable_models']:
+            with _stats_lock:
+                _stats['requests'] += 1
+                _stats['model_not_found'] += 1
+            self._send_json(404, {'error': f"Model not found: {payload.get('model')}"})
+            return
+
+        with _stats_lock:
+            _stats['requests'] += 1
+            over_limit = 0 < CONFIG['max_concurrency'] <= _stats['in_flight']
+            if not over_limit:
+                _stats['in_flight'] += 1
+                _stats['max_in_flight'] = max(_stats['max_in_flight'], _stats['in_flight'])
+
+        if over_limit or random.random() < CONFIG['rate_limit_rate']:
+            with _stats_lock:
+                _stats['rate_limited'] += 1
+                if not over_limit:
+                    _stats['in_flight'] -= 1
+            self._send_json(429, {'error': 'Too many requests'},
+                            headers={'Retry-After': str(CONFIG['retry_after'])})
+            return
+
+        try:
+            if random.random() < CONFIG['error_rate']:
+                with _stats_lock:
+                    _stats['errors_injected'] += 1
+                self._send_json(500, {'error': 'Injected server error'})
+                return
+            self._complete(payload)
+        finally:
+            with _stats_lock:
+                _stats['in_flight'] -= 1
+
+    def _complete(self, payload):
+        messages = payload.get('messages', [])
+        prompt = '\n'.join(str(m.get('content', '')) for m in messages)
+        tokens = tokenize(canned_response(prompt))
+
+        max_tokens = payload.get('max_tokens')
+        finish_reason = 'stop'
+        if max_tokens and len(tokens) > max_tokens:
+            tokens = tokens[:max_tokens]
+            finish_reason = 'length'
+
+        usage = {
+            'prompt_tokens': len(tokenize(prompt)),
+            'completion_tokens': len(tokens),
+            'total_tokens': len(tokenize(prompt)) + len(tokens)
+        }
+        with _stats_lock:
+            _stats['prompt_tokens'] += usage['prompt_tokens']
+            _stats['completion_tokens'] += usage['completion_tokens']
+
+        completion_id = f"mock-{uuid.uuid4().hex[:12]}"
+        model = payload.get('model', 'mock')
+        token_delay = 1.0 / CONFIG['tokens_per_sec'] if CONFIG['tokens_per_sec'] > 0 else 0.0
+
+        time.sleep(CONFIG['ttft'])
+
+        if not payload.get('stream'):
+            time.sleep(token_delay * max(len(tokens) - 1, 0))
+            self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                    'finish_reason': finish_reason
+                }],
+                'usage': usage
+            })
+            return
+
+        with _stats_lock:
+            _stats['streaming_requests'] += 1
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            for index, token in enumerate(tokens):
+                if index and token_delay:
+                    time.sleep(token_delay)
+                chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+
+            final = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': finish_reason}],
+                'usage': usage
+            }
+            self._write_chunk(f"data: {json.dumps(final)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away mid-stream
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Fireworks-compatible mock LLM server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--ttft', type=float, default=CONFIG['ttft'], help='Seconds before the first token')
+    parser.add_argument('--tokens-per-sec', type=float, default=CONFIG['tokens_per_sec'], help='0 = instant')
+    parser.add_argument('--error-rate', type=float, default=CONFIG['error_rate'], help='Fraction of 500 responses')
+    parser.add_argument('--rate-limit-rate', type=float, default=CONFIG['rate_limit_rate'], help='Fraction of 429 responses')
+    parser.add_argument('--retry-after', type=float, default=CONFIG['retry_after'], help='Retry-After seconds on 429')
+    parser.add_argument('--max-concurrency', type=int, default=CONFIG['max_concurrency'],
+                        help='Requests in flight before answering 429, 0 = unlimited')
+    parser.add_argument('--unavailable-model', action='append', default=[],
+                        help='Answer requests for this model with a 404 (repeatable)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible error injection')
+    args = parser.parse_args()
+
+    CONFIG.update({
+        'ttft': args.ttft,
+        'tokens_per_sec': args.tokens_per_sec,
+        'error_rate': args.error_rate,
+        'rate_limit_rate': args.rate_limit_rate,
+        'retry_after': args.retry_after,
+        'max_concurrency': args.max_concurrency,
+        'unavailable_models': args.unavailable_model
+    })
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    server = ThreadingHTTPServer((args.host, args.port), MockFireworksHandler)
+    server.daemon_threads = True
+    print(f"Mock Fireworks API listening on http://{args.host}:{args.port}{CHAT_COMPLETIONS_PATH}")
+    print(f"Config: {CONFIG}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
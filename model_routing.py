@@ -0,0 +1,75 @@
+"""
+Model routing for LLM call sites
+Each call site (the telemetry label, e.g. "extract_course_name") maps to a
+model tier. A tier has a model, a read timeout and a fallback chain of other
+tiers tried in order when a call on it fails, so light calls can run on a
+small fast model without losing the large one as a backstop.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+SMALL, LARGE = 'small', 'large'
+
+# Call sites that are cheap enough for the small model; everything else uses the default tier
+DEFAULT_ROUTES = {
+    'extract_course_name': SMALL,
+    'generate_bot_response': SMALL,
+}
+
+
+class ModelRouter:
+    """Routing table: call site -> tier -> (model, timeout, fallback tiers)"""
+
+    def __init__(self, models: Dict[str, str], timeouts: Dict[str, float],
+                 fallbacks: Dict[str, Sequence[str]], routes: Optional[Dict[str, str]] = None,
+                 default_tier: str = LARGE):
+        self.models = dict(models)
+        self.timeouts = dict(timeouts)
+        self.default_tier = default_tier
+        self.routes = dict(DEFAULT_ROUTES, **(routes or {}))
+        self.fallbacks = {
+            tier: [other for other in fallbacks.get(tier, ()) if other in self.models and other != tier]
+            for tier in self.models
+        }
+
+        for call_site, tier in self.routes.items():
+            if tier not in self.models:
+                raise ValueError(f"Unknown model tier '{tier}' for call site '{call_site}'")
+
+    def tier_for(self, call_site: Optional[str]) -> str:
+        return self.routes.get(call_site, self.default_tier)
+
+    def model_for(self, call_site: Optional[str]) -> str:
+        return self.models[self.tier_for(call_site)]
+
+    def tier_of_model(self, model: str) -> Optional[str]:
+        """Tier a model name belongs to (None for models outside the table)"""
+        for tier, tier_model in self.models.items():
+            if tier_model == model:
+                return tier
+        return None
+
+    def chain(self, model: str) -> List[Tuple[Optional[str], str, Optional[float]]]:
+        """
+        (tier, model, read timeout) attempts for a call on model: its own tier
+        followed by the tier's fallbacks. A model outside the table is tried
+        alone with the default timeout.
+        """
+        tier = self.tier_of_model(model)
+        if tier is None:
+            return [(None, model, None)]
+
+        attempts = [(tier, model, self.timeouts.get(tier))]
+        for fallback in self.fallbacks.get(tier, []):
+            if self.models[fallback] != model:
+                attempts.append((fallback, self.models[fallback], self.timeouts.get(fallback)))
+        return attempts
+
+    def status(self) -> Dict:
+        return {
+            'tiers': {
+                tier: {'model': model, 'timeout': self.timeouts.get(tier), 'fallbacks': self.fallbacks[tier]}
+                for tier, model in self.models.items()
+            },
+            'routes': dict(self.routes),
+            'default_tier': self.default_tier
+        }
@@ -0,0 +1,156 @@
+"""
+Token-budgeted prompt assembly
+Each call site has a prompt budget in (approximate) tokens. build_prompt
+renders the fixed parts of a prompt (instructions, user input), then shares
+what is left of the budget between its flexible sections (study guide
+context, chat history), trimming them at section and sentence boundaries
+instead of at an arbitrary character offset.
+"""
+import re
+from typing import Callable, List, Sequence, Union
+
+# Total prompt budget per call site (call site names match the telemetry labels)
+PROMPT_BUDGETS = {
+    'generate_bot_response': 1200,
+    'extract_course_name': 300,
+    'generate_study_guide': 1200,
+    'generate_schedule_outline': 900,
+    'generate_schedule_segment': 1500,
+    'generate_task_content': 900,
+    'generate_task_content_batch': 1200,
+}
+DEFAULT_PROMPT_BUDGET = 1000
+
+# Uploaded PDF text added to the chat
+PDF_CONTEXT_TOKENS = 750
+
+# Words, short digit groups and single punctuation marks. Long words count as
+# several tokens, roughly matching BPE tokenizers on English text.
+_TOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_")
+_SECTION_SPLIT = re.compile(r'\n\s*\n|\n(?=\*\*|#)')
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count of text (errs slightly high for English)"""
+    return sum(1 + (len(piece) - 1) // 6 for piece in _TOKEN_PATTERN.findall(text))
+
+
+def _fit_pieces(pieces: Sequence[str], budget: int) -> List[str]:
+    """Longest prefix of pieces that fits budget"""
+    kept, used = [], 0
+    for piece in pieces:
+        cost = count_tokens(piece)
+        if used + cost > budget:
+            break
+        kept.append(piece)
+        used += cost
+    return kept
+
+
+def truncate_text(text: str, budget: int) -> str:
+    """
+    Keep the beginning of text within budget tokens: whole sections (paragraphs,
+    markdown headings) first, then whole sentences of the section that no longer
+    fits, then words if not even one sentence fits
+    """
+    if budget <= 0:
+        return ''
+    if count_tokens(text) <= budget:
+        return text
+
+    sections = [s for s in _SECTION_SPLIT.split(text) if s.strip()]
+    kept = _fit_pieces(sections, budget)
+    used = sum(count_tokens(s) for s in kept)
+
+    if len(kept) < len(sections):
+        # Sentences of the section that didn't fit, remembering which start a new line
+        sentences = []
+        for line in sections[len(kept)].split('\n'):
+            for index, sentence in enumerate(s for s in _SENTENCE_SPLIT.split(line) if s.strip()):
+                sentences.append(('\n' if index == 0 else ' ') + sentence)
+        partial = _fit_pieces(sentences, budget - used)
+        # A heading like "**Resources:**" is useless without what follows it
+        while partial and partial[-1].rstrip().endswith((':', ':**')):
+            partial.pop()
+        if partial:
+            kept.append(''.join(partial).strip())
+        elif not kept and sentences:
+            kept.append(' '.join(_fit_pieces(sentences[0].split(), budget)))
+
+    return '\n\n'.join(kept).strip()
+
+
+class Section:
+    """
+    Flexible part of a prompt
+    text_or_items: a string (trimmed from the end, keeping its beginning) or a
+        list of messages (oldest dropped first when keep='tail')
+    pin_first: for message lists, always try to keep the first message
+        (it usually says what the user wants to learn)
+    weight: share of the remaining budget relative to other sections
+    """
+
+    def __init__(self, text_or_items: Union[str, Sequence[str]], keep: str = 'head',
+                 pin_first: bool = False, weight: float = 1.0, joiner: str = '\n'):
+        self.text_or_items = text_or_items
+        self.keep = keep
+        self.pin_first = pin_first
+        self.weight = weight
+        self.joiner = joiner
+
+    def tokens(self) -> int:
+        if isinstance(self.text_or_items, str):
+            return count_tokens(self.text_or_items)
+        return sum(count_tokens(item) for item in self.text_or_items)
+
+    def fit(self, budget: int) -> str:
+        if isinstance(self.text_or_items, str):
+            return truncate_text(self.text_or_items, budget)
+
+        items = list(self.text_or_items)
+        if self.keep == 'head':
+            return truncate_text(self.joiner.join(items), budget)
+
+        first = []
+        if self.pin_first and items and count_tokens(items[0]) <= budget // 2:
+            first, items = items[:1], items[1:]
+            budget -= count_tokens(first[0])
+
+        recent = []
+        for item in reversed(items):
+            cost = count_tokens(item)
+            if cost > budget:
+                if not recent:
+                    # The newest message alone is too long: keep its beginning
+                    recent.append(truncate_text(item, budget))
+                break
+            recent.append(item)
+            budget -= cost
+
+        return self.joiner.join(first + list(reversed(recent)))
+
+
+def build_prompt(call_site: str, render: Callable[..., str], **sections) -> str:
+    """
+    Render a prompt within the call site's token budget
+    render is called with one keyword argument per section. Plain strings are
+    fixed and passed through as-is; Section values share the budget left after
+    the fixed parts, smallest first so unused share goes to the larger ones.
+    """
+    budget = PROMPT_BUDGETS.get(call_site, DEFAULT_PROMPT_BUDGET)
+
+    fixed = {name: value for name, value in sections.items() if not isinstance(value, Section)}
+    flexible = {name: value for name, value in sections.items() if isinstance(value, Section)}
+
+    remaining = budget - count_tokens(render(**fixed, **{name: '' for name in flexible}))
+    total_weight = sum(section.weight for section in flexible.values())
+
+    texts = {}
+    for name, section in sorted(flexible.items(), key=lambda item: item[1].tokens() / item[1].weight):
+        share = int(max(remaining, 0) * section.weight / total_weight) if total_weight else 0
+        texts[name] = section.fit(share)
+        remaining -= count_tokens(texts[name])
+        total_weight -= section.weight
+
+    return render(**fixed, **texts)
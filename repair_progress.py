@@ -0,0 +1,39 @@
+"""
+Consistency check and rebuild for the materialized progress counters
+course_progress and course_week_progress are maintained by triggers; this
+compares them with counts from activities, activity_completions and
+daily_progress and rebuilds the courses that differ.
+
+Usage:
+    python repair_progress.py --check          # report courses that differ, change nothing
+    python repair_progress.py                  # rebuild courses that differ
+    python repair_progress.py --course-id 12   # only one course
+"""
+import argparse
+
+import db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and rebuild materialized progress counters')
+    parser.add_argument('--check', action='store_true', help='Only report courses that differ')
+    parser.add_argument('--course-id', type=int, help='Only check this course')
+    args = parser.parse_args()
+
+    drift = db.check_progress_counters(args.course_id)
+    for course_id, stored, expected in drift:
+        print(f"[DRIFT] course {course_id}: stored {stored}, expected {expected}")
+        if not args.check:
+            db.rebuild_progress_counters(course_id)
+
+    if not drift:
+        print("[OK] All progress counters match")
+    elif args.check:
+        print(f"\n{len(drift)} course(s) differ; run without --check to rebuild them")
+        raise SystemExit(1)
+    else:
+        print(f"\n[OK] Rebuilt progress counters for {len(drift)} course(s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Batch repair for incrementally maintained streaks
+Completions update user_streaks from the changed day only; this recomputes
+records from daily_progress and fixes any that drifted (e.g. after a manual
+data fix or a restore of daily_progress alone).
+
+Usage:
+    python repair_streaks.py --check          # report records that differ, change nothing
+    python repair_streaks.py                  # fix records that differ
+    python repair_streaks.py --course-id 12   # only one course
+"""
+import argparse
+
+import db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute streak records from daily progress')
+    parser.add_argument('--check', action='store_true', help='Only report records that differ')
+    parser.add_argument('--course-id', type=int, help='Only check this course')
+    args = parser.parse_args()
+
+    drift = db.check_streak_records(args.course_id)
+    for user_id, course_id, stored, expected in drift:
+        print(f"[DRIFT] user {user_id} course {course_id}: stored {stored}, expected {expected}")
+        if not args.check:
+            db.rebuild_streak_record(user_id, course_id)
+
+    if not drift:
+        print("[OK] All streak records match daily progress")
+    elif args.check:
+        print(f"\n{len(drift)} record(s) differ; run without --check to repair them")
+        raise SystemExit(1)
+    else:
+        print(f"\n[OK] Repaired {len(drift)} record(s)")
+
+
+if __name__ == '__main__':
+    main()
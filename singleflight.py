@@ -0,0 +1,47 @@
+"""
+Single-flight call deduplication
+Concurrent callers asking for the same key share one execution instead of
+each running it. This only covers threads of one process; lessons.py adds
+a DB lease on top so separate worker processes don't duplicate work either.
+"""
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into a single call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future of the in-flight call
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn() unless a call for key is already in flight, in which case
+        wait for it and return its result (or raise its exception)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+        return future.result()
+
+    def in_flight(self) -> int:
+        """Number of keys currently being computed"""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,168 @@
+"""
+Speculative course generation during the intake conversation
+Once OLEG has enough information to build a course, the course name and the
+study guide are started in the background for the conversation as it stands.
+/finish then picks up the running (or finished) results instead of starting
+from scratch, as long as the user hasn't said anything new since.
+"""
+import contextvars
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional
+
+from upstream import STANDARD, priority_scope
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def conversation_key(chat_history: List[str]) -> str:
+    """
+    Fingerprint of what the user has said: their messages with case,
+    punctuation and spacing normalized. OLEG's replies are left out, as they
+    don't change what the course should be about.
+    """
+    user_messages = [
+        _WHITESPACE.sub(' ', _PUNCTUATION.sub(' ', message[len('user:'):].lower())).strip()
+        for message in chat_history if message.startswith('user:')
+    ]
+    return hashlib.sha256('\n'.join(user_messages).encode('utf-8')).hexdigest()
+
+
+class _Speculation:
+    def __init__(self, key: str, futures: Dict[str, Future]):
+        self.key = key
+        self.futures = futures
+        self.started = time.monotonic()
+
+
+class Speculator:
+    """
+    One speculation per owner (user): starting a new one for a different
+    conversation discards the previous one, and take() hands the results
+    over only when the conversation still matches.
+    """
+
+    def __init__(self, enabled: bool = True, max_workers: int = 4, ttl: float = 900.0,
+                 priority: str = STANDARD):
+        self.enabled = enabled
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.priority = priority
+        self._executor = None
+        self._speculations: Dict[Hashable, _Speculation] = {}
+        self._lock = threading.Lock()
+        self._started = 0
+        self._hits = 0
+        self._misses = 0
+        self._discarded = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='course-speculate')
+            return self._executor
+
+    def _run(self, func: Callable, chat_history: List[str]):
+        with priority_scope(self.priority):
+            return func(chat_history)
+
+    def _drop(self, speculation: _Speculation):
+        # Queued work is cancelled; running calls finish and land in the LLM cache
+        for future in speculation.futures.values():
+            future.cancel()
+        self._discarded += 1
+
+    def start(self, owner: Hashable, chat_history: List[str], tasks: Dict[str, Callable]) -> bool:
+        """
+        Start tasks (name -> func(chat_history)) for owner's conversation unless
+        the same conversation is already being speculated on
+        Returns whether anything was started
+        """
+        if not self.enabled:
+            return False
+
+        key = conversation_key(chat_history)
+        with self._lock:
+            current = self._speculations.get(owner)
+            if current and current.key == key and time.monotonic() - current.started < self.ttl:
+                return False
+
+        executor = self._get_executor()
+        snapshot = list(chat_history)
+        futures = {
+            name: executor.submit(contextvars.copy_context().run, self._run, func, snapshot)
+            for name, func in tasks.items()
+        }
+
+        with self._lock:
+            previous = self._speculations.get(owner)
+            if previous:
+                self._drop(previous)
+            self._speculations[owner] = _Speculation(key, futures)
+            self._started += 1
+            self._expire()
+        return True
+
+    def take(self, owner: Hashable, chat_history: List[str]) -> Optional[Dict[str, Future]]:
+        """Owner's speculative futures if they were started for this conversation, else None"""
+        with self._lock:
+            speculation = self._speculations.pop(owner, None)
+            if speculation is None:
+                return None
+            if speculation.key != conversation_key(chat_history) \
+                    or time.monotonic() - speculation.started >= self.ttl:
+                self._drop(speculation)
+                self._misses += 1
+                return None
+            self._hits += 1
+            return speculation.futures
+
+    def discard(self, owner: Hashable):
+        """Forget owner's speculation (the conversation was cleared)"""
+        with self._lock:
+            speculation = self._speculations.pop(owner, None)
+            if speculation:
+                self._drop(speculation)
+
+    def _expire(self):
+        # Called with the lock held: abandoned conversations shouldn't pin results forever
+        now = time.monotonic()
+        for owner in [owner for owner, speculation in self._speculations.items()
+                      if now - speculation.started >= self.ttl]:
+            self._drop(self._speculations.pop(owner))
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'pending': len(self._speculations),
+                'started': self._started,
+                'hits': self._hits,
+                'misses': self._misses,
+                'discarded': self._discarded
+            }
+
+    def render_prometheus(self) -> str:
+        """Speculation counters in Prometheus text format"""
+        status = self.status()
+        metrics = [
+            ('oleg_speculations_pending', 'gauge', 'Conversations with speculative results waiting for /finish',
+             status['pending']),
+            ('oleg_speculations_started_total', 'counter', 'Speculative course generations started',
+             status['started']),
+            ('oleg_speculation_hits_total', 'counter', 'Course creations that reused speculative results',
+             status['hits']),
+            ('oleg_speculation_misses_total', 'counter', 'Speculative results rejected because the conversation changed',
+             status['misses']),
+            ('oleg_speculations_discarded_total', 'counter', 'Speculative results dropped unused',
+             status['discarded']),
+        ]
+        lines = []
+        for name, kind, help_text, value in metrics:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,82 @@
+// Stream OLEG's reply from /send_stream.
+// The endpoint answers a POST with Server-Sent Events, so it is read with
+// fetch() instead of EventSource (which only supports GET).
+//
+// handlers.onDelta(delta, fullText) - called for every chunk of text
+// handlers.onDone(data)             - called once with {response, show_duration_selector}
+// handlers.onError(message)         - called once if the request or the stream fails
+function streamChat(message, handlers) {
+    let finished = false;
+    let fullText = '';
+
+    function fail(errorMessage) {
+        if (finished) return;
+        finished = true;
+        if (handlers.onError) handlers.onError(errorMessage);
+    }
+
+    function handleEvent(rawEvent) {
+        let eventName = 'message';
+        let dataLines = [];
+
+        rawEvent.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                eventName = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+
+        if (dataLines.length === 0) return;
+        const data = JSON.parse(dataLines.join('\n'));
+
+        if (eventName === 'error') {
+            fail(data.error || 'Error generating response');
+        } else if (eventName === 'done') {
+            finished = true;
+            if (handlers.onDone) handlers.onDone(data);
+        } else if (data.delta) {
+            fullText += data.delta;
+            if (handlers.onDelta) handlers.onDelta(data.delta, fullText);
+        }
+    }
+
+    return fetch('/send_stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream'
+        },
+        body: JSON.stringify({ formdata: message })
+    }).then(response => {
+        if (!response.ok || !response.body) {
+            throw new Error('Request failed with status ' + response.status);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        function pump() {
+            return reader.read().then(({ done, value }) => {
+                if (done) {
+                    if (!finished) fail('Connection closed before the response finished');
+                    return;
+                }
+
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    handleEvent(rawEvent);
+                }
+
+                return pump();
+            });
+        }
+
+        return pump();
+    }).catch(error => fail(error.message));
+}
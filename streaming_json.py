@@ -0,0 +1,176 @@
+"""
+Incremental JSON parsing for streamed LLM output
+StreamingArrayParser is fed text deltas as they arrive and emits every
+element of the watched top-level arrays (e.g. "steps", "questions") as soon
+as it closes. parse_json_response parses a complete response, repairing
+common truncation (cut-off strings, missing closing brackets, trailing
+commas) by keeping everything up to the last complete value.
+"""
+import json
+import re
+from typing import Iterable, List, Optional, Tuple
+
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+
+
+class StreamingArrayParser:
+    """
+    Emit (key, index, element) for each object element of the top-level
+    arrays named in keys, e.g. ('steps', 0, {...}) as soon as it is complete.
+    Text before the first "{" (e.g. "Here is your lesson:") is ignored.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        self.keys = set(keys)
+        self._buffer = []       # Characters from the first "{" on
+        self._stack = []        # Open containers: '{' or '['
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_string = None
+        self._current_key = None  # Last key seen in the top-level object
+        self._array_key = None    # Key of the top-level array we are in
+        self._element_start = None
+        self._counts = {}
+
+    def feed(self, text: str) -> List[Tuple[str, int, dict]]:
+        """Consume a chunk of text; returns the elements completed by it"""
+        completed = []
+        for char in text:
+            if not self._buffer and char != '{':
+                continue
+            self._buffer.append(char)
+            position = len(self._buffer) - 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        self._last_string = ''.join(self._buffer[self._string_start + 1:position])
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = position
+            elif char == ':' and len(self._stack) == 1:
+                self._current_key = self._last_string
+            elif char in '{[':
+                self._stack.append(char)
+                if len(self._stack) == 2 and char == '[':
+                    self._array_key = self._current_key
+                elif len(self._stack) == 3 and char == '{' and self._array_key in self.keys:
+                    self._element_start = position
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if len(self._stack) == 2 and char == '}' and self._element_start is not None:
+                    element = self._parse_element(''.join(self._buffer[self._element_start:position + 1]))
+                    self._element_start = None
+                    if element is not None:
+                        index = self._counts.get(self._array_key, 0)
+                        self._counts[self._array_key] = index + 1
+                        completed.append((self._array_key, index, element))
+                elif len(self._stack) == 1:
+                    self._array_key = None
+        return completed
+
+    @staticmethod
+    def _parse_element(text: str) -> Optional[dict]:
+        try:
+            element = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return element if isinstance(element, dict) else None
+
+    def text(self) -> str:
+        """Everything consumed so far, from the first "{" on"""
+        return ''.join(self._buffer)
+
+
+def repair_truncated_json(text: str, max_depth: int = 2) -> Optional[str]:
+    """
+    Turn a cut-off JSON object into valid JSON by keeping everything up to
+    the last complete value and closing the containers still open there.
+    Only values at most max_depth containers deep count as cut points, so a
+    half-written step is dropped instead of kept without its content.
+    Returns None if there is no object to repair
+    """
+    start = text.find('{')
+    if start < 0:
+        return None
+
+    stack = []
+    in_string = escaped = False
+    safe_end, safe_stack = None, None
+
+    for position in range(start, len(text)):
+        char = text[position]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append(char)
+        elif char in '}]':
+            if not stack:
+                break
+            stack.pop()
+            if len(stack) <= max_depth:
+                safe_end, safe_stack = position + 1, list(stack)
+            if not stack:
+                break  # Top-level object complete
+        elif char == ',' and len(stack) <= max_depth:
+            # Everything before a comma is a complete member/element
+            safe_end, safe_stack = position, list(stack)
+
+    if safe_end is None:
+        return None
+
+    closers = ''.join('}' if opener == '{' else ']' for opener in reversed(safe_stack))
+    return text[start:safe_end] + closers
+
+
+def _loads_object(text: str) -> Optional[dict]:
+    """json.loads that also tolerates trailing commas; None unless the result is an object"""
+    for candidate in (text, _TRAILING_COMMA.sub(r'\1', text)):
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        return data if isinstance(data, dict) else None
+    return None
+
+
+def parse_json_response(response: str, repair: bool = True, max_depth: int = 2) -> Tuple[Optional[dict], bool]:
+    """
+    Parse the JSON object in an LLM response
+    Returns (data, repaired): data is None if nothing could be parsed, and
+    repaired is True when truncation had to be repaired to get it
+    (max_depth as in repair_truncated_json)
+    """
+    json_start = response.find('{')
+    json_end = response.rfind('}') + 1
+    if json_start >= 0 and json_end > json_start:
+        data = _loads_object(response[json_start:json_end])
+        if data is not None:
+            return data, False
+
+    if repair:
+        repaired = repair_truncated_json(_TRAILING_COMMA.sub(r'\1', response), max_depth)
+        if repaired:
+            data = _loads_object(repaired)
+            if data is not None:
+                return data, True
+
+    return None, False
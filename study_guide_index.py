@@ -0,0 +1,157 @@
+"""
+Per-course retrieval over the study guide
+The study guide is split at its "**Topic N:**" headings into chunks, which are
+stored with their term counts when the course is created. Lesson prompts then
+get the chunks most relevant to the task (BM25 over the course's chunks)
+instead of the beginning of the guide.
+"""
+import json
+import math
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List
+
+import db
+from content_library import tokenize
+from prompts import count_tokens
+
+# BM25 parameters (term frequency saturation, length normalization)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Heading terms count this many extra times: a topic's name says what it is about
+HEADING_BOOST = 2
+
+# Chunks scoring below this fraction of the best chunk are left out even within top k
+MIN_RELATIVE_SCORE = 0.35
+
+# Guides without topic headings are split into paragraph groups of about this size
+FALLBACK_CHUNK_TOKENS = 250
+
+# Text before the first topic shorter than this is a greeting, not content
+MIN_PREAMBLE_TOKENS = 30
+
+_TOPIC_HEADING = re.compile(r'^[ \t]*(?:#{1,4}[ \t]*)?\*{0,2}[ \t]*Topic[ \t]+\d+[ \t]*[:.\-]',
+                            re.IGNORECASE | re.MULTILINE)
+
+
+def guide_hash(study_guide: str) -> int:
+    """Fingerprint stored with the chunks, so an edited guide gets re-indexed"""
+    return zlib.crc32(study_guide.encode('utf-8'))
+
+
+def _heading(text: str) -> str:
+    first_line = text.strip().split('\n', 1)[0]
+    return first_line.strip('*# \t')
+
+
+def split_study_guide(study_guide: str) -> List[Dict]:
+    """Split a study guide into [{'heading', 'content'}], one chunk per topic"""
+    starts = [match.start() for match in _TOPIC_HEADING.finditer(study_guide)]
+
+    if starts:
+        preamble = study_guide[:starts[0]]
+        pieces = [preamble] if count_tokens(preamble) >= MIN_PREAMBLE_TOKENS else []
+        pieces += [study_guide[start:end] for start, end in zip(starts, starts[1:] + [len(study_guide)])]
+    else:
+        # No topic structure: group paragraphs into chunks of similar size
+        pieces, current, used = [], [], 0
+        for paragraph in re.split(r'\n\s*\n', study_guide):
+            cost = count_tokens(paragraph)
+            if current and used + cost > FALLBACK_CHUNK_TOKENS:
+                pieces.append('\n\n'.join(current))
+                current, used = [], 0
+            current.append(paragraph)
+            used += cost
+        pieces.append('\n\n'.join(current))
+
+    return [
+        {'heading': _heading(piece), 'content': piece.strip()}
+        for piece in pieces if piece.strip()
+    ]
+
+
+def _term_counts(chunk: Dict) -> Counter:
+    counts = Counter(tokenize(chunk['content']))
+    for term in tokenize(chunk['heading']):
+        counts[term] += HEADING_BOOST
+    return counts
+
+
+# ====================
+# INDEXING
+# ====================
+
+def index_study_guide(course_id: int, study_guide: str) -> List[Dict]:
+    """Split and store a course's study guide; returns the stored chunks"""
+    chunks = split_study_guide(study_guide)
+    for chunk in chunks:
+        counts = _term_counts(chunk)
+        chunk['term_counts'] = json.dumps(counts, separators=(',', ':'))
+        chunk['length'] = sum(counts.values())
+
+    db.replace_study_guide_chunks(course_id, guide_hash(study_guide), chunks)
+    return db.get_study_guide_chunks(course_id)
+
+
+def get_chunks(course_id: int, study_guide: str) -> List[Dict]:
+    """A course's chunks, (re)indexing courses created before the index or whose guide changed"""
+    chunks = db.get_study_guide_chunks(course_id)
+    if not chunks or chunks[0]['guide_hash'] != guide_hash(study_guide):
+        chunks = index_study_guide(course_id, study_guide)
+    return chunks
+
+
+# ====================
+# RETRIEVAL
+# ====================
+
+def rank_chunks(chunks: List[Dict], query: str, k: int) -> List[Dict]:
+    """Top k chunks for query by BM25 (only chunks sharing a term with it), in guide order"""
+    # Bare numbers ("Week 2", "Day 14") would only match topic numbers
+    query_terms = {term for term in tokenize(query) if not term.isdigit()}
+    if not chunks or not query_terms or k <= 0:
+        return []
+
+    counts = [json.loads(chunk['term_counts']) for chunk in chunks]
+    average_length = sum(chunk['length'] for chunk in chunks) / len(chunks) or 1.0
+
+    scores = []
+    for position, (chunk, terms) in enumerate(zip(chunks, counts)):
+        score = 0.0
+        for term in query_terms:
+            frequency = terms.get(term)
+            if not frequency:
+                continue
+            document_frequency = sum(1 for other in counts if term in other)
+            idf = math.log(1 + (len(chunks) - document_frequency + 0.5) / (document_frequency + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * chunk['length'] / average_length)
+            score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        if score > 0:
+            scores.append((score, position))
+
+    if not scores:
+        return []
+
+    top = sorted(scores, reverse=True)[:k]
+    cutoff = top[0][0] * MIN_RELATIVE_SCORE
+    return [chunks[position] for score, position in sorted(top, key=lambda item: item[1]) if score >= cutoff]
+
+
+def select_context(course: Dict, queries: List[str], k: int) -> str:
+    """
+    Study guide text for a prompt: the top k chunks for each query (one per
+    task in a batch), in guide order. Falls back to the first k chunks when
+    nothing matches (e.g. "Week 2 Review").
+    """
+    chunks = get_chunks(course['id'], course['study_guide'])
+
+    selected = {}
+    for query in queries:
+        for chunk in rank_chunks(chunks, query, k):
+            selected[chunk['chunk_index']] = chunk
+    if not selected:
+        selected = {chunk['chunk_index']: chunk for chunk in chunks[:k]}
+
+    return '\n\n'.join(selected[index]['content'] for index in sorted(selected))
@@ -0,0 +1,279 @@
+"""
+LLM call telemetry
+funcs.chat records one LLMCall per request (call site, model, queue wait,
+time to first byte, duration, tokens, retries, outcome). Calls feed in-process
+counters and histograms rendered in Prometheus text format for /metrics, and
+can optionally be appended to a SQLite table by a background writer thread.
+"""
+import contextvars
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0)
+QUEUE_WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Outcomes of calls that never reached the API (no latency or cost to record)
+NO_UPSTREAM_OUTCOMES = {'cache_hit', 'stale_cache_hit', 'rejected'}
+
+# Set by funcs.run_llm_task when a call waited for a concurrency slot
+_queued_at = contextvars.ContextVar('llm_queued_at', default=None)
+
+
+def set_queued_at(queued_at: float) -> contextvars.Token:
+    """Remember when the current LLM task started waiting; returns a token for reset_queued_at"""
+    return _queued_at.set(queued_at)
+
+
+def reset_queued_at(token: contextvars.Token):
+    _queued_at.reset(token)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+# ====================
+# METRIC TYPES
+# ====================
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str]):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, labels: Tuple, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value:g}')
+        return '\n'.join(lines)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels: Tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        names = self.labelnames + ('le',)
+        for labels, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{_format_labels(names, labels + (f"{bound:g}",))} {count}')
+            lines.append(f'{self.name}_bucket{_format_labels(names, labels + ("+Inf",))} {series[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]:g}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}')
+        return '\n'.join(lines)
+
+
+# ====================
+# LLM CALL RECORDS
+# ====================
+
+class LLMCall:
+    """Measurements of one chat request, filled in by funcs.chat / chat_stream"""
+
+    __slots__ = ('telemetry', 'call_site', 'model', 'tier', 'started', 'queue_wait', 'ttfb',
+                 'prompt_tokens', 'completion_tokens', 'retries', 'finished')
+
+    def __init__(self, telemetry: 'LLMTelemetry', call_site: str, model: str, tier: str):
+        self.telemetry = telemetry
+        self.call_site = call_site
+        self.model = model
+        self.tier = tier
+        self.started = time.monotonic()
+        self.ttfb = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.retries = 0
+        self.finished = False
+
+        # Only the first call of a queued task waited; later calls in the same task didn't
+        queued_at = _queued_at.get()
+        self.queue_wait = None
+        if queued_at is not None:
+            self.queue_wait = max(self.started - queued_at, 0.0)
+            _queued_at.set(None)
+
+    def mark_first_byte(self):
+        if self.ttfb is None:
+            self.ttfb = time.monotonic() - self.started
+
+    def add_retry(self):
+        self.retries += 1
+
+    def set_usage(self, usage: Optional[Dict]):
+        """Take token counts from an API usage block"""
+        if usage:
+            self.prompt_tokens = usage.get('prompt_tokens')
+            self.completion_tokens = usage.get('completion_tokens')
+
+    def finish(self, outcome: str):
+        """
+        Record the call once; outcome is 'success', 'error', 'cancelled',
+        'cache_hit', or 'rejected' / 'stale_cache_hit' when the upstream guard
+        failed it fast (without / with a stale cached answer)
+        """
+        if self.finished:
+            return
+        self.finished = True
+        self.telemetry.record(self, outcome, time.monotonic() - self.started)
+
+
+class LLMTelemetry:
+    """Registry of LLM call metrics plus the optional SQLite sink"""
+
+    def __init__(self, enabled: bool = True, price_per_million_tokens: float = 0.0,
+                 sink_path: Optional[str] = None):
+        self.enabled = enabled
+        self.price_per_million_tokens = price_per_million_tokens
+        self.sink_path = sink_path
+
+        self._lock = threading.Lock()
+        labels = ('call_site', 'model')
+        self.requests = Counter('oleg_llm_requests_total', 'LLM calls by outcome', labels + ('outcome',))
+        self.retries = Counter('oleg_llm_retries_total', 'Retried upstream attempts', labels)
+        self.tokens = Counter('oleg_llm_tokens_total', 'Tokens reported by the API usage block', labels + ('kind',))
+        self.cost = Counter('oleg_llm_cost_usd_total', 'Estimated spend in USD', labels)
+        self.duration = Histogram('oleg_llm_request_duration_seconds', 'Total call duration',
+                                  labels, LATENCY_BUCKETS)
+        self.ttfb = Histogram('oleg_llm_time_to_first_byte_seconds',
+                              'Time to the first streamed token (to the full body when not streaming)',
+                              labels, LATENCY_BUCKETS)
+        self.queue_wait = Histogram('oleg_llm_queue_wait_seconds', 'Time waiting for a concurrency slot',
+                                    labels, QUEUE_WAIT_BUCKETS)
+        self.tier_duration = Histogram('oleg_llm_tier_request_duration_seconds', 'Total call duration by model tier',
+                                       ('tier',), LATENCY_BUCKETS)
+        self.tier_ttfb = Histogram('oleg_llm_tier_time_to_first_byte_seconds', 'Time to first byte by model tier',
+                                   ('tier',), LATENCY_BUCKETS)
+        self.fallbacks = Counter('oleg_llm_model_fallbacks_total', 'Calls retried on a fallback model tier',
+                                 ('call_site', 'from_tier', 'to_tier'))
+        self._metrics = [self.requests, self.retries, self.tokens, self.cost,
+                         self.duration, self.ttfb, self.queue_wait,
+                         self.tier_duration, self.tier_ttfb, self.fallbacks]
+
+        self._sink_queue = None
+        if enabled and sink_path:
+            self._sink_queue = queue.Queue(maxsize=10000)
+            threading.Thread(target=self._sink_worker, name='llm-telemetry-sink', daemon=True).start()
+
+    def start_call(self, call_site: Optional[str], model: str, tier: Optional[str] = None) -> LLMCall:
+        return LLMCall(self, call_site or 'unknown', model, tier or 'unrouted')
+
+    def record_fallback(self, call_site: Optional[str], from_tier: Optional[str], to_tier: Optional[str]):
+        """A failed call is being retried on the next tier of its fallback chain"""
+        if self.enabled:
+            with self._lock:
+                self.fallbacks.inc((call_site or 'unknown', from_tier or 'unrouted', to_tier or 'unrouted'))
+
+    def record(self, call: LLMCall, outcome: str, duration: float):
+        if not self.enabled:
+            return
+
+        labels = (call.call_site, call.model)
+        tokens = (call.prompt_tokens or 0) + (call.completion_tokens or 0)
+        cost = tokens * self.price_per_million_tokens / 1_000_000 if outcome not in NO_UPSTREAM_OUTCOMES else 0.0
+
+        with self._lock:
+            self.requests.inc(labels + (outcome,))
+            if outcome not in NO_UPSTREAM_OUTCOMES:
+                self.duration.observe(labels, duration)
+                self.tier_duration.observe((call.tier,), duration)
+            if call.ttfb is not None:
+                self.ttfb.observe(labels, call.ttfb)
+                self.tier_ttfb.observe((call.tier,), call.ttfb)
+            if call.queue_wait is not None:
+                self.queue_wait.observe(labels, call.queue_wait)
+            if call.retries:
+                self.retries.inc(labels, call.retries)
+            if call.prompt_tokens:
+                self.tokens.inc(labels + ('prompt',), call.prompt_tokens)
+            if call.completion_tokens:
+                self.tokens.inc(labels + ('completion',), call.completion_tokens)
+            if cost:
+                self.cost.inc(labels, cost)
+
+        if self._sink_queue is not None:
+            try:
+                self._sink_queue.put_nowait((
+                    time.time(), call.call_site, call.model, outcome, call.queue_wait, call.ttfb,
+                    duration, call.prompt_tokens, call.completion_tokens, call.retries, cost
+                ))
+            except queue.Full:
+                pass  # Never slow down a request for telemetry
+
+    def render_prometheus(self) -> str:
+        """All metrics in Prometheus text exposition format"""
+        with self._lock:
+            return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+    def _sink_worker(self):
+        """Append queued call records to SQLite in batches"""
+        conn = sqlite3.connect(self.sink_path)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_calls (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   ts REAL NOT NULL,
+                   call_site TEXT NOT NULL,
+                   model TEXT NOT NULL,
+                   outcome TEXT NOT NULL,
+                   queue_wait REAL,
+                   ttfb REAL,
+                   duration REAL,
+                   prompt_tokens INTEGER,
+                   completion_tokens INTEGER,
+                   retries INTEGER,
+                   cost_usd REAL
+               )"""
+        )
+        conn.commit()
+
+        while True:
+            rows = [self._sink_queue.get()]
+            while len(rows) < 500:
+                try:
+                    rows.append(self._sink_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                conn.executemany(
+                    """INSERT INTO llm_calls
+                       (ts, call_site, model, outcome, queue_wait, ttfb, duration,
+                        prompt_tokens, completion_tokens, retries, cost_usd)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    rows
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing LLM telemetry: {e}")
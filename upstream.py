@@ -0,0 +1,482 @@
+"""
+Upstream protection for LLM calls
+An AIMD concurrency limiter bounds how many calls are in flight to the LLM
+API at once: the limit grows by one per window of successful calls and is
+cut multiplicatively on 429/5xx/timeouts or when responses slow down. A
+circuit breaker in front of it fails calls fast while the upstream keeps
+failing, so Flask workers aren't tied up waiting on it and DB-only pages
+stay responsive during an incident.
+
+Calls waiting for a slot are served by priority class (interactive, standard,
+background) with weighted-fair sharing and aging, so chat replies stay fast
+while courses are being generated in bulk.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class UpstreamUnavailable(RuntimeError):
+    """Raised instead of calling the LLM API when it is unhealthy or saturated"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# ====================
+# PRIORITY CLASSES
+# ====================
+
+INTERACTIVE, STANDARD, BACKGROUND = 'interactive', 'standard', 'background'
+PRIORITIES = (INTERACTIVE, STANDARD, BACKGROUND)
+
+# Relative share of freed slots per class while several classes are waiting
+DEFAULT_PRIORITY_WEIGHTS = {INTERACTIVE: 8, STANDARD: 3, BACKGROUND: 1}
+
+_priority = contextvars.ContextVar('llm_priority', default=STANDARD)
+
+
+def current_priority() -> str:
+    """Priority class of LLM calls made from the current context"""
+    return _priority.get()
+
+
+@contextmanager
+def priority_scope(priority: str):
+    """Run LLM calls inside the block with the given priority class"""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority: {priority}")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _Waiter:
+    __slots__ = ('priority', 'enqueued', 'granted')
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+# ====================
+# CONCURRENCY LIMITER
+# ====================
+
+class AdaptiveLimiter:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit
+    Congestion is a failed attempt (rate limit, 5xx, timeout) or a call whose
+    seconds per completion token exceed latency_tolerance x the baseline of
+    its model. Token-normalized latency keeps short and long generations
+    comparable; per-model baselines keep small and large models apart.
+
+    When all slots are busy, freed slots go to waiting classes in proportion
+    to their weights (stride scheduling). Background calls never hold more
+    than background_share of the limit, and any call waiting longer than
+    max_wait is served next regardless of class, so nothing starves.
+    """
+
+    # At most one decrease per interval, so a burst of simultaneous 429s counts once
+    DECREASE_INTERVAL = 1.0
+    # Latency samples needed before the baseline is trusted
+    MIN_LATENCY_SAMPLES = 10
+
+    def __init__(self, initial_limit: int, min_limit: int = 1, max_limit: int = 10,
+                 backoff_ratio: float = 0.7, latency_tolerance: float = 2.0,
+                 weights: Optional[Dict[str, float]] = None, max_wait: float = 10.0,
+                 background_share: float = 0.5):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.weights = dict(DEFAULT_PRIORITY_WEIGHTS, **(weights or {}))
+        self.max_wait = max_wait
+        self.background_share = background_share
+
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._last_decrease = 0.0
+        self._baselines = {}  # Latency key (model) -> seconds per completion token of a healthy call
+        self._samples = {}
+        self._counters = {'increases': 0, 'decreases': 0, 'queue_timeouts': 0}
+
+        self._queues = {priority: deque() for priority in PRIORITIES}
+        self._pass = {priority: 0.0 for priority in PRIORITIES}  # Stride scheduling position
+        self._class_stats = {
+            priority: {'in_flight': 0, 'granted': 0, 'aged': 0, 'timeouts': 0, 'wait_seconds': 0.0}
+            for priority in PRIORITIES
+        }
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self, timeout: float, priority: Optional[str] = None) -> str:
+        """
+        Wait for a free slot; raises UpstreamUnavailable after timeout seconds
+        priority defaults to the current priority_scope. Returns the class the
+        slot was granted to (pass it to release).
+        """
+        priority = priority or current_priority()
+        waiter = _Waiter(priority)
+        deadline = waiter.enqueued + timeout
+
+        with self._condition:
+            queue = self._queues[priority]
+            if not queue:
+                # A class that was idle starts level with the busiest waiting class
+                # instead of spending the credit it "saved" while idle
+                waiting = [self._pass[p] for p in PRIORITIES if self._queues[p]]
+                if waiting:
+                    self._pass[priority] = max(self._pass[priority], min(waiting))
+            queue.append(waiter)
+            self._dispatch()
+
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.remove(waiter)
+                    self._counters['queue_timeouts'] += 1
+                    self._class_stats[priority]['timeouts'] += 1
+                    raise UpstreamUnavailable(
+                        f"LLM upstream is at its concurrency limit ({int(self._limit)} calls in flight)",
+                        retry_after=timeout
+                    )
+                self._condition.wait(remaining)
+
+            self._class_stats[priority]['wait_seconds'] += time.monotonic() - waiter.enqueued
+        return priority
+
+    def release(self, priority: str = STANDARD):
+        with self._condition:
+            self._in_flight -= 1
+            self._class_stats[priority]['in_flight'] -= 1
+            self._dispatch()
+
+    def _background_cap(self) -> int:
+        return max(int(self._limit * self.background_share), 1)
+
+    def _next_class(self, now: float) -> Optional[str]:
+        """Class whose oldest waiter gets the next free slot (lock held)"""
+        waiting = [p for p in PRIORITIES if self._queues[p]]
+        if not waiting:
+            return None
+
+        # Starvation protection: anything that waited too long goes first, oldest first
+        aged = [p for p in waiting if now - self._queues[p][0].enqueued >= self.max_wait]
+        if aged:
+            priority = min(aged, key=lambda p: self._queues[p][0].enqueued)
+            self._class_stats[priority]['aged'] += 1
+            return priority
+
+        if self._class_stats[BACKGROUND]['in_flight'] >= self._background_cap():
+            waiting = [p for p in waiting if p != BACKGROUND]
+            if not waiting:
+                return None
+
+        priority = min(waiting, key=lambda p: (self._pass[p], PRIORITIES.index(p)))
+        self._pass[priority] += 1.0 / self.weights[priority]
+        return priority
+
+    def _dispatch(self):
+        """Hand free slots to waiters (lock held)"""
+        granted = False
+        now = time.monotonic()
+        while self._in_flight < int(self._limit):
+            priority = self._next_class(now)
+            if priority is None:
+                break
+            waiter = self._queues[priority].popleft()
+            waiter.granted = True
+            self._in_flight += 1
+            self._class_stats[priority]['in_flight'] += 1
+            self._class_stats[priority]['granted'] += 1
+            granted = True
+        if granted:
+            self._condition.notify_all()
+
+    def on_success(self, seconds_per_token: Optional[float] = None, key: str = ''):
+        """A call succeeded; grow the limit unless it was abnormally slow for its model (key)"""
+        with self._condition:
+            if seconds_per_token is not None and seconds_per_token > 0:
+                samples = self._samples[key] = self._samples.get(key, 0) + 1
+                baseline = self._baselines.get(key)
+                if baseline is None or seconds_per_token < baseline:
+                    baseline = seconds_per_token
+                else:
+                    # Drift up slowly so a permanently slower model resets the baseline
+                    baseline += (seconds_per_token - baseline) * 0.01
+                self._baselines[key] = baseline
+
+                if (samples >= self.MIN_LATENCY_SAMPLES
+                        and seconds_per_token > baseline * self.latency_tolerance):
+                    self._decrease()
+                    return
+
+            # Only grow while the limit is actually being used
+            if self._in_flight >= self._limit / 2 and self._limit < self.max_limit:
+                previous = int(self._limit)
+                self._limit = min(self._limit + 1.0 / self._limit, float(self.max_limit))
+                if int(self._limit) > previous:
+                    self._counters['increases'] += 1
+                    self._dispatch()
+
+    def on_congestion(self):
+        """An attempt was rate limited, failed with 5xx or timed out"""
+        with self._condition:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        self._limit = max(self._limit * self.backoff_ratio, float(self.min_limit))
+        self._counters['decreases'] += 1
+
+    def status(self) -> Dict:
+        with self._condition:
+            return {
+                'limit': int(self._limit),
+                'in_flight': self._in_flight,
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'baseline_seconds_per_token': dict(self._baselines),
+                **self._counters,
+                'classes': {
+                    priority: {
+                        'queue_depth': len(self._queues[priority]),
+                        **{key: round(value, 3) if isinstance(value, float) else value
+                           for key, value in self._class_stats[priority].items()}
+                    }
+                    for priority in PRIORITIES
+                }
+            }
+
+
+# ====================
+# CIRCUIT BREAKER
+# ====================
+
+class CircuitBreaker:
+    """
+    closed: calls pass; failure_threshold consecutive failures open the circuit
+    open: calls fail fast until reset_timeout has passed
+    half_open: one probe call is let through; success closes, failure re-opens
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = 6, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._counters = {'opened': 0, 'rejected': 0}
+
+    def before_call(self) -> bool:
+        """
+        Raise UpstreamUnavailable if calls aren't allowed right now
+        Returns True when this call is the half-open probe
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self._counters['rejected'] += 1
+                    raise UpstreamUnavailable(
+                        "LLM upstream is unavailable (circuit open)", retry_after=remaining
+                    )
+                self._state = self.HALF_OPEN
+
+            if self._state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self._counters['rejected'] += 1
+                    raise UpstreamUnavailable(
+                        "LLM upstream is recovering (probe call in flight)", retry_after=1.0
+                    )
+                self._probe_in_flight = True
+                return True
+
+            return False
+
+    def allows_retry(self) -> bool:
+        """Whether a call already in progress may retry (not once the circuit opened)"""
+        with self._lock:
+            return self._state != self.OPEN
+
+    def on_success(self, probe: bool):
+        with self._lock:
+            self._failures = 0
+            if probe:
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                print("LLM upstream circuit closed")
+
+    def on_failure(self, probe: bool):
+        with self._lock:
+            self._failures += 1
+            if probe:
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or (
+                    self._state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._counters['opened'] += 1
+                print(f"LLM upstream circuit opened after {self._failures} consecutive failures")
+
+    def release_probe(self, probe: bool):
+        """A probe call ended without a verdict (e.g. cancelled); let the next one through"""
+        if probe:
+            with self._lock:
+                self._probe_in_flight = False
+
+    def status(self) -> Dict:
+        with self._lock:
+            status = {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                **self._counters
+            }
+            if self._state == self.OPEN:
+                status['retry_after'] = max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+            return status
+
+
+# ====================
+# GUARD
+# ====================
+
+class UpstreamSlot:
+    """One admitted call; report each failed attempt and the final success on it"""
+
+    def __init__(self, guard: 'UpstreamGuard', probe: bool, latency_key: str = ''):
+        self.guard = guard
+        self.probe = probe
+        self.latency_key = latency_key
+        self.started = time.monotonic()
+        self.outcome = None
+
+    def failure(self, congestion: bool = True):
+        """
+        A failed attempt; congestion=False for failures that don't say the
+        upstream is overloaded (e.g. a dropped connection mid-stream)
+        """
+        self.outcome = 'failure'
+        self.guard.breaker.on_failure(self.probe)
+        self.probe = False  # The probe's verdict is in
+        if congestion:
+            self.guard.limiter.on_congestion()
+
+    def success(self, completion_tokens: Optional[int] = None):
+        self.outcome = 'success'
+        seconds_per_token = None
+        if completion_tokens:
+            seconds_per_token = (time.monotonic() - self.started) / completion_tokens
+        self.guard.breaker.on_success(self.probe)
+        self.probe = False
+        self.guard.limiter.on_success(seconds_per_token, self.latency_key)
+
+    def allows_retry(self) -> bool:
+        return self.guard.breaker.allows_retry()
+
+
+class UpstreamGuard:
+    """Circuit breaker + adaptive limiter in front of every LLM API call"""
+
+    def __init__(self, limiter: AdaptiveLimiter, breaker: CircuitBreaker,
+                 queue_timeout: float = 30.0, enabled: bool = True):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+        self._fallbacks = 0
+
+    @contextmanager
+    def slot(self, priority: Optional[str] = None, latency_key: str = ''):
+        """
+        Admit one call (raises UpstreamUnavailable when it must fail fast)
+        priority defaults to the current priority_scope; latency_key (the
+        model) selects the latency baseline the call is compared against
+        """
+        if not self.enabled:
+            yield UpstreamSlot(self, probe=False, latency_key=latency_key)
+            return
+
+        probe = self.breaker.before_call()
+        try:
+            priority = self.limiter.acquire(self.queue_timeout, priority)
+        except UpstreamUnavailable:
+            self.breaker.release_probe(probe)
+            raise
+
+        slot = UpstreamSlot(self, probe, latency_key)
+        try:
+            yield slot
+        finally:
+            self.breaker.release_probe(slot.probe)
+            self.limiter.release(priority)
+
+    def record_fallback(self):
+        """A rejected call was answered from the cache instead"""
+        self._fallbacks += 1
+
+    def status(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'circuit': self.breaker.status(),
+            'limiter': self.limiter.status(),
+            'stale_fallbacks': self._fallbacks
+        }
+
+    def render_prometheus(self) -> str:
+        """Limiter and breaker state in Prometheus text format"""
+        status = self.status()
+        circuit, limiter = status['circuit'], status['limiter']
+        state_value = {'closed': 0, 'half_open': 1, 'open': 2}[circuit['state']]
+        metrics = [
+            ('oleg_llm_upstream_concurrency_limit', 'gauge', 'Current adaptive concurrency limit', limiter['limit']),
+            ('oleg_llm_upstream_in_flight', 'gauge', 'LLM calls currently in flight', limiter['in_flight']),
+            ('oleg_llm_upstream_circuit_state', 'gauge', 'Circuit state (0 closed, 1 half open, 2 open)', state_value),
+            ('oleg_llm_upstream_circuit_opened_total', 'counter', 'Times the circuit opened', circuit['opened']),
+            ('oleg_llm_upstream_rejected_total', 'counter', 'Calls failed fast by the open circuit', circuit['rejected']),
+            ('oleg_llm_upstream_queue_timeouts_total', 'counter', 'Calls that timed out waiting for a slot',
+             limiter['queue_timeouts']),
+            ('oleg_llm_upstream_limit_decreases_total', 'counter', 'Multiplicative limit decreases',
+             limiter['decreases']),
+            ('oleg_llm_upstream_stale_fallbacks_total', 'counter', 'Rejected calls answered from expired cache entries',
+             status['stale_fallbacks']),
+        ]
+        per_class = [
+            ('oleg_llm_upstream_queue_depth', 'gauge', 'Calls waiting for a slot by priority class', 'queue_depth'),
+            ('oleg_llm_upstream_class_in_flight', 'gauge', 'LLM calls in flight by priority class', 'in_flight'),
+            ('oleg_llm_upstream_granted_total', 'counter', 'Slots granted by priority class', 'granted'),
+            ('oleg_llm_upstream_aged_total', 'counter', 'Slots granted to a call that waited past max_wait', 'aged'),
+            ('oleg_llm_upstream_class_queue_timeouts_total', 'counter', 'Queue timeouts by priority class',
+             'timeouts'),
+            ('oleg_llm_upstream_queue_wait_seconds_total', 'counter', 'Total time spent waiting for a slot',
+             'wait_seconds'),
+        ]
+        lines = []
+        for name, kind, help_text, value in metrics:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+        for name, kind, help_text, key in per_class:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for priority, stats in limiter['classes'].items():
+                lines.append(f'{name}{{priority="{priority}"}} {stats[key]:g}')
+        return '\n'.join(lines) + '\n'